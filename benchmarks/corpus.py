@@ -0,0 +1,104 @@
+"""
+Deterministic generator for synthetic diary corpora used by the benchmarks.
+"""
+
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+SENTENCES = (
+    "今日は朝から雨が降っていた。",
+    "駅前の喫茶店でコーヒーを飲んだ。",
+    "仕事の打ち合わせが長引いて疲れた。",
+    "夕方に公園を散歩した。",
+    "久しぶりに友人と電話で話した。",
+    "新しい本を読み始めた。",
+    "夜は早めに寝ることにする。",
+    "Meeting notes were shared with the team.",
+    "Went for a 5km run before breakfast.",
+    "明日の予定を確認しておく。",
+)
+TAGS = ("仕事", "家族", "読書", "運動", "旅行", "料理")
+TXT_ENCODINGS = ("utf-8", "shift-jis", "euc-jp", "iso-2022-jp")
+
+
+def _body(rnd: random.Random) -> str:
+    paragraphs = []
+    for _ in range(rnd.randint(2, 12)):
+        paragraphs.append("".join(rnd.choices(SENTENCES, k=rnd.randint(2, 8))))
+    return "\n\n".join(paragraphs)
+
+
+def _date_text(rnd: random.Random, day: date) -> str:
+    style = rnd.randrange(4)
+    if style == 0:
+        return day.isoformat()
+    if style == 1:
+        return f"{day.year}年{day.month}月{day.day}日"
+    if style == 2:
+        return day.strftime("%Y/%m/%d")
+    return f"{day:%m/%d/%Y}"
+
+
+def _diary(rnd: random.Random, index: int) -> tuple[str, str]:
+    """
+    Returns the file stem and Markdown content of one diary entry.
+    """
+    day = date(2015, 1, 1) + timedelta(days=rnd.randrange(10 * 365))
+    kind = rnd.randrange(4)
+    body = _body(rnd)
+    if kind == 0:
+        # 日付がファイル名だけにある
+        return f"{day:%Y%m%d}_{rnd.randrange(2400):04d}", body
+    if kind == 1:
+        return f"{day:%Y%m%d}", f"# {day.month}月{day.day}日\n\n{body}"
+    frontmatter = (
+        "---\n"
+        f"created: {day.isoformat()}\n"
+        f"happiness score: {rnd.randint(1, 5)}\n"
+        f"tags: [{', '.join(rnd.sample(TAGS, k=rnd.randint(1, 3)))}]\n"
+        "---\n"
+    )
+    if kind == 2:
+        return f"memo_{index:06d}", f"{frontmatter}{body}"
+    # 日付が本文の中にある
+    return f"日記_{index:06d}", f"{_date_text(rnd, day)}\n\n{body}"
+
+
+def generate_corpus(folder: str | Path, count: int, seed: int = 0) -> list[Path]:
+    """
+    Write `count` Markdown diary files into folder, 1000 per subfolder.
+    """
+    folder = Path(folder)
+    rnd = random.Random(seed)
+    paths = []
+    used: set[Path] = set()
+    for index in range(count):
+        stem, content = _diary(rnd, index)
+        subfolder = folder / f"{index // 1000:03d}"
+        subfolder.mkdir(parents=True, exist_ok=True)
+        path = subfolder / f"{stem}.md"
+        if path in used:
+            # 同期ツールが作る競合コピーのような名前にする
+            path = subfolder / f"{stem} ({index}).md"
+        used.add(path)
+        path.write_text(content, encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+def generate_txt_corpus(folder: str | Path, count: int, seed: int = 0) -> list[Path]:
+    """
+    Write `count` .txt diary files in a mix of Japanese encodings.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rnd = random.Random(seed)
+    paths = []
+    for index in range(count):
+        stem, content = _diary(rnd, index)
+        encoding = TXT_ENCODINGS[index % len(TXT_ENCODINGS)]
+        path = folder / f"{stem}_{index:06d}.txt"
+        path.write_bytes(content.replace("\n", "\r\n").encode(encoding))
+        paths.append(path)
+    return paths
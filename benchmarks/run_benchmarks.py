@@ -0,0 +1,311 @@
+"""
+Time krapp's hot paths on synthetic corpora and write the results as JSON.
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --output results.json
+    python benchmarks/run_benchmarks.py --sizes 1000 --compare results.json
+
+Each benchmark reports the best of --repeat runs in seconds, plus the
+number of items it processed, so runs of different sizes can be compared.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from corpus import generate_corpus, generate_txt_corpus
+from sqlalchemy import text
+
+from krapp.date_extractor import DateExtractor
+from krapp.diary_organizer import DiaryOrganizer
+from krapp.text_db_manager import TextDBManager
+from krapp.txt2md import Txt2MdConverter
+from krapp.yaml_frontmatter_parser import YamlFrontmatterParser
+
+
+def measure(
+    fn: Callable[[], object],
+    repeat: int,
+    setup: Callable[[], object] | None = None,
+) -> float:
+    """
+    Best wall time of `repeat` runs. setup runs before each run, untimed.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        # 取り込み中のログ出力は計測に含めない
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def reset(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+    # 前の実行で残った WAL を新しいデータベースに適用させない
+    for suffix in ("-wal", "-shm"):
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+
+def db_size(path: Path) -> int:
+    """
+    Bytes on disk of a SQLite database, including a WAL not yet merged.
+    """
+    wal = path.with_name(path.name + "-wal")
+    return path.stat().st_size + (wal.stat().st_size if wal.exists() else 0)
+
+
+def run_size(size: int, work_dir: Path, repeat: int, seed: int) -> list[dict]:
+    texts = work_dir / f"texts_{size}"
+    md_paths = generate_corpus(texts, size, seed=seed)
+    txt_folder = work_dir / f"txt_{size}"
+    generate_txt_corpus(txt_folder, size, seed=seed)
+    contents = [path.read_text(encoding="utf-8") for path in md_paths]
+    results = []
+
+    def record(name: str, seconds: float, items: int, **extra) -> None:
+        results.append(
+            {
+                "name": name,
+                "size": size,
+                "items": items,
+                "seconds": seconds,
+                "items_per_second": items / seconds if seconds else None,
+                **extra,
+            }
+        )
+        details = "".join(f"  {key}={value}" for key, value in extra.items())
+        print(f"{size:>7} {name:<40} {seconds:9.4f}s{details}")
+
+    extractor = DateExtractor()
+    record(
+        "DateExtractor.extract_dates",
+        measure(lambda: [extractor.extract_dates(c) for c in contents], repeat),
+        len(contents),
+    )
+    parser = YamlFrontmatterParser()
+    record(
+        "YamlFrontmatterParser.parse",
+        measure(lambda: [parser.parse(c) for c in contents], repeat),
+        len(contents),
+    )
+
+    db_path = work_dir / f"texts_{size}.db"
+
+    def build_db(concurrency: int | None = None) -> None:
+        db = TextDBManager(
+            folder_path=texts,
+            date_extractor=extractor,
+            yaml_parser=parser,
+            db_path=db_path,
+        )
+        db.process_folder(concurrency=concurrency)
+        db.close()
+
+    record(
+        "TextDBManager.process_folder (asyncio)",
+        measure(lambda: build_db(16), repeat, setup=lambda: reset(db_path)),
+        size,
+        concurrency=16,
+    )
+    record(
+        "TextDBManager.process_folder",
+        measure(build_db, repeat, setup=lambda: reset(db_path)),
+        size,
+    )
+    record("TextDBManager.process_folder (unchanged)", measure(build_db, repeat), size)
+
+    db = TextDBManager(db_path=db_path)
+    years = db.get_all_years()
+    months = [(year, month) for year in years for month in db.get_months_in_year(year)]
+    record("TextDBManager.get_all_years", measure(db.get_all_years, repeat), 1)
+    record(
+        "TextDBManager.get_months_in_year",
+        measure(lambda: [db.get_months_in_year(year) for year in years], repeat),
+        len(years),
+    )
+    record(
+        "TextDBManager.get_entries_by_year_month",
+        measure(
+            lambda: [db.get_entries_by_year_month(y, m) for y, m in months], repeat
+        ),
+        len(months),
+    )
+    record(
+        "TextDBManager.iter_entries_by_year_month",
+        measure(
+            lambda: [list(db.iter_entries_by_year_month(y, m)) for y, m in months],
+            repeat,
+        ),
+        len(months),
+    )
+    record(
+        "TextDBManager.list_entries_by_year_month",
+        measure(
+            lambda: [db.list_entries_by_year_month(y, m) for y, m in months], repeat
+        ),
+        len(months),
+    )
+    record(
+        "TextDBManager.search",
+        measure(lambda: db.search("公園を散歩"), repeat),
+        1,
+    )
+    db.close()
+
+    # 本文を圧縮したときのデータベースの大きさと月表示の速さ
+    for compression in (None, "zlib", "lzma"):
+        label = compression or "none"
+        compressed_path = work_dir / f"texts_{size}_{label}.db"
+        reset(compressed_path)
+        db = TextDBManager(
+            folder_path=texts, db_path=compressed_path, compression=compression
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.process_folder()
+        db.session.execute(text("VACUUM"))
+        # データベースは WAL モードなので、VACUUM の結果を本体のファイルに書き戻す
+        db.session.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        record(
+            f"month view (compression={label})",
+            measure(
+                lambda: [list(db.iter_entries_by_year_month(y, m)) for y, m in months],
+                repeat,
+            ),
+            len(months),
+            db_bytes=db_size(compressed_path),
+        )
+        db.close()
+
+    md_folder = work_dir / f"md_{size}"
+    record(
+        "Txt2MdConverter.convert_txt_to_md",
+        measure(
+            lambda: Txt2MdConverter().convert_txt_to_md(txt_folder, md_folder),
+            repeat,
+            setup=lambda: reset(md_folder),
+        ),
+        size,
+    )
+
+    organized = work_dir / f"organized_{size}"
+    organizer = DiaryOrganizer(date_extractor=extractor)
+
+    def organize() -> None:
+        for path in md_paths:
+            try:
+                organizer.organize_diary(path, organized)
+            except ValueError:
+                continue
+
+    record(
+        "DiaryOrganizer.organize_diary",
+        measure(organize, repeat, setup=lambda: reset(organized)),
+        size,
+    )
+    return results
+
+
+def run_startup(repeat: int) -> list[dict]:
+    """
+    Time how long the CLI takes to start, which does not depend on the corpus.
+    """
+    results = []
+    for args in (["--help"], ["show-config"]):
+        name = f"krapp {' '.join(args)} (startup)"
+        seconds = measure(
+            lambda: subprocess.run(
+                [sys.executable, "-m", "krapp.cli", *args],
+                capture_output=True,
+                check=True,
+            ),
+            repeat,
+        )
+        results.append(
+            {
+                "name": name,
+                "size": 0,
+                "items": 1,
+                "seconds": seconds,
+                "items_per_second": 1 / seconds if seconds else None,
+            }
+        )
+        print(f"{0:>7} {name:<40} {seconds:9.4f}s")
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], previous_path: Path) -> None:
+    previous = json.loads(previous_path.read_text(encoding="utf-8"))
+    baseline = {(r["name"], r["size"]): r["seconds"] for r in previous["results"]}
+    print(f"\nCompared with {previous_path} ({previous.get('revision')}):")
+    for result in results:
+        before = baseline.get((result["name"], result["size"]))
+        if before:
+            ratio = result["seconds"] / before
+            print(f"{result['size']:>7} {result['name']:<40} {ratio:6.2f}x")
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[1000])
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", type=Path, help="JSON file to write")
+    arg_parser.add_argument("--compare", type=Path, help="previous JSON results")
+    arg_parser.add_argument(
+        "--work-dir", type=Path, help="where corpora are generated (default: tmp)"
+    )
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = args.work_dir or Path(tmp)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        results = run_startup(args.repeat)
+        for size in args.sizes:
+            results.extend(run_size(size, work_dir, args.repeat, args.seed))
+
+    report = {
+        "revision": git_revision(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,24 @@
+import sys
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import typer
 
-from krapp.config_manager import ConfigManager
-from krapp.date_extractor import DateExtractor
-from krapp.diary_organizer import DiaryOrganizer
-from krapp.text_db_manager import TextDBManager
-from krapp.txt2md import Txt2MdConverter
-from krapp.yaml_frontmatter_parser import YamlFrontmatterParser
+from krapp.config_manager import (
+    BASE_PATH_CONFIG,
+    ConfigManager,
+    get_db_path,
+    get_write_options,
+)
+from krapp.ingest_stats import IngestStats
+
+# SQLAlchemy・pandas・yaml・streamlit は読み込みに時間がかかるので、
+# 使うコマンドの中でだけ import する (tests/krapp/test_cli.py で確認している)
+if TYPE_CHECKING:
+    from krapp.text_db_manager import TextDBManager
 
 app = typer.Typer()
-BASE_PATH_CONFIG = "texts.dir"
+DATE_SOURCES_CONFIG = "org_diary.date_sources"
 
 
 @app.command()
@@ -21,16 +29,65 @@ def txt2md(
     output_folder: str = typer.Option(
         help="Path to the output folder for .md files",
     ),
+    recursive: bool = typer.Option(
+        help="Convert subfolders too, mirroring the folder tree",
+        default=False,
+    ),
+    jobs: int = typer.Option(
+        help="Number of files converted in parallel",
+        default=1,
+    ),
+    force: bool = typer.Option(
+        help="Convert files even if their .md output is up to date",
+        default=False,
+    ),
+    stats: bool = typer.Option(
+        help="Print per-stage timings when done",
+        default=False,
+    ),
+    stats_json: str = typer.Option(
+        help="Write per-stage timings to this JSON file",
+        default=None,
+    ),
 ):
     """
     Convert .txt files in the input folder to .md files in the output folder.
     """
 
+    from krapp.txt2md import Txt2MdConverter
+
     converter = Txt2MdConverter()
-    result = converter.convert_txt_to_md(input_folder, output_folder)
+    ingest_stats = _create_stats()
+    result = converter.convert_txt_to_md(
+        input_folder,
+        output_folder,
+        recursive=recursive,
+        jobs=jobs,
+        force=force,
+        stats=ingest_stats,
+    )
+    for path, error in result.failed_files.items():
+        typer.echo(f"Failed to convert {path}: {error}")
     typer.echo(
         f"Converted {len(result.processed_files)} files from {input_folder} to {output_folder}."
     )
+    typer.echo(
+        f"Skipped {len(result.skipped_files)} up-to-date files, "
+        f"failed {len(result.failed_files)} files."
+    )
+    _report_stats(ingest_stats, stats, stats_json)
+
+
+def _create_stats() -> IngestStats:
+    # 端末でなければ進捗行は出さない
+    return IngestStats(progress=sys.stderr.isatty())
+
+
+def _report_stats(ingest_stats: IngestStats, show: bool, json_path: str | None):
+    if show:
+        typer.echo(ingest_stats.format_summary())
+    if json_path is not None:
+        ingest_stats.write_json(json_path)
 
 
 def _get_folder_path(folder_path: str, config_manager=None) -> Path:
@@ -45,32 +102,297 @@ def _get_folder_path(folder_path: str, config_manager=None) -> Path:
     return Path(base_path)
 
 
+def _open_db(db_path: str | None, **kwargs) -> "TextDBManager":
+    from krapp.text_db_manager import TextDBManager
+
+    return TextDBManager(db_path=get_db_path(db_path), **kwargs)
+
+
 @app.command()
 def create_db(
     db_path: str = typer.Option(
-        help="Path to the SQLite database file", default="./texts.db"
+        help="Path to the SQLite database file (default: db.path config or ./texts.db)",
+        default=None,
     ),
     folder_path: str = typer.Option(
         help="Path to the folder containing .md files", default=None
     ),
+    rebuild: bool = typer.Option(
+        help="Drop the existing database and rebuild it from scratch",
+        default=False,
+    ),
+    jobs: int = typer.Option(
+        help="Number of worker processes used to read and parse files",
+        default=1,
+    ),
+    concurrency: int = typer.Option(
+        help="Read files with asyncio, this many at a time, instead of --jobs "
+        "worker processes; for slow or network-mounted folders",
+        default=None,
+    ),
+    dedup: str = typer.Option(
+        help="What to do with files whose content is already stored: "
+        "keep (separate entries), link (share one entry) or skip "
+        "(default: db.dedup config, else the policy the database was built "
+        "with, else keep)",
+        default=None,
+    ),
+    compression: str = typer.Option(
+        help="Store entry contents compressed with zlib or lzma, or none "
+        "(default: db.compression config)",
+        default=None,
+    ),
+    compression_level: int = typer.Option(
+        help="zlib level or lzma preset, 0-9 (default: db.compression_level config)",
+        default=None,
+    ),
+    stats: bool = typer.Option(
+        help="Print per-stage timings when done",
+        default=False,
+    ),
+    stats_json: str = typer.Option(
+        help="Write per-stage timings to this JSON file",
+        default=None,
+    ),
 ):
     """
     Create a SQLite database from .md files in the specified folder.
+    An existing database is updated incrementally unless --rebuild is given.
     """
-    date_extractor = DateExtractor()
-    yaml_parser = YamlFrontmatterParser()
-    db = TextDBManager(
-        db_path=db_path,
+    db_path = get_db_path(db_path)
+    db = _open_db(
+        db_path,
         folder_path=_get_folder_path(folder_path),
-        date_extractor=date_extractor,
-        yaml_parser=yaml_parser,
+        recreate=rebuild,
+        **get_write_options(compression, compression_level, dedup),
     )
     # フォルダをスキャンしてDB構築
-    db.process_folder()
+    ingest_stats = _create_stats()
+    result = db.process_folder(jobs=jobs, stats=ingest_stats, concurrency=concurrency)
     db.close()
     typer.echo(
         f"Database created at {db_path} from files in {_get_folder_path(folder_path)}."
     )
+    typer.echo(
+        f"Added {result.added}, updated {result.updated}, deleted {result.deleted}, "
+        f"unchanged {result.unchanged}, failed {result.failed}, "
+        f"duplicates {result.duplicates}."
+    )
+    _report_stats(ingest_stats, stats, stats_json)
+
+
+@app.command()
+def watch(
+    db_path: str = typer.Option(
+        help="Path to the SQLite database file (default: db.path config or ./texts.db)",
+        default=None,
+    ),
+    folder_path: str = typer.Option(
+        help="Path to the folder containing .md files", default=None
+    ),
+    debounce: float = typer.Option(
+        help="Seconds of quiet to wait for before applying a burst of changes",
+        default=1.0,
+    ),
+    poll_interval: float = typer.Option(
+        help="Seconds between scans when inotify is not available",
+        default=5.0,
+    ),
+    polling: bool = typer.Option(
+        help="Scan the folder periodically even if inotify is available",
+        default=False,
+    ),
+    dedup: str = typer.Option(
+        help="What to do with files whose content is already stored: "
+        "keep (separate entries), link (share one entry) or skip "
+        "(default: db.dedup config, else the policy the database was built "
+        "with, else keep)",
+        default=None,
+    ),
+):
+    """
+    Keep the database in sync with the folder until interrupted.
+    """
+    from krapp.folder_watcher import create_watcher, watch_folder
+
+    folder = _get_folder_path(folder_path)
+    db = _open_db(db_path, folder_path=folder, **get_write_options(None, None, dedup))
+    # 監視していなかった間の変更を取り込んでから監視を始める
+    watcher = create_watcher(folder, poll_interval=poll_interval, polling=polling)
+    result = db.process_folder()
+    typer.echo(
+        f"Synced {folder}: added {result.added}, updated {result.updated}, "
+        f"deleted {result.deleted}. Watching with {type(watcher).__name__}."
+    )
+
+    def report(result):
+        typer.echo(
+            f"Added {result.added}, updated {result.updated}, "
+            f"deleted {result.deleted}, failed {result.failed}."
+        )
+
+    def report_error(error):
+        typer.echo(f"Sync failed, retrying: {error}", err=True)
+
+    try:
+        watch_folder(
+            db, watcher, debounce=debounce, on_sync=report, on_error=report_error
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        db.close()
+
+
+@app.command()
+def search(
+    query: str = typer.Argument(help="Words to search for"),
+    db_path: str = typer.Option(
+        help="Path to the SQLite database file (default: db.path config or ./texts.db)",
+        default=None,
+    ),
+    limit: int = typer.Option(help="Maximum number of results", default=20),
+):
+    """
+    Search the entries in the database by full text.
+    """
+    db = _open_db(db_path)
+    results = db.search(query, limit=limit)
+    db.close()
+    for result in results:
+        typer.echo(f"{result.date} {result.title}")
+        typer.echo(f"    {result.snippet.replace(chr(10), ' ')}")
+    typer.echo(f"{len(results)} entries found.")
+
+
+@app.command()
+def stats(
+    year: int = typer.Option(help="Only the months of this year", default=None),
+    db_path: str = typer.Option(
+        help="Path to the SQLite database file (default: db.path config or ./texts.db)",
+        default=None,
+    ),
+):
+    """
+    Show the number of entries, characters and average happiness per month.
+    """
+    db = _open_db(db_path)
+    months = db.get_monthly_stats(year)
+    db.close()
+    typer.echo(f"{'month':<8} {'entries':>8} {'chars':>10} {'happiness':>10}")
+    for month in months:
+        happiness = (
+            f"{month.average_happiness:.2f}"
+            if month.average_happiness is not None
+            else "-"
+        )
+        typer.echo(
+            f"{month.year}-{month.month:02d}  {month.entry_count:>8}"
+            f" {month.char_count:>10} {happiness:>10}"
+        )
+
+
+@app.command()
+def fields(
+    key: str = typer.Argument(
+        help="List the values of this key instead of the keys", default=None
+    ),
+    db_path: str = typer.Option(
+        help="Path to the SQLite database file (default: db.path config or ./texts.db)",
+        default=None,
+    ),
+):
+    """
+    List the frontmatter keys in the database, or the values of one key.
+    """
+    db = _open_db(db_path)
+    rows = db.get_field_values(key) if key is not None else db.get_field_keys()
+    db.close()
+    for name, count in rows:
+        typer.echo(f"{name}\t{count}")
+
+
+@app.command("filter")
+def filter_entries(
+    key: str = typer.Argument(help="Frontmatter key, e.g. tags or place.city"),
+    value: str = typer.Argument(help="Value to match", default=None),
+    year: int = typer.Option(help="Only entries of this year", default=None),
+    month: int = typer.Option(help="Only entries of this month", default=None),
+    min_value: float = typer.Option(help="Minimum numeric value", default=None),
+    max_value: float = typer.Option(help="Maximum numeric value", default=None),
+    db_path: str = typer.Option(
+        help="Path to the SQLite database file (default: db.path config or ./texts.db)",
+        default=None,
+    ),
+    limit: int = typer.Option(help="Maximum number of results", default=100),
+):
+    """
+    List the entries whose frontmatter matches, e.g. `krapp filter tags 旅行 --year 2023`.
+    """
+    db = _open_db(db_path)
+    summaries = db.find_entries_by_field(
+        key,
+        value,
+        year=year,
+        month=month,
+        min_value=min_value,
+        max_value=max_value,
+        limit=limit,
+    )
+    db.close()
+    for summary in summaries:
+        typer.echo(f"{summary.date} {summary.title}")
+    typer.echo(f"{len(summaries)} entries found.")
+
+
+@app.command()
+def build_site(
+    output_folder: str = typer.Option(
+        help="Path to the folder the HTML site is written to",
+    ),
+    db_path: str = typer.Option(
+        help="Path to the SQLite database file (default: db.path config or ./texts.db)",
+        default=None,
+    ),
+    jobs: int = typer.Option(
+        help="Number of worker processes rendering entry pages",
+        default=1,
+    ),
+    force: bool = typer.Option(
+        help="Rebuild every page even if its inputs have not changed",
+        default=False,
+    ),
+    stats: bool = typer.Option(
+        help="Print per-stage timings when done",
+        default=False,
+    ),
+    stats_json: str = typer.Option(
+        help="Write per-stage timings to this JSON file",
+        default=None,
+    ),
+):
+    """
+    Render the entries as a static HTML site with year, month and entry pages
+    and a client-side search. Only pages whose inputs changed are rebuilt.
+    """
+    from krapp.site_builder import SiteBuilder
+
+    db = _open_db(db_path)
+    ingest_stats = _create_stats()
+    result = SiteBuilder(db).build_site(
+        output_folder, jobs=jobs, force=force, stats=ingest_stats
+    )
+    db.close()
+    for path, error in result.failed_pages.items():
+        typer.echo(f"Failed to write {path}: {error}")
+    typer.echo(
+        f"Wrote {len(result.written_pages)} pages to {output_folder}, "
+        f"skipped {len(result.skipped_pages)} unchanged, "
+        f"deleted {len(result.deleted_pages)}, "
+        f"failed {len(result.failed_pages)}."
+    )
+    _report_stats(ingest_stats, stats, stats_json)
 
 
 @app.command()
@@ -86,7 +408,7 @@ def run_app():
     #     folder_path="/Users/ishida/Documents/Texts/",
     # )
     subprocess.run(
-        ["streamlit", "run", "src/krapp/streamlit_app.py"],
+        ["streamlit", "run", str(Path(__file__).with_name("streamlit_app.py"))],
         check=True,
     )
 
@@ -125,20 +447,75 @@ def org_diary(
         help="Remove the original .md files after conversion",
         default=False,
     ),
+    jobs: int = typer.Option(
+        help="Number of files read and moved in parallel",
+        default=1,
+    ),
+    dry_run: bool = typer.Option(
+        help="Print where each file would go without touching any files",
+        default=False,
+    ),
+    date_sources: str = typer.Option(
+        help="Comma-separated places to look for the date, tried in order: "
+        "filename, frontmatter, body (default: org_diary.date_sources config, "
+        "or the file name and body searched together)",
+        default=None,
+    ),
+    stats: bool = typer.Option(
+        help="Print per-stage timings when done",
+        default=False,
+    ),
+    stats_json: str = typer.Option(
+        help="Write per-stage timings to this JSON file",
+        default=None,
+    ),
 ):
+    """
+    Sort .md files into year/month folders by the first date they contain.
+    """
     if output_folder is None:
         output_folder = input_folder
 
-    organizer = DiaryOrganizer(date_extractor=DateExtractor())
-    for file in Path(input_folder).rglob("*.md"):
-        try:
-            organizer.organize_diary(
-                input_md_file=file, output_folder=output_folder, remove=remove
-            )
-        except ValueError:
-            typer.echo(f"Failed to copy {file} to {output_folder}. ")
-            continue
-        typer.echo(f"Copy {file} to {output_folder}. ")
+    if date_sources is None:
+        date_sources = ConfigManager().get_config(DATE_SOURCES_CONFIG)
+    from krapp.date_extractor import DateExtractor
+    from krapp.diary_organizer import DiaryOrganizer
+
+    organizer = DiaryOrganizer(
+        date_extractor=DateExtractor(),
+        date_sources=(
+            [source.strip() for source in date_sources.split(",")]
+            if date_sources
+            else None
+        ),
+    )
+    ingest_stats = _create_stats()
+    with ingest_stats.stage("walk"):
+        files = list(Path(input_folder).rglob("*.md"))
+    # 先にすべての移動先を決めてから、まとめて移動する
+    with ingest_stats.stage("plan"):
+        plan = organizer.plan(files, output_folder, jobs=jobs, stats=ingest_stats)
+    for file, error in plan.failed.items():
+        typer.echo(f"Failed to copy {file} to {output_folder}. {error}")
+    for file, reason in plan.skipped.items():
+        typer.echo(f"Skipped {file}. {reason}")
+
+    if dry_run:
+        action = "Move" if remove else "Copy"
+        for move in plan.moves:
+            typer.echo(f"{action} {move.source} to {move.destination}.")
+        typer.echo(
+            f"{len(plan.moves)} files to {action.lower()}, "
+            f"{len(plan.skipped)} skipped, {len(plan.failed)} failed."
+        )
+        return
+
+    result = organizer.execute(plan, remove=remove, jobs=jobs, stats=ingest_stats)
+    for file, error in result.failed.items():
+        typer.echo(f"Failed to copy {file} to {output_folder}. {error}")
+    for move in result.done:
+        typer.echo(f"Copy {move.source} to {move.destination.parent}. ")
+    _report_stats(ingest_stats, stats, stats_json)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+import lzma
+import zlib
+from typing import Final
+
+# 先頭の 1 バイトで圧縮方式を見分ける
+_PREFIXES: Final = {"zlib": b"z", "lzma": b"x"}
+COMPRESSION_METHODS: Final = tuple(_PREFIXES)
+
+
+def compress(text: str, method: str, level: int | None = None) -> bytes:
+    """
+    Compress text for the content_blob column.
+    level is the zlib level or the lzma preset; None uses the library default.
+    """
+    data = text.encode("utf-8")
+    if method == "zlib":
+        body = zlib.compress(data, -1 if level is None else level)
+    elif method == "lzma":
+        body = lzma.compress(data, preset=level)
+    else:
+        raise ValueError(
+            f"compression must be one of {', '.join(COMPRESSION_METHODS)}, "
+            f"not {method!r}"
+        )
+    return _PREFIXES[method] + body
+
+
+def decompress(blob: bytes) -> str:
+    prefix, body = blob[:1], blob[1:]
+    if prefix == _PREFIXES["zlib"]:
+        data = zlib.decompress(body)
+    elif prefix == _PREFIXES["lzma"]:
+        data = lzma.decompress(body)
+    else:
+        raise ValueError(f"Unknown compressed content prefix {prefix!r}")
+    return data.decode("utf-8")
+
+
+def content_text(content: str | None, blob: bytes | None) -> str | None:
+    """
+    The text of an entry, whichever column it is stored in.
+    Registered in SQLite as krapp_content(content, content_blob).
+    """
+    return decompress(blob) if blob is not None else content
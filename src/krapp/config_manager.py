@@ -4,6 +4,13 @@ import sys
 from pathlib import Path
 from typing import Any
 
+BASE_PATH_CONFIG = "texts.dir"
+DB_PATH_CONFIG = "db.path"
+DEFAULT_DB_PATH = "./texts.db"
+COMPRESSION_CONFIG = "db.compression"
+COMPRESSION_LEVEL_CONFIG = "db.compression_level"
+DEDUP_CONFIG = "db.dedup"
+
 
 class ConfigManager:
     @property
@@ -28,6 +35,11 @@ class ConfigManager:
     def __init__(self) -> None:
         self.config: dict = {
             "texts.dir": None,
+            "db.path": None,
+            "org_diary.date_sources": None,
+            "db.compression": None,
+            "db.compression_level": None,
+            "db.dedup": None,
         }
         self.load_config()
 
@@ -57,3 +69,40 @@ class ConfigManager:
         os.makedirs(self.config_file.parent, exist_ok=True)
         with open(self.config_file, "w") as file:
             json.dump(self.config, file, indent=4)
+
+
+def get_db_path(
+    db_path: str | None = None, config_manager: ConfigManager | None = None
+) -> str:
+    """
+    The database path given, else the db.path config, else ./texts.db.
+    """
+    if db_path is not None:
+        return db_path
+    if config_manager is None:
+        config_manager = ConfigManager()
+    return config_manager.get_config(DB_PATH_CONFIG) or DEFAULT_DB_PATH
+
+
+def get_write_options(
+    compression: str | None = None,
+    level: int | None = None,
+    dedup: str | None = None,
+    config_manager: ConfigManager | None = None,
+) -> dict:
+    """
+    TextDBManager arguments for writing, falling back to the config, so
+    every command and the Streamlit app treat the database the same way.
+    "none" turns compression off even if the config enables it.
+    """
+    if config_manager is None:
+        config_manager = ConfigManager()
+    # どちらもなければ、データベースに保存された方針で取り込む
+    options = {"dedup": dedup or config_manager.get_config(DEDUP_CONFIG)}
+    if compression is None:
+        compression = config_manager.get_config(COMPRESSION_CONFIG)
+    if level is None and config_manager.get_config(COMPRESSION_LEVEL_CONFIG):
+        level = int(config_manager.get_config(COMPRESSION_LEVEL_CONFIG))
+    if compression not in (None, "", "none"):
+        options.update(compression=compression, compression_level=level)
+    return options
@@ -12,8 +12,9 @@ class ContentFormatter:
         """
         if content.startswith("---"):
             parts = content.split("---", 2)
+            # 閉じる区切りがなければ、そのまま表示する
             if len(parts) > 2:
                 front_matter = parts[1].strip()
                 body = parts[2].strip()
-            return f"```\n{front_matter}\n```\n\n{body}"
+                return f"```\n{front_matter}\n```\n\n{body}"
         return content
@@ -10,6 +10,35 @@ class DatePatternFormat:
     format: str
 
 
+@dataclass(frozen=True)
+class _CombinedEngine:
+    """
+    One regex that tries several date patterns at every position.
+    Each pattern is wrapped in an optional lookahead, so all patterns that
+    match at a position are reported by a single match object.
+    """
+
+    regex: re.Pattern
+    # (パターン全体のグループ番号, 値として使うグループ番号)
+    groups: tuple[tuple[int, int], ...]
+
+    @classmethod
+    def compile(cls, patterns: tuple[DatePatternFormat, ...]) -> "_CombinedEngine":
+        if not patterns:
+            return cls(re.compile(r"(?!)"), ())
+        # どれかのパターンが一致する位置だけで止まるようにする
+        guard = "(?=" + "|".join(f"(?:{p.pattern})" for p in patterns) + ")"
+        regex = guard
+        groups = []
+        for pattern in patterns:
+            outer = re.compile(regex).groups + 1
+            # findall と同じく、グループがあれば最初のグループを値にする
+            inner = outer + 1 if re.compile(pattern.pattern).groups else outer
+            groups.append((outer, inner))
+            regex += f"(?=({pattern.pattern}))?"
+        return cls(re.compile(regex), tuple(groups))
+
+
 class DateExtractor:
     def __init__(self) -> None:
         # Define common date patterns
@@ -23,6 +52,11 @@ class DateExtractor:
             DatePatternFormat(r"\b\d{8}\b", "%Y%m%d"),
             DatePatternFormat(r"\b(\d{8})_\d{4}\b", "%Y%m%d"),
         )
+        # _engines[n] は優先度の高い n 個のパターンだけを扱う
+        self._engines: Final = tuple(
+            _CombinedEngine.compile(self.date_patterns[:n])
+            for n in range(len(self.date_patterns) + 1)
+        )
 
     def read_file(self, file_path: str) -> str:
         """Reads the content of a file and returns it as a string."""
@@ -35,14 +69,82 @@ class DateExtractor:
         return self.extract_dates(text)
 
     def extract_dates(self, text: str) -> List[datetime]:
-        """Extracts dates from the given text and returns them as a list of datetime objects."""
+        """
+        Extracts dates from the given text and returns them as a list of datetime objects.
+        Dates are ordered by pattern priority, then by position, exactly as if
+        each pattern had been searched with re.findall one after another.
+        """
+        engine = self._engines[-1]
+        matches: list[list[str]] = [[] for _ in engine.groups]
+        # パターンごとに、前回の一致の終わりより前では一致させない (findall と同じ)
+        last_end = [0] * len(engine.groups)
+        for match in engine.regex.finditer(text):
+            position = match.start()
+            for index, (outer, inner) in enumerate(engine.groups):
+                if match.group(outer) is None or position < last_end[index]:
+                    continue
+                matches[index].append(match.group(inner))
+                last_end[index] = match.end(outer)
+
         dates = []
-        for pattern in self.date_patterns:
-            matches = re.findall(pattern.pattern, text)
-            for match in matches:
+        for pattern, found in zip(self.date_patterns, matches):
+            for value in found:
                 try:
-                    dates.append(datetime.strptime(match, pattern.format))
+                    dates.append(datetime.strptime(value, pattern.format))
                 except ValueError:
                     # Skip invalid date formats
                     continue
         return dates
+
+    def extract_first_date(self, text: str) -> datetime | None:
+        """
+        Returns the first element extract_dates would return, or None.
+        Once a valid date is found only higher-priority patterns are searched
+        for in the rest of the text, and the scan stops at the top pattern.
+        """
+        found = self.extract_first_date_with_priority(text)
+        return found[1] if found is not None else None
+
+    def extract_first_date_with_priority(
+        self, text: str
+    ) -> tuple[int, datetime] | None:
+        """
+        Like extract_first_date, but also returns the index of the pattern
+        that matched. A date found with pattern 0 cannot be beaten by any
+        text appended after it.
+        """
+        engine = self._engines[-1]
+        last_end = [0] * len(engine.groups)
+        best: tuple[int, datetime] | None = None
+        position = 0
+        while engine.groups:
+            for match in engine.regex.finditer(text, position):
+                position = match.start()
+                found = self._first_valid(match, engine, position, last_end)
+                if found is not None:
+                    best = found
+                    engine = self._engines[found[0]]
+                    position += 1
+                    break
+            else:
+                break
+        return best
+
+    def _first_valid(
+        self,
+        match: re.Match,
+        engine: _CombinedEngine,
+        position: int,
+        last_end: list[int],
+    ) -> tuple[int, datetime] | None:
+        for index, (outer, inner) in enumerate(engine.groups):
+            if match.group(outer) is None or position < last_end[index]:
+                continue
+            last_end[index] = match.end(outer)
+            try:
+                return index, datetime.strptime(
+                    match.group(inner), self.date_patterns[index].format
+                )
+            except ValueError:
+                continue
+        return None
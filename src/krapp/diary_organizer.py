@@ -1,32 +1,133 @@
+import errno
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
+from typing import Final, Iterable, Sequence
 
 from krapp.date_extractor import DateExtractor
+from krapp.ingest_stats import IngestStats
+from krapp.yaml_frontmatter_parser import YamlFrontmatterParser
+
+# find_date が日付を探せる場所
+DATE_SOURCES: Final = ("filename", "frontmatter", "body")
+
+
+@dataclass(frozen=True, slots=True)
+class PlannedMove:
+    source: Path
+    destination: Path
+
+
+@dataclass
+class OrganizePlan:
+    """
+    Where each file goes, computed before anything is touched.
+    skipped and failed map a source file to the reason.
+    """
+
+    moves: list[PlannedMove] = field(default_factory=list)
+    skipped: dict[Path, str] = field(default_factory=dict)
+    failed: dict[Path, str] = field(default_factory=dict)
+
+
+@dataclass
+class OrganizeResult:
+    done: list[PlannedMove] = field(default_factory=list)
+    failed: dict[Path, str] = field(default_factory=dict)
 
 
 class DiaryOrganizer:
-    def __init__(self, date_extractor: DateExtractor) -> None:
+    def __init__(
+        self,
+        date_extractor: DateExtractor,
+        date_sources: Sequence[str] | None = None,
+        yaml_parser: YamlFrontmatterParser | None = None,
+    ) -> None:
+        """
+        date_sources are the places tried in order by find_date, e.g.
+        ("filename", "frontmatter", "body"). The default searches the file
+        name and the whole content together, which prefers a higher-priority
+        date pattern in the body over a date in the file name.
+        """
+        unknown = set(date_sources or ()) - set(DATE_SOURCES)
+        if unknown:
+            raise ValueError(f"Unknown date sources: {', '.join(sorted(unknown))}")
         self.date_extractor = date_extractor
+        self.date_sources: Final = tuple(date_sources) if date_sources else None
+        self.yaml_parser: Final = yaml_parser or YamlFrontmatterParser()
+
+    def find_date(
+        self, input_md_file: Path, stats: IngestStats | None = None
+    ) -> datetime:
+        """
+        The first date in the file name or content.
+        Raises ValueError when there is none.
+        """
+        stats = stats or IngestStats()
+        if self.date_sources is None:
+            date = self._find_date_in_file(input_md_file, stats)
+        else:
+            date = self._find_date_in_sources(input_md_file, stats)
+        if date is None:
+            raise ValueError(
+                f"{input_md_file}. No valid date found in the markdown file."
+            )
+        return date
+
+    def _find_date_in_file(
+        self, input_md_file: Path, stats: IngestStats
+    ) -> datetime | None:
+        with stats.stage("dates"):
+            found = self.date_extractor.extract_first_date_with_priority(
+                input_md_file.stem
+            )
+        # 最優先のパターンで見つかれば、本文を読んでも結果は変わらない
+        if found is not None and found[0] == 0:
+            return found[1]
+        with stats.stage("read"):
+            content = input_md_file.read_text(encoding="utf-8")
+        with stats.stage("dates"):
+            return self.date_extractor.extract_first_date(
+                f"{input_md_file.stem}\n{content}"
+            )
+
+    def _find_date_in_sources(
+        self, input_md_file: Path, stats: IngestStats
+    ) -> datetime | None:
+        for source in self.date_sources:
+            if source == "filename":
+                text = input_md_file.stem
+            elif source == "frontmatter":
+                with stats.stage("read"):
+                    text = self.yaml_parser.read_header(input_md_file)
+                if text is None:
+                    continue
+            else:
+                with stats.stage("read"):
+                    text = input_md_file.read_text(encoding="utf-8")
+            with stats.stage("dates"):
+                date = self.date_extractor.extract_first_date(text)
+            if date is not None:
+                return date
+        return None
 
     def organize_diary(
-        self, input_md_file: str | Path, output_folder: str | Path, remove: bool = False
+        self,
+        input_md_file: str | Path,
+        output_folder: str | Path,
+        remove: bool = False,
+        stats: IngestStats | None = None,
     ) -> None:
+        stats = stats or IngestStats()
         # Read the content of the input markdown file
         input_md_file = Path(input_md_file)
         output_folder = Path(output_folder)
-        content = input_md_file.read_text(encoding="utf-8")
 
         # Extract the date from the content
-        date_list = self.date_extractor.extract_dates(
-            f"{input_md_file.stem}\n{content}"
-        )
-        if len(date_list) == 0:
-            raise ValueError(
-                f"{input_md_file}. No valid date found in the markdown file."
-            )
-        date = date_list[0]
+        date = self.find_date(input_md_file, stats)
 
         if date == datetime.today():
             print(
@@ -35,8 +136,7 @@ class DiaryOrganizer:
             return
 
         # Create year and month folders
-        year_folder = output_folder / str(date.year)
-        month_folder = year_folder / f"{date.month:02d}"
+        month_folder = self.month_folder(output_folder, date)
         os.makedirs(month_folder, exist_ok=True)
 
         # 同じ名前のファイルがあった場合は処理をスキップ
@@ -45,7 +145,138 @@ class DiaryOrganizer:
                 f"File {input_md_file.name} already exists in {month_folder}. Skipping."
             )
             return
-        # Copy the markdown file to the appropriate folder
-        shutil.copy(input_md_file, month_folder)
         if remove:
-            os.remove(input_md_file)
+            with stats.stage("move"):
+                move_file(input_md_file, month_folder / input_md_file.name)
+            return
+        # Copy the markdown file to the appropriate folder
+        with stats.stage("copy"):
+            shutil.copy(input_md_file, month_folder)
+
+    @staticmethod
+    def month_folder(output_folder: Path, date: datetime) -> Path:
+        return output_folder / str(date.year) / f"{date.month:02d}"
+
+    def plan(
+        self,
+        input_files: Iterable[str | Path],
+        output_folder: str | Path,
+        jobs: int = 1,
+        stats: IngestStats | None = None,
+    ) -> OrganizePlan:
+        """
+        Work out the destination of every file without touching any.
+        Dates are read with `jobs` threads. Each destination folder is
+        listed at most once, and two files planned for the same name are
+        caught before anything is moved.
+        """
+        stats = stats or IngestStats()
+        output_folder = Path(output_folder)
+        input_files = [Path(path) for path in input_files]
+
+        def find(path: Path) -> datetime | str:
+            try:
+                return self.find_date(path, stats)
+            except ValueError as e:
+                return str(e)
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            dates = list(executor.map(find, input_files))
+
+        plan = OrganizePlan()
+        # フォルダごとのファイル名の一覧。計画したファイルも加えていく
+        listings: dict[Path, set[str]] = {}
+        for path, date in zip(input_files, dates):
+            if isinstance(date, str):
+                plan.failed[path] = date
+                continue
+            if date == datetime.today():
+                plan.skipped[path] = "The date in the markdown file is today."
+                continue
+            month_folder = self.month_folder(output_folder, date)
+            if month_folder not in listings:
+                try:
+                    listings[month_folder] = set(os.listdir(month_folder))
+                except FileNotFoundError:
+                    listings[month_folder] = set()
+            if path.name in listings[month_folder]:
+                plan.skipped[path] = f"{path.name} already exists in {month_folder}."
+                continue
+            listings[month_folder].add(path.name)
+            plan.moves.append(PlannedMove(path, month_folder / path.name))
+        return plan
+
+    def execute(
+        self,
+        plan: OrganizePlan,
+        remove: bool = False,
+        jobs: int = 1,
+        stats: IngestStats | None = None,
+    ) -> OrganizeResult:
+        """
+        Carry out a plan with `jobs` threads. With remove the files are moved,
+        otherwise copied. Existing files are never overwritten.
+        """
+        stats = stats or IngestStats()
+        for folder in sorted({move.destination.parent for move in plan.moves}):
+            os.makedirs(folder, exist_ok=True)
+        stats.set_total(len(plan.moves))
+
+        def run(move: PlannedMove) -> str | None:
+            try:
+                with stats.stage("move" if remove else "copy"):
+                    if remove:
+                        move_file(move.source, move.destination)
+                    else:
+                        copy_file(move.source, move.destination)
+            except OSError as e:
+                return str(e)
+            finally:
+                stats.advance()
+            return None
+
+        result = OrganizeResult()
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            for move, error in zip(plan.moves, executor.map(run, plan.moves)):
+                if error is None:
+                    result.done.append(move)
+                else:
+                    result.failed[move.source] = error
+        stats.finish()
+        return result
+
+
+def copy_file(source: Path, destination: Path) -> None:
+    """
+    Copy a file, failing instead of overwriting an existing destination.
+    """
+    with open(source, "rb") as src, open(destination, "xb") as dst:
+        try:
+            shutil.copyfileobj(src, dst)
+        except BaseException:
+            # 書きかけのファイルを残さない
+            os.remove(destination)
+            raise
+    shutil.copymode(source, destination)
+
+
+def move_file(source: Path, destination: Path) -> None:
+    """
+    Move a file without overwriting the destination.
+    On the same filesystem this is a hard link plus unlink, so no data is
+    copied; where links are not supported it falls back to rename, and
+    across filesystems to a copy followed by removing the source.
+    """
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            copy_file(source, destination)
+        elif destination.exists():
+            raise FileExistsError(errno.EEXIST, "File exists", str(destination))
+        else:
+            os.rename(source, destination)
+            return
+    os.remove(source)
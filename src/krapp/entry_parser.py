@@ -0,0 +1,311 @@
+import asyncio
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    TypeVar,
+)
+
+from krapp.compression import compress
+from krapp.date_extractor import DateExtractor
+from krapp.yaml_frontmatter_parser import YamlFrontmatterParser
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# (ファイルパス, マニフェストのキー, 既知のハッシュ)
+ParseTask = tuple[Path, str, str | None]
+# (ファイルパス, 解析結果, エラーメッセージ)
+ParseOutcome = tuple[Path, "ParsedFile | None", str | None]
+
+
+class FieldValue(NamedTuple):
+    """
+    One frontmatter value as stored in the entry_fields table.
+    text_value is what equality filters compare against; number_value is
+    set for numbers and booleans so they can be filtered by range.
+    """
+
+    key: str
+    value_type: str
+    text_value: str | None
+    number_value: float | None
+
+
+def field_text(value: Any) -> str | None:
+    """
+    The text a frontmatter value is stored and matched as.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def flatten_frontmatter(frontmatter: dict, prefix: str = "") -> list[FieldValue]:
+    """
+    Turn a frontmatter mapping into rows: one row per list item, and
+    nested mappings under dotted keys such as "place.city".
+    """
+    fields: list[FieldValue] = []
+    for key, value in frontmatter.items():
+        name = f"{prefix}{key}"
+        items = value if isinstance(value, list) else [value]
+        for item in items:
+            if isinstance(item, dict):
+                fields.extend(flatten_frontmatter(item, f"{name}."))
+                continue
+            fields.append(_field_value(name, item))
+    return fields
+
+
+def _field_value(key: str, value: Any) -> FieldValue:
+    number: float | None = None
+    # bool は int の、datetime は date のサブクラスなので先に判定する
+    if isinstance(value, bool):
+        value_type, number = "bool", float(value)
+    elif isinstance(value, (int, float)):
+        value_type = type(value).__name__
+        try:
+            number = float(value)
+        except OverflowError:
+            pass
+    elif isinstance(value, datetime):
+        value_type = "datetime"
+    elif isinstance(value, date):
+        value_type = "date"
+    elif value is None:
+        value_type = "null"
+    else:
+        value_type = "str"
+    return FieldValue(key, value_type, field_text(value), number)
+
+
+def happiness_score(value: Any) -> int | None:
+    """
+    The "happiness score" frontmatter value as stored in the entries table.
+    Whole numbers, also written as "3" or 3.0, are accepted; anything else
+    raises ValueError, so the file is reported as failed instead of
+    breaking the write of its whole batch.
+    """
+    if value is None:
+        return None
+    score: int | None = None
+    # bool は int のサブクラスなので先に除く
+    if isinstance(value, int) and not isinstance(value, bool):
+        score = value
+    elif isinstance(value, float) and value.is_integer():
+        score = int(value)
+    elif isinstance(value, str) and value.strip().lstrip("+-").isdigit():
+        score = int(value)
+    # SQLite の INTEGER に収まらない値も書き込みで失敗する
+    if score is None or not -(2**63) <= score < 2**63:
+        raise ValueError(f"happiness score must be an integer, not {value!r}")
+    return score
+
+
+@dataclass
+class ParsedFile:
+    """
+    A file read from the folder, ready to be written to the database.
+    content is None when the file's hash matches the manifest.
+    """
+
+    path: str
+    size: int
+    mtime_ns: int
+    content_hash: str
+    title: str
+    content: str | None = None
+    date: datetime | None = None
+    char_count: int = 0
+    happiness_score: int | None = None
+    # 圧縮して保存するときの本文。このとき content は空文字列になる
+    content_blob: bytes | None = None
+    # フロントマターの全項目
+    fields: list[FieldValue] = field(default_factory=list)
+    # 段階ごとの処理時間 (秒)
+    timings: dict[str, float] = field(default_factory=dict)
+
+    def entry_values(self) -> dict:
+        return {
+            "date": self.date,
+            "title": self.title,
+            "content": self.content,
+            "content_blob": self.content_blob,
+            "content_hash": self.content_hash,
+            "char_count": self.char_count,
+            "happiness_score": self.happiness_score,
+            "year": self.date.year if self.date else None,
+            "month": self.date.month if self.date else None,
+            "day": self.date.day if self.date else None,
+        }
+
+
+class EntryParser:
+    """
+    Reads .md files and extracts the values stored for each entry.
+    Instances are picklable so they can be shipped to worker processes.
+    """
+
+    def __init__(
+        self,
+        date_extractor: DateExtractor,
+        yaml_parser: YamlFrontmatterParser,
+        compression: str | None = None,
+        compression_level: int | None = None,
+    ) -> None:
+        self.date_extractor = date_extractor
+        self.yaml_parser = yaml_parser
+        self.compression = compression
+        self.compression_level = compression_level
+
+    def parse_file(
+        self, file_path: Path, key: str, known_hash: str | None = None
+    ) -> ParsedFile:
+        """
+        Read one file and build the row values for its entry.
+        When the content hash equals known_hash the content is not parsed.
+        """
+        start = time.perf_counter()
+        stat = file_path.stat()
+        data = file_path.read_bytes()
+        read_end = time.perf_counter()
+        parsed = ParsedFile(
+            path=key,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            content_hash=hashlib.sha256(data).hexdigest(),
+            title=file_path.stem,
+        )
+        hash_end = time.perf_counter()
+        parsed.timings = {"read": read_end - start, "hash": hash_end - read_end}
+        if parsed.content_hash == known_hash:
+            return parsed
+
+        content = self.decode(data)
+        decode_end = time.perf_counter()
+        frontmatter = self.yaml_parser.parse(content)
+        frontmatter_end = time.perf_counter()
+        parsed.content = content
+        # 文字数をカウント
+        parsed.char_count = len(content) if content else 0
+        # 日付を抽出
+        parsed.date = self.extract_date(parsed.title, content)
+        parsed.happiness_score = happiness_score(frontmatter.get("happiness score"))
+        parsed.fields = flatten_frontmatter(frontmatter)
+        dates_end = time.perf_counter()
+        parsed.timings["decode"] = decode_end - hash_end
+        parsed.timings["frontmatter"] = frontmatter_end - decode_end
+        parsed.timings["dates"] = dates_end - frontmatter_end
+        if self.compression is not None:
+            # 圧縮はワーカープロセスで済ませておく
+            parsed.content_blob = compress(
+                content, self.compression, self.compression_level
+            )
+            parsed.content = ""
+            parsed.timings["compress"] = time.perf_counter() - dates_end
+        return parsed
+
+    def parse_chunk(self, tasks: list[ParseTask]) -> list[ParseOutcome]:
+        """
+        Parse several files, reporting failures per file instead of raising.
+        """
+        outcomes: list[ParseOutcome] = []
+        for file_path, key, known_hash in tasks:
+            try:
+                outcomes.append(
+                    (file_path, self.parse_file(file_path, key, known_hash), None)
+                )
+            except Exception as e:
+                outcomes.append((file_path, None, str(e)))
+        return outcomes
+
+    def extract_date(self, title: str, content: str) -> datetime | None:
+        # 最初に見つかった日付を返す。見つからない場合は None
+        return self.date_extractor.extract_first_date(f"{title}\n{content}")
+
+    @staticmethod
+    def decode(data: bytes) -> str:
+        # read_text と同じく改行コードを \n に揃える
+        return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+_worker_parser: EntryParser | None = None
+
+
+def init_worker(parser: EntryParser) -> None:
+    """
+    Process pool initializer: keep one parser per worker process.
+    """
+    global _worker_parser
+    _worker_parser = parser
+
+
+def parse_chunk_in_worker(tasks: list[ParseTask]) -> list[ParseOutcome]:
+    assert _worker_parser is not None, "init_worker was not called"
+    return _worker_parser.parse_chunk(tasks)
+
+
+def ordered_map(
+    executor: Executor, fn: Callable[[T], R], items: Iterable[T], window: int
+) -> Iterator[R]:
+    """
+    Like Executor.map, but keeps at most `window` tasks in flight so that
+    finished results do not pile up while the consumer is busy.
+    Results are yielded in the order of `items`.
+    """
+    pending: deque = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+async def ordered_map_async(
+    fn: Callable[[T], R], items: Iterable[T], concurrency: int, window: int
+) -> AsyncIterator[R]:
+    """
+    Like ordered_map, but from asyncio: fn runs in threads via
+    asyncio.to_thread, at most `concurrency` at a time. Started tasks wait
+    in a queue of `window`, so reading ahead stops while the consumer is
+    busy. Results are yielded in the order of `items`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    queue: asyncio.Queue[asyncio.Task | None] = asyncio.Queue(maxsize=window)
+
+    async def run(item: T) -> R:
+        async with semaphore:
+            return await asyncio.to_thread(fn, item)
+
+    async def produce() -> None:
+        for item in items:
+            await queue.put(asyncio.create_task(run(item)))
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (task := await queue.get()) is not None:
+            yield await task
+    finally:
+        # 途中で止められたら、読み始めたタスクも止める
+        producer.cancel()
+        while not queue.empty():
+            task = queue.get_nowait()
+            if task is not None:
+                task.cancel()
@@ -0,0 +1,213 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Final, Protocol
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from krapp.text_db_manager import SyncResult, TextDBManager
+
+
+class FolderWatcher(Protocol):
+    def wait(self, timeout: float | None) -> set[Path]:
+        """
+        Block until something changes or the timeout expires.
+        Returns the changed paths, empty on timeout.
+        """
+        ...
+
+    def close(self) -> None: ...
+
+
+class InotifyWatcher:
+    """
+    Watches a folder tree with Linux inotify, one watch per directory.
+    """
+
+    IN_CLOSE_WRITE: Final = 0x00000008
+    IN_MOVED_FROM: Final = 0x00000040
+    IN_MOVED_TO: Final = 0x00000080
+    IN_CREATE: Final = 0x00000100
+    IN_DELETE: Final = 0x00000200
+    IN_DELETE_SELF: Final = 0x00000400
+    IN_Q_OVERFLOW: Final = 0x00004000
+    IN_IGNORED: Final = 0x00008000
+    IN_ISDIR: Final = 0x40000000
+    MASK: Final = (
+        IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+    )
+    EVENT_HEADER: Final = struct.Struct("iIII")
+
+    def __init__(self, folder_path: str | Path) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self.folder_path: Final = Path(folder_path)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches: dict[int, Path] = {}
+        self._add_tree(self.folder_path)
+
+    def _add_tree(self, folder: Path) -> None:
+        for path in [folder, *(p for p in folder.rglob("*") if p.is_dir())]:
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(path), ctypes.c_uint32(self.MASK)
+            )
+            if wd < 0:
+                # 監視を追加する前に消えたフォルダ
+                continue
+            self._watches[wd] = path
+
+    def wait(self, timeout: float | None) -> set[Path]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed: set[Path] = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            changed |= self._parse_events(data)
+        return changed
+
+    def _parse_events(self, data: bytes) -> set[Path]:
+        changed: set[Path] = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # イベントを取りこぼしたので、フォルダ全体を同期し直す
+                changed.add(self.folder_path)
+                continue
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            folder = self._watches.get(wd)
+            if folder is None or not name:
+                continue
+            path = folder / name
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._add_tree(path)
+            changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    Detects changes by comparing snapshots of the .md files' stats.
+    Used where inotify is not available.
+    """
+
+    def __init__(self, folder_path: str | Path, interval: float = 5.0) -> None:
+        self.folder_path: Final = Path(folder_path)
+        self.interval: Final = interval
+        self._snapshot = self._take_snapshot()
+        self._next_poll = time.monotonic() + interval
+
+    def _take_snapshot(self) -> dict[Path, tuple[int, int]]:
+        snapshot = {}
+        for path in self.folder_path.rglob("*.md"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout: float | None) -> set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if deadline is not None and deadline < self._next_poll:
+                time.sleep(max(deadline - now, 0))
+                return set()
+            time.sleep(max(self._next_poll - now, 0))
+            self._next_poll = time.monotonic() + self.interval
+            snapshot = self._take_snapshot()
+            changed = {
+                path
+                for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+            if changed:
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+def create_watcher(
+    folder_path: str | Path, poll_interval: float = 5.0, polling: bool = False
+) -> FolderWatcher:
+    """
+    Use inotify where available and fall back to polling.
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(folder_path)
+        except OSError:
+            pass
+    return PollingWatcher(folder_path, interval=poll_interval)
+
+
+def watch_folder(
+    db: TextDBManager,
+    watcher: FolderWatcher,
+    debounce: float = 1.0,
+    max_delay: float = 10.0,
+    on_sync: Callable[[SyncResult], None] | None = None,
+    stop: threading.Event | None = None,
+    retry_delay: float = 5.0,
+    on_error: Callable[[Exception], None] | None = None,
+) -> None:
+    """
+    Apply filesystem changes to the database until stop is set.
+    Events are collected until the folder has been quiet for `debounce`
+    seconds (or `max_delay` has passed), then applied in one transaction.
+    When applying fails, e.g. because another process holds the database,
+    the error goes to on_error and the same paths are tried again after
+    `retry_delay` seconds, together with any newer changes.
+    """
+    # 反映に失敗して、やり直す必要のあるパス
+    pending: set[Path] = set()
+    while stop is None or not stop.is_set():
+        changed = watcher.wait(timeout=retry_delay if pending else 1.0)
+        if not changed and not pending:
+            continue
+        deadline = time.monotonic() + max_delay
+        while changed and time.monotonic() < deadline:
+            more = watcher.wait(timeout=debounce)
+            if not more:
+                break
+            changed |= more
+        paths = pending | changed
+        try:
+            result = db.sync_paths(paths)
+        except (OSError, SQLAlchemyError) as e:
+            pending = paths
+            if on_error is not None:
+                on_error(e)
+            continue
+        pending = set()
+        if on_sync is not None:
+            on_sync(result)
@@ -0,0 +1,123 @@
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Final, Iterator, TextIO
+
+
+class IngestStats:
+    """
+    Per-stage timings and counters for ingest commands, with an optional
+    progress line showing the rate and ETA.
+    Stage times measured in worker processes are summed, so they can add
+    up to more than the elapsed wall time.
+    """
+
+    # 進捗表示を更新する間隔 (秒)
+    refresh_interval: Final = 0.2
+
+    def __init__(self, progress: bool = False, stream: TextIO | None = None) -> None:
+        self.progress: Final = progress
+        self.stream: Final = stream or sys.stderr
+        self.timings: dict[str, float] = defaultdict(float)
+        self.counts: dict[str, int] = defaultdict(int)
+        self.total: int | None = None
+        self.done = 0
+        self._started = time.perf_counter()
+        self._last_render = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float, count: int = 1) -> None:
+        with self._lock:
+            self.timings[name] += seconds
+            self.counts[name] += count
+
+    def merge(self, timings: dict[str, float]) -> None:
+        """
+        Add timings recorded elsewhere, e.g. in a worker process.
+        """
+        for name, seconds in timings.items():
+            self.add_time(name, seconds)
+
+    def set_total(self, total: int) -> None:
+        self.total = total
+        self._render(force=True)
+
+    def advance(self, count: int = 1) -> None:
+        with self._lock:
+            self.done += count
+        self._render()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def _render(self, force: bool = False) -> None:
+        if not self.progress:
+            return
+        now = time.perf_counter()
+        if not force and now - self._last_render < self.refresh_interval:
+            return
+        self._last_render = now
+        elapsed = now - self._started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = f"{self.done}"
+        if self.total is not None:
+            line += f"/{self.total}"
+            if rate > 0:
+                remaining = (self.total - self.done) / rate
+                line += f" files  {rate:,.0f} files/s  ETA {_format_seconds(remaining)}"
+        self.stream.write(f"\r{line}\033[K")
+        self.stream.flush()
+
+    def finish(self) -> None:
+        """
+        Draw the final progress line and move past it.
+        """
+        if self.progress:
+            self._render(force=True)
+            self.stream.write("\n")
+            self.stream.flush()
+
+    def summary(self) -> dict:
+        elapsed = self.elapsed
+        return {
+            "elapsed_seconds": elapsed,
+            "files": self.done,
+            "files_per_second": self.done / elapsed if elapsed > 0 else None,
+            "stages": {
+                name: {"seconds": self.timings[name], "count": self.counts[name]}
+                for name in self.timings
+            },
+        }
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        lines = [f"{'stage':<12} {'seconds':>10} {'count':>8}"]
+        for name, stage in summary["stages"].items():
+            lines.append(f"{name:<12} {stage['seconds']:>10.3f} {stage['count']:>8}")
+        lines.append(
+            f"elapsed {summary['elapsed_seconds']:.3f}s, {summary['files']} files"
+        )
+        return "\n".join(lines)
+
+    def write_json(self, path: str | Path) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
@@ -0,0 +1,605 @@
+import hashlib
+import html
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Final, Iterable, Iterator
+
+from krapp.content_formatter import ContentFormatter
+from krapp.entry_parser import ordered_map
+from krapp.ingest_stats import IngestStats
+from krapp.text_db_manager import EntryHeader, EntryRecord, MonthStat, TextDBManager
+
+# テンプレートを変えたら上げる。すべてのページが作り直される
+TEMPLATE_VERSION: Final = 3
+
+STYLE: Final = """\
+body { font-family: sans-serif; line-height: 1.7; max-width: 46em;
+       margin: 0 auto; padding: 1em; color: #222; }
+nav { font-size: 0.9em; margin-bottom: 1em; }
+nav a { margin-right: 0.5em; }
+pre { background: #f4f4f4; padding: 0.5em; overflow-x: auto; }
+.meta { color: #777; font-size: 0.9em; }
+ul.entries li { margin: 0.3em 0; }
+mark { background: #ffe58a; }
+"""
+
+SEARCH_SCRIPT: Final = """\
+const input = document.getElementById("query");
+const results = document.getElementById("results");
+// 索引は年ごとに分けてあり、新しい年から必要になった分だけ読む
+let shards = null;
+const loaded = new Map();
+let current = 0;
+
+function load(url) {
+  if (!loaded.has(url)) {
+    loaded.set(url, fetch(url).then((response) => response.json()));
+  }
+  return loaded.get(url);
+}
+
+async function search() {
+  const generation = ++current;
+  shards ??= load("search-index.json");
+  const terms = input.value.toLowerCase().split(/\\s+/).filter(Boolean);
+  results.replaceChildren();
+  if (terms.length === 0) return;
+  let count = 0;
+  for (const shard of await shards) {
+    const entries = await load(shard.url);
+    // 読み込むあいだに入力が変わったら、古い検索はやめる
+    if (generation !== current) return;
+    for (const entry of entries) {
+      const text = (entry.title + "\\n" + entry.text).toLowerCase();
+      if (!terms.every((term) => text.includes(term))) continue;
+      const item = document.createElement("li");
+      const link = document.createElement("a");
+      link.href = entry.url;
+      link.textContent = `${entry.date ?? ""} ${entry.title}`;
+      const position = Math.max(entry.text.toLowerCase().indexOf(terms[0]) - 20, 0);
+      const snippet = document.createElement("div");
+      snippet.className = "meta";
+      snippet.textContent = entry.text.slice(position, position + 80);
+      item.append(link, snippet);
+      results.append(item);
+      if (++count >= 100) return;
+    }
+  }
+}
+
+input.addEventListener("input", search);
+"""
+
+
+# 書いたページのパス、書けなかったときのエラー、段階ごとの時間
+PageOutcome = tuple[str, str | None, dict[str, float]]
+
+
+@dataclass
+class SiteBuildResult:
+    output_folder: str
+    # 書き直したページと、入力が変わっていないので飛ばしたページ
+    written_pages: list[str] = field(default_factory=list)
+    skipped_pages: list[str] = field(default_factory=list)
+    # 投稿や月がなくなって消したページ
+    deleted_pages: list[str] = field(default_factory=list)
+    failed_pages: dict[str, str] = field(default_factory=dict)
+
+
+class SiteBuilder:
+    """
+    Renders the entries database as a static HTML site: an index of years,
+    a page per year and month, a page per entry and a client-side search
+    over the text of every entry, sharded by year under search/.
+    """
+
+    # ページごとの入力のハッシュを出力フォルダに記録する
+    manifest_name: Final = ".krapp-site-manifest.json"
+    # 投稿の本文を一度に読み込む件数
+    batch_size: Final = 256
+    # ワーカープロセスに一度に渡す投稿の数
+    render_chunk_size: Final = 32
+
+    def __init__(
+        self, db: TextDBManager, formatter: ContentFormatter | None = None
+    ) -> None:
+        self.db: Final = db
+        self.formatter: Final = formatter or ContentFormatter()
+
+    def _load_manifest(self, output_folder: Path) -> dict[str, str]:
+        manifest_path = output_folder / self.manifest_name
+        if not manifest_path.exists():
+            return {}
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _save_manifest(self, output_folder: Path, manifest: dict[str, str]) -> None:
+        manifest_path = output_folder / self.manifest_name
+        partial_path = manifest_path.with_name(manifest_path.name + ".part")
+        with open(partial_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(partial_path, manifest_path)
+
+    def build_site(
+        self,
+        output_folder: str | Path,
+        jobs: int = 1,
+        force: bool = False,
+        stats: IngestStats | None = None,
+    ) -> SiteBuildResult:
+        """
+        Write the site into output_folder, rendering entry pages in `jobs`
+        worker processes.
+        Each page's inputs are hashed, and a page whose hash matches the last
+        build is skipped unless force is given. Pages of entries and months
+        that no longer exist are removed.
+        """
+        stats = stats or IngestStats()
+        output_folder = Path(output_folder)
+        os.makedirs(output_folder, exist_ok=True)
+        manifest = self._load_manifest(output_folder)
+        result = SiteBuildResult(output_folder=str(output_folder))
+
+        with stats.stage("query"):
+            headers = list(self.db.iter_entry_headers())
+            month_stats = self.db.get_monthly_stats()
+        pages = self._plan_pages(headers, month_stats)
+        shards = self._plan_search_shards(headers)
+        shard_list = [
+            {"url": path, "count": len(entries)} for path, entries in shards.items()
+        ]
+        pages["search-index.json"] = (
+            _digest(shard_list),
+            lambda: json.dumps(shard_list, ensure_ascii=False),
+        )
+        digests: dict[str, str | None] = {
+            path: digest for path, (digest, _) in pages.items()
+        }
+        # ハッシュのない投稿は変わったかどうか分からないので、毎回作り直す
+        entry_digests = {
+            header.id: _entry_digest(header)
+            for header in headers
+            if header.content_hash is not None
+        }
+        for header in headers:
+            digests[_entry_path(header.id)] = entry_digests.get(header.id)
+        for path, entries in shards.items():
+            digests[path] = (
+                _digest([entry_digests[h.id] for h in entries])
+                if all(h.id in entry_digests for h in entries)
+                else None
+            )
+
+        def is_stale(path: str) -> bool:
+            return (
+                force
+                or digests[path] is None
+                or manifest.get(path) != digests[path]
+                or not (output_folder / path).exists()
+            )
+
+        stale = {path for path in digests if is_stale(path)}
+        result.skipped_pages = sorted(digests.keys() - stale)
+        stats.set_total(len(stale))
+
+        def write(path: str, render: Callable[[], str]) -> str | None:
+            try:
+                with stats.stage("render"):
+                    page = render()
+                with stats.stage("write"):
+                    _write_page(output_folder / path, page)
+            except OSError as e:
+                return str(e)
+            finally:
+                stats.advance()
+            return None
+
+        # 一覧のページは数が少なく軽いので、このプロセスで書く
+        outcomes: list[tuple[str, str | None]] = [
+            (path, write(path, render))
+            for path, (_, render) in pages.items()
+            if path in stale
+        ]
+
+        # 本文は書き直す投稿の分だけ、batch_size 件ずつ読む
+        stale_ids = [h.id for h in headers if _entry_path(h.id) in stale]
+        records = self.db.iter_entries(stale_ids, batch_size=self.batch_size)
+
+        def chunks() -> Iterator[list[EntryRecord]]:
+            while chunk := list(islice(records, self.render_chunk_size)):
+                yield chunk
+
+        for chunk in self._write_entry_pages(output_folder, chunks(), jobs):
+            for path, error, timings in chunk:
+                stats.merge(timings)
+                stats.advance()
+                outcomes.append((path, error))
+        # 索引は年ごとの本文を読みながら書き出すので、このスレッドのセッションで作る
+        for path, entries in shards.items():
+            if path not in stale:
+                continue
+            error = None
+            try:
+                with stats.stage("write"):
+                    self._write_search_shard(
+                        output_folder / path, [h.id for h in entries]
+                    )
+            except OSError as e:
+                error = str(e)
+            finally:
+                stats.advance()
+            outcomes.append((path, error))
+
+        for path, error in sorted(outcomes):
+            if error is None:
+                result.written_pages.append(path)
+                # ハッシュのないページも、消すときのために空文字列で記録する
+                manifest[path] = digests[path] or ""
+            else:
+                result.failed_pages[path] = error
+                manifest.pop(path, None)
+
+        for path in sorted(manifest.keys() - digests.keys()):
+            with stats.stage("delete"):
+                (output_folder / path).unlink(missing_ok=True)
+            del manifest[path]
+            result.deleted_pages.append(path)
+        self._save_manifest(output_folder, manifest)
+        stats.finish()
+        return result
+
+    def _write_entry_pages(
+        self, output_folder: Path, chunks: Iterable[list[EntryRecord]], jobs: int
+    ) -> Iterator[list[PageOutcome]]:
+        """
+        Render and write entry pages chunk by chunk, in worker processes when
+        jobs > 1; rendering is pure Python, so threads would share one core.
+        Chunks are yielded in the same order either way.
+        """
+        if jobs <= 1:
+            for chunk in chunks:
+                yield write_entry_pages(self.formatter, output_folder, chunk)
+            return
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=init_render_worker,
+            initargs=(self.formatter, output_folder),
+        ) as executor:
+            yield from ordered_map(
+                executor, write_entry_pages_in_worker, chunks, window=jobs * 2
+            )
+
+    def _plan_pages(
+        self, headers: list[EntryHeader], month_stats: list[MonthStat]
+    ) -> dict[str, tuple[str, Callable[[], str]]]:
+        """
+        The listing and static pages with the hash of their inputs and a
+        function that renders them. Entry pages and the search shards are
+        planned separately because they need the entries' bodies.
+        """
+        months: dict[tuple[int, int], list[EntryHeader]] = defaultdict(list)
+        undated: list[EntryHeader] = []
+        for header in headers:
+            if header.date is None:
+                undated.append(header)
+            else:
+                months[header.date.year, header.date.month].append(header)
+        for entries in months.values():
+            # 月のページは新しい順に並べる
+            entries.sort(key=lambda h: (h.date, h.id), reverse=True)
+        years: dict[int, list[MonthStat]] = defaultdict(list)
+        for month in month_stats:
+            years[month.year].append(month)
+
+        pages: dict[str, tuple[str, Callable[[], str]]] = {
+            "style.css": (_digest(STYLE), lambda: STYLE),
+            "search.js": (_digest(SEARCH_SCRIPT), lambda: SEARCH_SCRIPT),
+            "search.html": (
+                _digest(self._render_search_page()),
+                self._render_search_page,
+            ),
+            "index.html": (
+                _digest([_month_key(m) for m in month_stats], bool(undated)),
+                lambda: self._render_index(years, bool(undated)),
+            ),
+        }
+        for year, year_months in years.items():
+            pages[f"{year}/index.html"] = (
+                _digest([_month_key(m) for m in year_months]),
+                lambda year=year, year_months=year_months: self._render_year(
+                    year, year_months
+                ),
+            )
+        for (year, month), entries in months.items():
+            pages[_month_path(year, month)] = (
+                _digest([_header_key(h) for h in entries]),
+                lambda year=year, month=month, entries=entries: self._render_month(
+                    year, month, entries
+                ),
+            )
+        if undated:
+            pages["undated.html"] = (
+                _digest([_header_key(h) for h in undated]),
+                lambda: self._render_undated(undated),
+            )
+        return pages
+
+    def _plan_search_shards(
+        self, headers: list[EntryHeader]
+    ) -> dict[str, list[EntryHeader]]:
+        """
+        The entries of each search shard, newest year first and the undated
+        entries last, so that the search page can stop early.
+        """
+        years: dict[int, list[EntryHeader]] = defaultdict(list)
+        undated: list[EntryHeader] = []
+        for header in headers:
+            if header.date is None:
+                undated.append(header)
+            else:
+                years[header.date.year].append(header)
+        shards: dict[str, list[EntryHeader]] = {}
+        for year in sorted(years, reverse=True):
+            # iter_entries が返す id 順に揃えておく
+            shards[f"search/{year}.json"] = sorted(years[year], key=lambda h: h.id)
+        if undated:
+            shards["search/undated.json"] = sorted(undated, key=lambda h: h.id)
+        return shards
+
+    def _render_index(self, years: dict[int, list[MonthStat]], undated: bool) -> str:
+        items = []
+        for year in sorted(years, reverse=True):
+            count = sum(month.entry_count for month in years[year])
+            items.append(
+                f'<li><a href="{year}/index.html">{year}年</a>'
+                f' <span class="meta">{count}件</span></li>'
+            )
+        if undated:
+            items.append('<li><a href="undated.html">日付なし</a></li>')
+        body = f"<h1>日記</h1>\n<ul>\n{''.join(items)}\n</ul>"
+        return _page("日記", body, "index.html")
+
+    def _render_year(self, year: int, months: list[MonthStat]) -> str:
+        path = f"{year}/index.html"
+        items = []
+        for month in months:
+            happiness = (
+                f" 幸福度 {month.average_happiness:.2f}"
+                if month.average_happiness is not None
+                else ""
+            )
+            items.append(
+                f'<li><a href="{month.month:02d}/index.html">{month.month}月</a>'
+                f' <span class="meta">{month.entry_count}件'
+                f" {month.char_count}字{happiness}</span></li>"
+            )
+        body = f"<h1>{year}年</h1>\n<ul>\n{''.join(items)}\n</ul>"
+        return _page(f"{year}年", body, path)
+
+    def _render_month(self, year: int, month: int, entries: list[EntryHeader]) -> str:
+        path = _month_path(year, month)
+        body = (
+            f'<p><a href="../index.html">{year}年</a></p>\n'
+            f"<h1>{year}年{month}月</h1>\n{_entry_list(entries, path)}"
+        )
+        return _page(f"{year}年{month}月", body, path)
+
+    def _render_undated(self, entries: list[EntryHeader]) -> str:
+        body = f"<h1>日付なし</h1>\n{_entry_list(entries, 'undated.html')}"
+        return _page("日付なし", body, "undated.html")
+
+    def _render_search_page(self) -> str:
+        body = (
+            "<h1>検索</h1>\n"
+            '<input id="query" type="search" autofocus>\n'
+            '<ul id="results" class="entries"></ul>\n'
+            '<script src="search.js"></script>'
+        )
+        return _page("検索", body, "search.html")
+
+    def _write_search_shard(self, target: Path, entry_ids: list[int]) -> None:
+        """
+        Stream the search records of entry_ids into target, one entry at a
+        time, so that only a batch of bodies is held in memory.
+        """
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = target.with_name(target.name + ".part")
+        records = self.db.iter_entries(entry_ids, batch_size=self.batch_size)
+        with open(partial_path, "w", encoding="utf-8") as file:
+            file.write("[")
+            for n, record in enumerate(records):
+                if n:
+                    file.write(",\n")
+                json.dump(
+                    {
+                        "id": record.id,
+                        "date": record.date.isoformat() if record.date else None,
+                        "title": record.title,
+                        "url": _entry_path(record.id),
+                        # 改行や空白は詰めて、本文全体を入れる
+                        "text": " ".join(record.content.split()),
+                    },
+                    file,
+                    ensure_ascii=False,
+                )
+            file.write("]\n")
+        os.replace(partial_path, target)
+
+
+_worker_formatter: ContentFormatter | None = None
+_worker_output_folder: Path | None = None
+
+
+def init_render_worker(formatter: ContentFormatter, output_folder: Path) -> None:
+    """
+    Process pool initializer: keep one formatter per worker process.
+    """
+    global _worker_formatter, _worker_output_folder
+    _worker_formatter = formatter
+    _worker_output_folder = output_folder
+
+
+def write_entry_pages_in_worker(records: list[EntryRecord]) -> list[PageOutcome]:
+    assert _worker_formatter is not None, "init_render_worker was not called"
+    assert _worker_output_folder is not None
+    return write_entry_pages(_worker_formatter, _worker_output_folder, records)
+
+
+def write_entry_pages(
+    formatter: ContentFormatter, output_folder: Path, records: list[EntryRecord]
+) -> list[PageOutcome]:
+    """
+    Render the pages of records and write them below output_folder.
+    A page that cannot be written is reported, not raised.
+    """
+    outcomes: list[PageOutcome] = []
+    for record in records:
+        path = _entry_path(record.id)
+        start = time.perf_counter()
+        page = _render_entry(formatter, record)
+        rendered = time.perf_counter()
+        timings = {"render": rendered - start}
+        try:
+            _write_page(output_folder / path, page)
+        except OSError as e:
+            outcomes.append((path, str(e), timings))
+            continue
+        timings["write"] = time.perf_counter() - rendered
+        outcomes.append((path, None, timings))
+    return outcomes
+
+
+def _render_entry(formatter: ContentFormatter, record: EntryRecord) -> str:
+    path = _entry_path(record.id)
+    root = _root(path)
+    if record.date is not None:
+        month_path = _month_path(record.date.year, record.date.month)
+        back = (
+            f'<a href="{root}{month_path}">'
+            f"{record.date.year}年{record.date.month}月</a>"
+        )
+    else:
+        back = f'<a href="{root}undated.html">日付なし</a>'
+    body = (
+        f"<p>{back}</p>\n<h1>{html.escape(record.title)}</h1>\n"
+        f'<p class="meta">{record.date or ""} {record.char_count}字</p>\n'
+        f"{markdown_html(formatter.format_content(record.content))}"
+    )
+    return _page(record.title, body, path)
+
+
+def _write_page(target: Path, page: str) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_text(page, encoding="utf-8")
+
+
+_HEADING: Final = re.compile(r"(#{1,6})\s+(.*)")
+
+
+def markdown_html(text: str) -> str:
+    """
+    Turn the markdown produced by ContentFormatter into HTML.
+    Only fenced code blocks, ATX headings and paragraphs are recognised;
+    anything else is shown as escaped text with its line breaks kept.
+    """
+    blocks: list[str] = []
+    paragraph: list[str] = []
+    fence: list[str] | None = None
+
+    def flush() -> None:
+        if paragraph:
+            blocks.append(f"<p>{'<br>'.join(map(html.escape, paragraph))}</p>")
+            paragraph.clear()
+
+    for line in text.split("\n"):
+        if fence is not None:
+            if line.startswith("```"):
+                blocks.append(
+                    f"<pre><code>{html.escape(chr(10).join(fence))}</code></pre>"
+                )
+                fence = None
+            else:
+                fence.append(line)
+        elif line.startswith("```"):
+            flush()
+            fence = []
+        elif heading := _HEADING.match(line):
+            flush()
+            level = len(heading[1])
+            blocks.append(f"<h{level}>{html.escape(heading[2])}</h{level}>")
+        elif line.strip():
+            paragraph.append(line)
+        else:
+            flush()
+    if fence is not None:
+        blocks.append(f"<pre><code>{html.escape(chr(10).join(fence))}</code></pre>")
+    flush()
+    return "\n".join(blocks)
+
+
+def _page(title: str, body: str, path: str) -> str:
+    # どの深さのページからも相対リンクで辿れるようにする
+    root = _root(path)
+    return (
+        "<!DOCTYPE html>\n"
+        '<html lang="ja">\n<head>\n<meta charset="utf-8">\n'
+        '<meta name="viewport" content="width=device-width, initial-scale=1">\n'
+        f"<title>{html.escape(title)}</title>\n"
+        f'<link rel="stylesheet" href="{root}style.css">\n'
+        "</head>\n<body>\n"
+        f'<nav><a href="{root}index.html">トップ</a>'
+        f'<a href="{root}search.html">検索</a></nav>\n'
+        f"{body}\n</body>\n</html>\n"
+    )
+
+
+def _entry_list(entries: Iterable[EntryHeader], path: str) -> str:
+    root = _root(path)
+    items = "".join(
+        f'<li><a href="{root}{_entry_path(entry.id)}">{html.escape(entry.title)}</a>'
+        f' <span class="meta">{entry.date or ""} {entry.char_count}字</span></li>'
+        for entry in entries
+    )
+    return f'<ul class="entries">\n{items}\n</ul>'
+
+
+def _root(path: str) -> str:
+    return "../" * path.count("/")
+
+
+def _entry_path(entry_id: int) -> str:
+    return f"entries/{entry_id}.html"
+
+
+def _month_path(year: int, month: int) -> str:
+    return f"{year}/{month:02d}/index.html"
+
+
+def _header_key(header: EntryHeader) -> list:
+    return [header.id, str(header.date), header.title, header.char_count]
+
+
+def _month_key(month: MonthStat) -> list:
+    return [
+        month.year,
+        month.month,
+        month.entry_count,
+        month.char_count,
+        month.average_happiness,
+    ]
+
+
+def _entry_digest(header: EntryHeader) -> str:
+    return _digest(_header_key(header), header.content_hash)
+
+
+def _digest(*inputs) -> str:
+    data = json.dumps([TEMPLATE_VERSION, *inputs], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
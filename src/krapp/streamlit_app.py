@@ -1,9 +1,43 @@
 import streamlit as st
 
+from krapp.config_manager import (
+    BASE_PATH_CONFIG,
+    ConfigManager,
+    get_db_path,
+    get_write_options,
+)
 from krapp.content_formatter import ContentFormatter
-from krapp.date_extractor import DateExtractor
 from krapp.text_db_manager import TextDBManager
 
+# フォルダとの差分を取り込む間隔 (秒)
+REFRESH_INTERVAL = 300
+# 月の一覧で一度に表示する投稿数
+PAGE_SIZE = 20
+
+
+@st.cache_resource
+def open_db() -> TextDBManager:
+    """
+    Open the database built by `krapp create-db`, shared by all sessions.
+    """
+    config = ConfigManager()
+    # 差分の取り込みでも create-db と同じ設定を使う
+    return TextDBManager(
+        folder_path=config.get_config(BASE_PATH_CONFIG),
+        db_path=get_db_path(config_manager=config),
+        **get_write_options(config_manager=config),
+    )
+
+
+@st.cache_data(ttl=REFRESH_INTERVAL, show_spinner="データベースを更新しています...")
+def refresh_db(_db: TextDBManager) -> None:
+    """
+    Pull changed files into the database, at most once per REFRESH_INTERVAL.
+    """
+    if _db.folder_path is not None:
+        _db.process_folder()
+
+
 # Streamlit セッション状態を使用して選択された年を保持
 if "selected_year" not in st.session_state:
     st.session_state.selected_year = None
@@ -11,26 +45,34 @@ if "selected_year" not in st.session_state:
 if "selected_month" not in st.session_state:
     st.session_state.selected_month = None
 
-if "db" not in st.session_state:
-    with st.spinner("Wait for it...", show_time=True):
-        st.session_state.db = TextDBManager(
-            folder_path="/Users/ishida/Documents/Texts",
-            date_extractor=DateExtractor(),
-        )
-        st.session_state.db.process_folder()
-
-db = st.session_state.db
-
-# データを取得する関数
+db = open_db()
+refresh_db(db)
 
 # サイドバーの設定
 st.sidebar.title("ナビゲーション")
+query = st.sidebar.text_input("全文検索")
+
+# フロントマターの項目で絞り込む (選択中の年があればその年だけ)
+field_key = st.sidebar.selectbox(
+    "項目で絞り込み",
+    [key for key, _ in db.get_field_keys()],
+    index=None,
+    placeholder="項目を選択",
+)
+field_value = None
+if field_key is not None:
+    field_value = st.sidebar.selectbox(
+        "値",
+        [value for value, _ in db.get_field_values(field_key)],
+        index=None,
+        placeholder="値を選択",
+    )
 years = db.get_all_years()
 
 for year in years:
     if year is None:
         continue
-    if st.sidebar.button(year):
+    if st.sidebar.button(str(year)):
         st.session_state.selected_year = year
         st.session_state.selected_month = None
 
@@ -42,21 +84,77 @@ if st.session_state.selected_year:
         if st.sidebar.button(f"{month} 月"):
             st.session_state.selected_month = month
 
-# 選択された年と月に応じたフィルタリング結果を表示
-if st.session_state.selected_year and st.session_state.selected_month:
+# 検索語があれば検索結果を、なければ選択された年と月の投稿を表示
+if query:
+    st.title(f"「{query}」の検索結果")
+    results = db.search(query, markers=("**", "**"))
+    for result in results:
+        st.subheader(result.title)
+        st.write(f"投稿日: {result.date}")
+        st.markdown(result.snippet)
+        st.write("---")
+    if not results:
+        st.write("一致する投稿がありません。")
+elif field_key is not None and field_value is not None:
+    year = st.session_state.selected_year
     st.title(
-        f"{st.session_state.selected_year} 年 {st.session_state.selected_month} 月の投稿一覧"
-    )
-    filtered_entries = db.get_entries_by_year_month(
-        st.session_state.selected_year, st.session_state.selected_month
+        f"{field_key}: {field_value} の投稿一覧" + (f" ({year} 年)" if year else "")
     )
+    summaries = db.find_entries_by_field(field_key, field_value, year=year)
+    for summary in summaries:
+        st.subheader(summary.title)
+        st.write(f"投稿日: {summary.date} / {summary.char_count} 文字")
+        st.caption(summary.snippet)
+        st.write("---")
+    if not summaries:
+        st.write("一致する投稿がありません。")
+elif st.session_state.selected_year and st.session_state.selected_month:
+    year = st.session_state.selected_year
+    month = st.session_state.selected_month
+    st.title(f"{year} 年 {month} 月の投稿一覧")
+    total = db.count_entries_by_year_month(year, month)
 
-    if len(filtered_entries) > 0:
+    if total > 0:
+        page_count = (total + PAGE_SIZE - 1) // PAGE_SIZE
+        page = st.number_input(
+            f"ページ (全 {page_count} ページ, {total} 件)",
+            min_value=1,
+            max_value=page_count,
+            key=f"page-{year}-{month}",
+        )
         formatter = ContentFormatter()
-        for index, row in filtered_entries.iterrows():
-            st.subheader(row["Title"])
-            st.write(f"投稿日: {row['Date']}")
-            st.markdown(formatter.format_content(row["Content"]))
+        summaries = db.list_entries_by_year_month(
+            year, month, offset=(page - 1) * PAGE_SIZE, limit=PAGE_SIZE
+        )
+        for summary in summaries:
+            st.subheader(summary.title)
+            st.write(f"投稿日: {summary.date} / {summary.char_count} 文字")
+            # 本文は開いたときにだけ読み込む
+            if st.toggle("本文を表示", key=f"entry-{summary.id}"):
+                entry = db.get_entry(summary.id)
+                if entry is not None:
+                    st.markdown(formatter.format_content(entry.content))
+            else:
+                st.caption(summary.snippet)
             st.write("---")
     else:
         st.write("この月には投稿がありません。")
+else:
+    # 何も選ばれていなければ、月ごとの集計を表示する
+    st.title("月ごとの統計")
+    months = db.get_monthly_stats()
+    if months:
+        chart = {
+            "月": [f"{m.year}-{m.month:02d}" for m in months],
+            "投稿数": [m.entry_count for m in months],
+            "文字数": [m.char_count for m in months],
+            "平均幸福度": [m.average_happiness for m in months],
+        }
+        st.subheader("投稿数")
+        st.bar_chart(chart, x="月", y="投稿数")
+        st.subheader("文字数")
+        st.bar_chart(chart, x="月", y="文字数")
+        st.subheader("平均幸福度")
+        st.line_chart(chart, x="月", y="平均幸福度")
+    else:
+        st.write("まだ投稿がありません。")
@@ -1,17 +1,132 @@
-from datetime import datetime
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
 from pathlib import Path
-from typing import Final
+from typing import TYPE_CHECKING, Final, Iterable, Iterator, NamedTuple
 
-import pandas as pd
-from sqlalchemy import Column, Date, Integer, String, create_engine, inspect
+from sqlalchemy import (
+    Column,
+    Connection,
+    Date,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    bindparam,
+    create_engine,
+    delete,
+    event,
+    exists,
+    func,
+    insert,
+    inspect,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 
+from krapp.compression import COMPRESSION_METHODS, content_text
 from krapp.date_extractor import DateExtractor
+from krapp.entry_parser import (
+    EntryParser,
+    FieldValue,
+    ParsedFile,
+    ParseOutcome,
+    ParseTask,
+    field_text,
+    flatten_frontmatter,
+    init_worker,
+    ordered_map,
+    ordered_map_async,
+    parse_chunk_in_worker,
+)
+from krapp.ingest_stats import IngestStats
 from krapp.yaml_frontmatter_parser import YamlFrontmatterParser
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 Base = declarative_base()
 
+# entries と同期する全文検索用の索引。
+# 分かち書きされていない日本語でも引けるように trigram で分割する。
+# 本文は圧縮されていることがあるので、展開した本文を見せるビューを索引する。
+FTS_SCHEMA: Final = (
+    "CREATE VIEW IF NOT EXISTS entries_text AS SELECT id, title,"
+    " krapp_content(content, content_blob) AS content FROM entries",
+    "CREATE VIRTUAL TABLE entries_fts USING fts5("
+    "title, content, content='entries_text', content_rowid='id',"
+    " tokenize='trigram')",
+    "CREATE TRIGGER entries_fts_insert AFTER INSERT ON entries BEGIN"
+    " INSERT INTO entries_fts(rowid, title, content)"
+    " VALUES (new.id, new.title, krapp_content(new.content, new.content_blob));"
+    " END",
+    "CREATE TRIGGER entries_fts_delete AFTER DELETE ON entries BEGIN"
+    " INSERT INTO entries_fts(entries_fts, rowid, title, content)"
+    " VALUES ('delete', old.id, old.title,"
+    " krapp_content(old.content, old.content_blob)); END",
+    "CREATE TRIGGER entries_fts_update"
+    " AFTER UPDATE OF title, content, content_blob ON entries BEGIN"
+    " INSERT INTO entries_fts(entries_fts, rowid, title, content)"
+    " VALUES ('delete', old.id, old.title,"
+    " krapp_content(old.content, old.content_blob));"
+    " INSERT INTO entries_fts(rowid, title, content)"
+    " VALUES (new.id, new.title, krapp_content(new.content, new.content_blob));"
+    " END",
+)
+FTS_DROP: Final = (
+    "DROP TRIGGER IF EXISTS entries_fts_insert",
+    "DROP TRIGGER IF EXISTS entries_fts_delete",
+    "DROP TRIGGER IF EXISTS entries_fts_update",
+    "DROP TABLE IF EXISTS entries_fts",
+    "DROP VIEW IF EXISTS entries_text",
+)
+# trigram で検索できる最短の語の長さ
+FTS_MIN_TERM_LENGTH: Final = 3
+
+# entries の変更に合わせて monthly_stats を増減させるトリガー。
+# 日付のない投稿は集計しない。
+_STATS_ADD: Final = (
+    "INSERT INTO monthly_stats"
+    " (year, month, entry_count, char_count, happiness_sum, happiness_count)"
+    " SELECT new.year, new.month, 1, coalesce(new.char_count, 0),"
+    " coalesce(new.happiness_score, 0), new.happiness_score IS NOT NULL"
+    " WHERE new.year IS NOT NULL"
+    " ON CONFLICT (year, month) DO UPDATE SET"
+    " entry_count = entry_count + 1,"
+    " char_count = char_count + excluded.char_count,"
+    " happiness_sum = happiness_sum + excluded.happiness_sum,"
+    " happiness_count = happiness_count + excluded.happiness_count;"
+)
+_STATS_REMOVE: Final = (
+    "UPDATE monthly_stats SET"
+    " entry_count = entry_count - 1,"
+    " char_count = char_count - coalesce(old.char_count, 0),"
+    " happiness_sum = happiness_sum - coalesce(old.happiness_score, 0),"
+    " happiness_count = happiness_count - (old.happiness_score IS NOT NULL)"
+    " WHERE year = old.year AND month = old.month;"
+    " DELETE FROM monthly_stats"
+    " WHERE year = old.year AND month = old.month AND entry_count = 0;"
+)
+MONTHLY_STATS_SCHEMA: Final = (
+    "CREATE TRIGGER IF NOT EXISTS monthly_stats_insert AFTER INSERT ON entries"
+    f" BEGIN {_STATS_ADD} END",
+    "CREATE TRIGGER IF NOT EXISTS monthly_stats_delete AFTER DELETE ON entries"
+    f" BEGIN {_STATS_REMOVE} END",
+    "CREATE TRIGGER IF NOT EXISTS monthly_stats_update"
+    " AFTER UPDATE OF year, month, char_count, happiness_score ON entries"
+    f" BEGIN {_STATS_REMOVE} {_STATS_ADD} END",
+)
+
 
 class Entry(Base):
     __tablename__ = "entries"
@@ -19,22 +134,208 @@ class Entry(Base):
     id = Column(Integer, primary_key=True)
     date = Column(Date, nullable=True)
     title = Column(String, nullable=False)
+    # 圧縮して保存するときは空文字列にして、本文は content_blob に入れる
     content = Column(String, nullable=False)
+    content_blob = Column(LargeBinary, nullable=True)
+    # 元のファイルの sha256。同じ内容の投稿を索引で探すのに使う
+    content_hash = Column(String, nullable=True)
     char_count = Column(Integer)
     happiness_score = Column(Integer, nullable=True)
+    # 年月での絞り込み用に、日付を分解して索引を張っておく
+    year = Column(Integer, nullable=True)
+    month = Column(Integer, nullable=True)
+    day = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_entries_year_month_day", "year", "month", "day"),
+        Index("ix_entries_content_hash", "content_hash"),
+    )
+
+
+class FileManifest(Base):
+    """
+    取り込み済みファイルの一覧。差分更新の判定に使う。
+    """
+
+    __tablename__ = "file_manifest"
+
+    path = Column(String, primary_key=True)
+    size = Column(Integer, nullable=False)
+    mtime_ns = Column(Integer, nullable=False)
+    content_hash = Column(String, nullable=False)
+    # 同じ内容のファイルが一つの投稿を共有することがある
+    entry_id = Column(Integer, ForeignKey("entries.id"), nullable=True, index=True)
+
+
+class EntryField(Base):
+    """
+    フロントマターの各項目。リストは要素ごと、入れ子の辞書は "親.子" のキーで一行にする。
+    """
+
+    __tablename__ = "entry_fields"
+
+    id = Column(Integer, primary_key=True)
+    entry_id = Column(Integer, ForeignKey("entries.id"), nullable=False)
+    key = Column(String, nullable=False)
+    value_type = Column(String, nullable=False)
+    text_value = Column(String, nullable=True)
+    number_value = Column(Float, nullable=True)
+
+    __table_args__ = (
+        # キーと値で絞り込んだ結果を entry_id まで索引だけで読めるようにする
+        Index("ix_entry_fields_key_text", "key", "text_value", "entry_id"),
+        Index("ix_entry_fields_key_number", "key", "number_value", "entry_id"),
+        Index("ix_entry_fields_entry_id", "entry_id"),
+    )
+
+
+class MonthlyStats(Base):
+    """
+    年月ごとの集計。entries のトリガーで常に最新に保たれる。
+    """
+
+    __tablename__ = "monthly_stats"
+
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    entry_count = Column(Integer, nullable=False)
+    char_count = Column(Integer, nullable=False)
+    happiness_sum = Column(Integer, nullable=False)
+    happiness_count = Column(Integer, nullable=False)
+
+
+class Setting(Base):
+    """
+    データベースごとの設定。どのコマンドから開いても同じように取り込むために保存する。
+    """
+
+    __tablename__ = "settings"
+
+    name = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+
+
+class ManifestRecord(NamedTuple):
+    size: int
+    mtime_ns: int
+    content_hash: str
+    entry_id: int | None
+
+
+@dataclass(frozen=True, slots=True)
+class EntrySummary:
+    """
+    A row of a month listing, without the entry's body.
+    """
+
+    id: int
+    date: date | None
+    title: str
+    char_count: int
+    snippet: str
+
+
+@dataclass(frozen=True, slots=True)
+class EntryRecord:
+    id: int
+    date: date | None
+    title: str
+    content: str
+    char_count: int
+    happiness_score: int | None
+
+
+@dataclass(frozen=True, slots=True)
+class EntryHeader:
+    """
+    An entry without its body, with the hash of the file it came from.
+    content_hash is None for entries stored before hashes were kept.
+    """
+
+    id: int
+    date: date | None
+    title: str
+    char_count: int
+    content_hash: str | None
+
+
+@dataclass(frozen=True, slots=True)
+class SearchResult:
+    id: int
+    date: date | None
+    title: str
+    snippet: str
+    rank: float
+
+
+@dataclass(frozen=True, slots=True)
+class MonthStat:
+    year: int
+    month: int
+    entry_count: int
+    char_count: int
+    average_happiness: float | None
+
+
+@dataclass
+class SyncResult:
+    added: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    # 既にある投稿と同じ内容で、新しい投稿を作らなかったファイルの数
+    duplicates: int = 0
+
+
+# 同じ内容のファイルの扱い。keep は別々の投稿にし、link は一つの投稿を共有させ、
+# skip は最初のファイルだけを取り込む
+DEDUP_POLICIES: Final = ("keep", "link", "skip")
 
 
 class TextDBManager:
+    # ワーカープロセスに一度に渡すファイル数
+    parse_chunk_size: Final = 64
+    # 一括取り込みの間だけ適用する、接続ごとの SQLite の設定
+    bulk_load_pragmas: Final = {
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+    }
+
     def __init__(
         self,
-        folder_path: str | Path,
-        date_extractor: DateExtractor,
-        yaml_parser: YamlFrontmatterParser,
+        folder_path: str | Path | None = None,
+        date_extractor: DateExtractor | None = None,
+        yaml_parser: YamlFrontmatterParser | None = None,
         db_path: str | Path | None = None,
+        recreate: bool = False,
+        batch_size: int = 500,
+        dedup: str | None = None,
+        compression: str | None = None,
+        compression_level: int | None = None,
     ):
-        self.folder_path: Final = Path(folder_path)
-        self.date_extractor: Final = date_extractor
-        self.yaml_parser: Final = yaml_parser
+        # 検索や閲覧だけなら folder_path は不要
+        self.folder_path: Final = Path(folder_path) if folder_path else None
+        self.date_extractor: Final = date_extractor or DateExtractor()
+        self.yaml_parser: Final = yaml_parser or YamlFrontmatterParser()
+        if dedup is not None and dedup not in DEDUP_POLICIES:
+            raise ValueError(
+                f"dedup must be one of {', '.join(DEDUP_POLICIES)}, not {dedup!r}"
+            )
+        if compression is not None and compression not in COMPRESSION_METHODS:
+            raise ValueError(
+                f"compression must be one of {', '.join(COMPRESSION_METHODS)},"
+                f" not {compression!r}"
+            )
+        self.batch_size: Final = batch_size
+        # 書き込むときの圧縮方式。読み込みはどちらの形式でも扱える
+        self.compression: Final = compression
+        self.entry_parser: Final = EntryParser(
+            self.date_extractor,
+            self.yaml_parser,
+            compression=compression,
+            compression_level=compression_level,
+        )
 
         if db_path is None:
             db_url = "sqlite:///:memory:"
@@ -42,89 +343,1231 @@ class TextDBManager:
             db_url = f"sqlite:///{db_path}"
 
         self.engine: Final = create_engine(db_url)
-        self._create_tables()
+        event.listen(self.engine, "connect", _register_functions)
+        if db_path is not None:
+            self._enable_wal()
+        self._create_tables(recreate=recreate)
+        self.dedup: Final = self._dedup_policy(dedup)
 
-        self.session: Final = sessionmaker(bind=self.engine)()
+        # Streamlit などで複数スレッドから共有されても安全なように、
+        # セッションはスレッドごとに持つ
+        self.session: Final = scoped_session(sessionmaker(bind=self.engine))
+        self._write_lock: Final = threading.Lock()
 
-    def _create_tables(self, recreate: bool = True):
-        if recreate and inspect(self.engine).has_table("entries"):
-            Entry.__table__.drop(self.engine)
+    def _enable_wal(self) -> None:
+        """
+        Switch the database file to WAL once; the mode is stored in the file.
+        Readers such as the Streamlit app then do not block a load, and a
+        load does not block them.
+        """
+        with self.engine.connect() as conn:
+            if conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal":
+                return
+            try:
+                conn.exec_driver_sql("PRAGMA journal_mode = WAL")
+            except OperationalError as e:
+                # 他の接続が使用中なら、次に開いたときに切り替える
+                print(f"Could not switch the database to WAL: {e}")
+
+    def _dedup_policy(self, dedup: str | None) -> str:
+        """
+        Store the given dedup policy in the database, or return the stored
+        one when none is given, so that later syncs such as krapp watch
+        treat copies the way the database was built.
+        """
+        settings = Setting.__table__
+        with self.engine.begin() as conn:
+            stored = conn.execute(
+                select(settings.c.value).where(settings.c.name == "dedup")
+            ).scalar()
+            if dedup is None:
+                return stored if stored in DEDUP_POLICIES else "keep"
+            if stored is None:
+                conn.execute(insert(settings).values(name="dedup", value=dedup))
+            elif stored != dedup:
+                conn.execute(
+                    update(settings)
+                    .where(settings.c.name == "dedup")
+                    .values(value=dedup)
+                )
+        return dedup
 
+    def _create_tables(self, recreate: bool = False):
+        if recreate:
+            with self.engine.begin() as conn:
+                for statement in FTS_DROP:
+                    conn.exec_driver_sql(statement)
+            Base.metadata.drop_all(self.engine)
+
+        existing = set(inspect(self.engine).get_table_names())
         Base.metadata.create_all(self.engine)
+        self._migrate(new_tables=set(Base.metadata.tables) - existing)
+        self.fts_enabled = self._create_fts()
+
+    def _create_fts(self) -> bool:
+        """
+        Create the full-text index if needed.
+        Returns False when this SQLite build has no FTS5 trigram tokenizer.
+        """
+        with self.engine.connect() as conn:
+            schema = conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE name = 'entries_fts'"
+            ).scalar()
+        if schema is not None and "entries_text" in schema:
+            return True
+        try:
+            with self.engine.begin() as conn:
+                # 本文を直接索引していた頃の索引は作り直す
+                for statement in FTS_DROP:
+                    conn.exec_driver_sql(statement)
+                for statement in FTS_SCHEMA:
+                    conn.exec_driver_sql(statement)
+                # 既存のデータベースに後から索引を追加した場合
+                conn.exec_driver_sql(
+                    "INSERT INTO entries_fts(entries_fts) VALUES ('rebuild')"
+                )
+        except OperationalError as e:
+            print(f"Full-text search is disabled: {e}")
+            return False
+        return True
+
+    def _migrate(self, new_tables: set[str] = frozenset()) -> None:
+        """
+        Bring databases created by older versions up to the current schema.
+        """
+        columns = {
+            column["name"] for column in inspect(self.engine).get_columns("entries")
+        }
+        with self.engine.begin() as conn:
+            if "year" not in columns:
+                for name in ("year", "month", "day"):
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE entries ADD COLUMN {name} INTEGER"
+                    )
+                conn.exec_driver_sql(
+                    "UPDATE entries SET"
+                    " year = CAST(substr(date, 1, 4) AS INTEGER),"
+                    " month = CAST(substr(date, 6, 2) AS INTEGER),"
+                    " day = CAST(substr(date, 9, 2) AS INTEGER)"
+                    " WHERE date IS NOT NULL"
+                )
+            if "content_blob" not in columns:
+                conn.exec_driver_sql("ALTER TABLE entries ADD COLUMN content_blob BLOB")
+            if "content_hash" not in columns:
+                conn.exec_driver_sql(
+                    "ALTER TABLE entries ADD COLUMN content_hash VARCHAR"
+                )
+                conn.exec_driver_sql(
+                    "UPDATE entries SET content_hash = (SELECT content_hash"
+                    " FROM file_manifest WHERE entry_id = entries.id LIMIT 1)"
+                )
+            for index in [*Entry.__table__.indexes, *FileManifest.__table__.indexes]:
+                index.create(conn, checkfirst=True)
+            if "entry_fields" in new_tables:
+                self._backfill_fields(conn)
+            for statement in MONTHLY_STATS_SCHEMA:
+                conn.exec_driver_sql(statement)
+            if "monthly_stats" in new_tables:
+                conn.exec_driver_sql(
+                    "INSERT INTO monthly_stats"
+                    " SELECT year, month, count(*), sum(coalesce(char_count, 0)),"
+                    " sum(coalesce(happiness_score, 0)), count(happiness_score)"
+                    " FROM entries WHERE year IS NOT NULL GROUP BY year, month"
+                )
 
-    def _save_entry(self, title: str, content: str):
-        # 文字数をカウント
-        char_count = len(content) if content else 0
-        # 日付を抽出
-        date = self._extract_date(title, content)
-        frontmatter = self.yaml_parser.parse(content)
-        entry = Entry(
-            date=date,
-            title=title,
-            content=content,
-            char_count=char_count,
-            happiness_score=frontmatter.get("happiness score", None),
-        )
-        self.session.add(entry)
-        self.session.commit()
-        print(f"Saved entry: {title}: {date}")
-
-    def _extract_date(self, title: str, content: str) -> datetime | None:
-        date_list = self.date_extractor.extract_dates(f"{title}\n{content}")
-        # 日付が見つからない場合は、Noneを返す
-        if len(date_list) == 0:
-            return None
-        # 最初に見つかった日付を返す
-        return date_list[0]
-
-    def process_folder(self):
-        for file_path in self.folder_path.rglob("*.md"):
-            if not file_path.is_file():
+    def _backfill_fields(self, conn: Connection) -> None:
+        """
+        Fill entry_fields from the stored contents of existing entries,
+        so older databases do not have to re-read their files.
+        """
+        entries = Entry.__table__
+        rows = []
+        for entry_id, content in conn.execute(
+            select(entries.c.id, _content(entries.c))
+        ):
+            try:
+                frontmatter = self.yaml_parser.parse(content)
+                fields = flatten_frontmatter(frontmatter)
+            except Exception:
+                # 取り込めないフロントマターは次の更新で読み直す
                 continue
+            rows.extend(_field_rows(entry_id, fields))
+        if rows:
+            conn.execute(insert(EntryField.__table__), rows)
+
+    @contextmanager
+    def _bulk_load(self) -> Iterator[Connection]:
+        """
+        Open a connection tuned for bulk loading.
+        The previous pragma values are restored when the load ends; a
+        failure to restore them does not fail the finished load.
+        """
+        with self.engine.connect() as conn:
+            previous = {
+                name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in self.bulk_load_pragmas
+            }
+            for name, value in self.bulk_load_pragmas.items():
+                conn.exec_driver_sql(f"PRAGMA {name} = {value}")
+            conn.commit()
             try:
-                title = file_path.stem
-                content = file_path.read_text(encoding="utf-8")
-                self._save_entry(
-                    title=title,
-                    content=content,
+                yield conn
+            finally:
+                conn.rollback()
+                try:
+                    for name, value in previous.items():
+                        conn.exec_driver_sql(f"PRAGMA {name} = {value}")
+                    conn.commit()
+                except OperationalError as e:
+                    print(f"Could not restore the SQLite settings: {e}")
+                    # 設定が残った接続はプールに戻さない
+                    conn.invalidate()
+
+    def _load_manifest(
+        self,
+        conn: Connection,
+        keys: Iterable[str] | None = None,
+        prefixes: Iterable[str] = (),
+    ) -> dict[str, ManifestRecord]:
+        """
+        Load the whole manifest, or only the given keys and the keys below
+        the given folder prefixes.
+        """
+        manifest = FileManifest.__table__
+        query = select(
+            manifest.c.path,
+            manifest.c.size,
+            manifest.c.mtime_ns,
+            manifest.c.content_hash,
+            manifest.c.entry_id,
+        )
+        if keys is not None:
+            conditions = [manifest.c.path.in_(list(keys))]
+            for prefix in prefixes:
+                folder = "" if prefix == "." else f"{prefix}/"
+                conditions.append(
+                    func.substr(manifest.c.path, 1, len(folder)) == folder
                 )
-            except Exception as e:
-                print(f"Error processing file {file_path}: {e}")
+            query = query.where(or_(*conditions))
+        rows = conn.execute(query)
+        return {row.path: ManifestRecord(*row[1:]) for row in rows}
 
-    def get_entries_by_year_month(self, year, month):
-        query = (
-            self.session.query(Entry)
-            .filter(Entry.date.isnot(None), Entry.date.like(f"{year}-{month:02}-%"))
-            .order_by(Entry.date.desc())
-        )
-        rows = [
-            {
-                "ID": entry.id,
-                "Date": entry.date,
-                "Title": entry.title,
-                "Content": entry.content,
+    def _write_batch(
+        self,
+        conn: Connection,
+        batch: list[ParsedFile],
+        manifest: dict[str, ManifestRecord],
+        result: SyncResult,
+    ) -> None:
+        """
+        Write one chunk of parsed files. The caller owns the transaction.
+        With the link or skip dedup policies a file whose content is already
+        stored points at (or ignores) the existing entry instead of adding
+        a copy. An entry shared by several files is never changed in place.
+        """
+        entries = Entry.__table__
+        manifest_table = FileManifest.__table__
+        dedup = self.dedup != "keep"
+        # 前のバッチで複製が取り込まれて、記録が変わっているかもしれない
+        manifest.update(self._load_manifest(conn, [parsed.path for parsed in batch]))
+        owned = {
+            manifest[parsed.path].entry_id
+            for parsed in batch
+            if parsed.path in manifest and parsed.content is not None
+        } - {None}
+        # 同じ内容の投稿。値は投稿の ID か、このバッチで追加するファイルのパス
+        canonical: dict[str, int | str] = {}
+        if dedup:
+            canonical.update(
+                self._find_by_hash(
+                    conn,
+                    {p.content_hash for p in batch if p.content is not None},
+                )
+            )
+        refcounts = self._count_links(
+            conn, owned | {i for i in canonical.values() if isinstance(i, int)}
+        )
+        new_entries: list[ParsedFile] = []
+        changed_entries: list[dict] = []
+        new_records: list[dict] = []
+        changed_records: list[dict] = []
+        changed_fields: list[dict] = []
+        released: set[int] = set()
+        # 書き換えて、もう保存されなくなる内容のハッシュ
+        replaced: set[str] = set()
+        # ファイルごとの投稿の ID。追加する投稿はパスで表す
+        targets: dict[str, int | str | None] = {}
+
+        for parsed in batch:
+            record = manifest.get(parsed.path)
+            entry_id = record.entry_id if record is not None else None
+            target: int | str | None = entry_id
+            duplicate = canonical.get(parsed.content_hash) if dedup else None
+            if parsed.content is None:
+                # touch されただけなので、統計情報だけ更新する
+                result.unchanged += 1
+            elif duplicate is not None and duplicate != entry_id:
+                # 同じ内容の投稿が既にある
+                target = duplicate if self.dedup == "link" else None
+                if isinstance(duplicate, int):
+                    # skip でも、このバッチの中では元の投稿を書き換えさせない
+                    refcounts[duplicate] = refcounts.get(duplicate, 0) + 1
+                result.duplicates += 1
+            elif entry_id is not None and refcounts.get(entry_id, 0) <= 1:
+                changed_entries.append({"b_id": entry_id, **parsed.entry_values()})
+                changed_fields.extend(_field_rows(entry_id, parsed.fields))
+                replaced.add(record.content_hash)
+                # 書き換える前の内容にはもうリンクさせない
+                for content_hash in [h for h, i in canonical.items() if i == entry_id]:
+                    del canonical[content_hash]
+                canonical[parsed.content_hash] = entry_id
+                result.updated += 1
+            else:
+                new_entries.append(parsed)
+                target = parsed.path
+                canonical.setdefault(parsed.content_hash, parsed.path)
+                if entry_id is not None:
+                    result.updated += 1
+                else:
+                    result.added += 1
+            if target != entry_id and entry_id is not None:
+                refcounts[entry_id] = refcounts.get(entry_id, 1) - 1
+                released.add(entry_id)
+            targets[parsed.path] = target
+
+            values = {
+                "b_path": parsed.path,
+                "size": parsed.size,
+                "mtime_ns": parsed.mtime_ns,
+                "content_hash": parsed.content_hash,
+                "entry_id": entry_id,
             }
-            for entry in query.all()
+            if record is None:
+                new_records.append(values)
+            else:
+                changed_records.append(values)
+
+        entry_ids: dict[str, int] = {}
+        if new_entries:
+            ids = conn.execute(
+                insert(entries).returning(entries.c.id, sort_by_parameter_order=True),
+                [parsed.entry_values() for parsed in new_entries],
+            ).scalars()
+            entry_ids.update(zip((parsed.path for parsed in new_entries), ids))
+        for values in new_records + changed_records:
+            target = targets[values["b_path"]]
+            values["entry_id"] = entry_ids.get(target, target)
+        if changed_entries:
+            conn.execute(
+                update(entries).where(entries.c.id == bindparam("b_id")),
+                changed_entries,
+            )
+            self._delete_fields(conn, [values["b_id"] for values in changed_entries])
+        field_rows = changed_fields
+        for parsed in new_entries:
+            field_rows.extend(_field_rows(entry_ids[parsed.path], parsed.fields))
+        if field_rows:
+            conn.execute(insert(EntryField.__table__), field_rows)
+        if new_records:
+            conn.execute(
+                insert(manifest_table).values(path=bindparam("b_path")),
+                new_records,
+            )
+        if changed_records:
+            conn.execute(
+                update(manifest_table).where(
+                    manifest_table.c.path == bindparam("b_path")
+                ),
+                changed_records,
+            )
+        self._release_entries(conn, released, result)
+        self._adopt_copies(conn, replaced, result)
+
+    def _delete_files(
+        self,
+        conn: Connection,
+        keys: list[str],
+        manifest: dict[str, ManifestRecord],
+        result: SyncResult,
+    ) -> None:
+        """
+        Delete the entries of vanished files. The caller owns the transaction.
+        """
+        if not keys:
+            return
+        manifest_table = FileManifest.__table__
+        manifest.update(self._load_manifest(conn, keys))
+        conn.execute(
+            delete(manifest_table).where(manifest_table.c.path == bindparam("b_path")),
+            [{"b_path": key} for key in keys],
+        )
+        self._release_entries(
+            conn, {manifest[key].entry_id for key in keys} - {None}, result
+        )
+        result.deleted += len(keys)
+
+    @staticmethod
+    def _find_by_hash(conn: Connection, hashes: set[str]) -> dict[str, int]:
+        """
+        The oldest entry for each of the given content hashes.
+        """
+        if not hashes:
+            return {}
+        entries = Entry.__table__
+        rows = conn.execute(
+            select(entries.c.content_hash, func.min(entries.c.id))
+            .where(entries.c.content_hash.in_(list(hashes)))
+            .group_by(entries.c.content_hash)
+        )
+        return {content_hash: entry_id for content_hash, entry_id in rows}
+
+    @staticmethod
+    def _count_links(conn: Connection, entry_ids: set[int]) -> dict[int, int]:
+        """
+        How many files point at each of the given entries.
+        """
+        if not entry_ids:
+            return {}
+        manifest_table = FileManifest.__table__
+        rows = conn.execute(
+            select(manifest_table.c.entry_id, func.count())
+            .where(manifest_table.c.entry_id.in_(list(entry_ids)))
+            .group_by(manifest_table.c.entry_id)
+        )
+        return {entry_id: count for entry_id, count in rows}
+
+    def _release_entries(
+        self, conn: Connection, entry_ids: set[int], result: SyncResult
+    ) -> None:
+        """
+        Delete those of the given entries that no file points at any more.
+        """
+        if not entry_ids:
+            return
+        entries = Entry.__table__
+        linked = self._count_links(conn, entry_ids)
+        orphans = sorted(entry_id for entry_id in entry_ids if entry_id not in linked)
+        if not orphans:
+            return
+        hashes = conn.execute(
+            select(entries.c.content_hash).where(entries.c.id.in_(orphans))
+        ).scalars()
+        hashes = {content_hash for content_hash in hashes if content_hash}
+        self._delete_fields(conn, orphans)
+        conn.execute(
+            delete(entries).where(entries.c.id == bindparam("b_id")),
+            [{"b_id": entry_id} for entry_id in orphans],
+        )
+        self._adopt_copies(conn, hashes, result)
+
+    def _adopt_copies(
+        self, conn: Connection, hashes: set[str], result: SyncResult
+    ) -> None:
+        """
+        Read again the files skipped as copies of content that is no longer
+        stored, in the same transaction. The first copy in path order that
+        still exists and can be read gets the entry; the others stay skipped
+        as its duplicates.
+        """
+        hashes = hashes - self._find_by_hash(conn, hashes).keys()
+        if not hashes:
+            return
+        folder_path = self._require_folder()
+        manifest_table = FileManifest.__table__
+        rows = conn.execute(
+            select(
+                manifest_table.c.path,
+                manifest_table.c.size,
+                manifest_table.c.mtime_ns,
+                manifest_table.c.content_hash,
+                manifest_table.c.entry_id,
+            )
+            .where(
+                manifest_table.c.entry_id.is_(None),
+                manifest_table.c.content_hash.in_(list(hashes)),
+            )
+            .order_by(manifest_table.c.path)
+        )
+        copies: dict[str, list[tuple[str, ManifestRecord]]] = {}
+        for row in rows:
+            # 消えたファイルは、この同期か次の同期で削除される
+            if (folder_path / row.path).is_file():
+                copies.setdefault(row.content_hash, []).append(
+                    (row.path, ManifestRecord(*row[1:]))
+                )
+
+        while copies:
+            # 内容ごとに、まだ試していない最初の複製を読む
+            records = dict(candidates.pop(0) for candidates in copies.values())
+            outcomes = self.entry_parser.parse_chunk(
+                [(folder_path / path, path, None) for path in records]
+            )
+            parsed = [outcome for _, outcome, _ in outcomes if outcome is not None]
+            unreadable = [
+                path
+                for path, (_, outcome, _) in zip(records, outcomes)
+                if outcome is None
+            ]
+            if unreadable:
+                # 読めなかった複製は、次の同期で読み直させる
+                conn.execute(
+                    update(manifest_table)
+                    .where(manifest_table.c.path == bindparam("b_path"))
+                    .values(size=-1, content_hash=""),
+                    [{"b_path": path} for path in unreadable],
+                )
+            if parsed:
+                self._write_batch(conn, parsed, records, result)
+            # 読めなかったり書き換えられていたりした内容は、次の複製で試す
+            stored = self._find_by_hash(conn, set(copies)).keys()
+            copies = {
+                content_hash: candidates
+                for content_hash, candidates in copies.items()
+                if content_hash not in stored and candidates
+            }
+
+    def _adopt_lost_copies(self, conn: Connection, result: SyncResult) -> None:
+        """
+        Adopt the skipped copies whose content no entry holds, e.g. after an
+        older version lost it.
+        """
+        entries = Entry.__table__
+        manifest_table = FileManifest.__table__
+        hashes = conn.execute(
+            select(manifest_table.c.content_hash)
+            .where(
+                manifest_table.c.entry_id.is_(None),
+                manifest_table.c.content_hash != "",
+                ~exists().where(
+                    entries.c.content_hash == manifest_table.c.content_hash
+                ),
+            )
+            .distinct()
+        ).scalars()
+        self._adopt_copies(conn, set(hashes), result)
+
+    def _delete_untracked_entries(self, conn: Connection) -> int:
+        """
+        Delete the entries no file points at. Databases built before the
+        manifest existed have only such entries; a full sync reads their
+        files again. Returns the number of entries deleted.
+        """
+        entries = Entry.__table__
+        manifest_table = FileManifest.__table__
+        untracked = (
+            conn.execute(
+                select(entries.c.id).where(
+                    ~exists().where(manifest_table.c.entry_id == entries.c.id)
+                )
+            )
+            .scalars()
+            .all()
+        )
+        if untracked:
+            self._delete_fields(conn, untracked)
+            conn.execute(
+                delete(entries).where(entries.c.id == bindparam("b_id")),
+                [{"b_id": entry_id} for entry_id in untracked],
+            )
+        return len(untracked)
+
+    @staticmethod
+    def _delete_fields(conn: Connection, entry_ids: list[int]) -> None:
+        fields = EntryField.__table__
+        conn.execute(
+            delete(fields).where(fields.c.entry_id == bindparam("b_id")),
+            [{"b_id": entry_id} for entry_id in entry_ids],
+        )
+
+    def _scan_folder(
+        self,
+        folder_path: Path,
+        manifest: dict[str, ManifestRecord],
+        result: SyncResult,
+    ) -> tuple[list[tuple[Path, str]], list[str]]:
+        """
+        Walk the folder and compare file stats with the manifest.
+        Returns the files that have to be read and the keys of vanished files.
+        """
+        keys = [
+            file_path.relative_to(folder_path).as_posix()
+            for file_path in folder_path.rglob("*.md")
+            if file_path.is_file()
         ]
-        return pd.DataFrame(rows)
+        candidates = self._changed_files(folder_path, sorted(keys), manifest, result)
+        seen = set(keys)
+        vanished = [key for key in manifest if key not in seen]
+        return candidates, vanished
+
+    @staticmethod
+    def _changed_files(
+        folder_path: Path,
+        keys: Iterable[str],
+        manifest: dict[str, ManifestRecord],
+        result: SyncResult,
+    ) -> list[tuple[Path, str]]:
+        """
+        Keep the existing files whose size or mtime differs from the manifest.
+        """
+        candidates = []
+        for key in keys:
+            file_path = folder_path / key
+            record = manifest.get(key)
+            if record is not None:
+                try:
+                    stat = file_path.stat()
+                except FileNotFoundError:
+                    # 一覧を作った後に消えたファイルは、次の同期で削除する
+                    continue
+                if (record.size, record.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                    result.unchanged += 1
+                    continue
+            candidates.append((file_path, key))
+        return candidates
+
+    def _parse_files(
+        self,
+        candidates: list[tuple[Path, str]],
+        manifest: dict[str, ManifestRecord],
+        result: SyncResult,
+        jobs: int,
+        stats: IngestStats,
+    ) -> Iterator[ParsedFile]:
+        """
+        Parse the candidate files, in worker processes when jobs > 1.
+        Files are yielded in the same order either way.
+        """
+        tasks = self._parse_tasks(candidates, manifest)
+        chunks = [
+            tasks[start : start + self.parse_chunk_size]
+            for start in range(0, len(tasks), self.parse_chunk_size)
+        ]
+
+        if jobs <= 1:
+            yield from self._collect(
+                map(self.entry_parser.parse_chunk, chunks), result, stats
+            )
+            return
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=init_worker, initargs=(self.entry_parser,)
+        ) as executor:
+            outcomes = ordered_map(
+                executor, parse_chunk_in_worker, chunks, window=jobs * 2
+            )
+            yield from self._collect(outcomes, result, stats)
+
+    @staticmethod
+    def _parse_tasks(
+        candidates: list[tuple[Path, str]], manifest: dict[str, ManifestRecord]
+    ) -> list[ParseTask]:
+        tasks: list[ParseTask] = []
+        for file_path, key in candidates:
+            record = manifest.get(key)
+            tasks.append((file_path, key, record.content_hash if record else None))
+        return tasks
+
+    async def _ingest_async(
+        self,
+        conn: Connection,
+        candidates: list[tuple[Path, str]],
+        manifest: dict[str, ManifestRecord],
+        result: SyncResult,
+        concurrency: int,
+        stats: IngestStats,
+    ) -> None:
+        """
+        Read and parse the candidate files in `concurrency` threads and write
+        them in file order, batch_size at a time, as the serial path does.
+        """
+        # asyncio.to_thread の既定のスレッド数を同時読み込み数に合わせる
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=concurrency)
+        )
+        tasks = self._parse_tasks(candidates, manifest)
+        outcomes = ordered_map_async(
+            lambda task: self.entry_parser.parse_chunk([task]),
+            tasks,
+            concurrency=concurrency,
+            window=concurrency * 2,
+        )
+        batch: list[ParsedFile] = []
+        async for chunk in outcomes:
+            for parsed in self._collect([chunk], result, stats):
+                batch.append(parsed)
+                if len(batch) >= self.batch_size:
+                    # SQLite の接続はスレッドをまたげないので、書き込みはこのスレッドで行う。
+                    # その間も読み始めたファイルは読み進められる
+                    self._write_chunk(conn, batch, manifest, result, stats)
+                    batch = []
+        if batch:
+            self._write_chunk(conn, batch, manifest, result, stats)
+
+    @staticmethod
+    def _collect(
+        outcomes: Iterable[list[ParseOutcome]],
+        result: SyncResult,
+        stats: IngestStats,
+    ) -> Iterator[ParsedFile]:
+        for chunk in outcomes:
+            for file_path, parsed, error in chunk:
+                if parsed is None:
+                    result.failed += 1
+                    stats.advance()
+                    print(f"Error processing file {file_path}: {error}")
+                    continue
+                stats.merge(parsed.timings)
+                yield parsed
+
+    def process_folder(
+        self,
+        jobs: int = 1,
+        stats: IngestStats | None = None,
+        concurrency: int | None = None,
+    ) -> SyncResult:
+        """
+        Synchronize the database with the .md files in the folder.
+        Only new or modified files are read; entries of vanished files are deleted,
+        as are entries no file points at, e.g. those of a database built
+        before the manifest existed. Rows are written with executemany in chunks of batch_size per transaction.
+        With jobs > 1 files are read and parsed in a process pool while this
+        process stays the single writer. With concurrency, files are instead
+        read by an asyncio pipeline with that many reads in flight, which
+        hides the latency of slow or network storage. Every mode produces
+        the same database. Stage timings go to stats.
+        """
+        folder_path = self._require_folder()
+        if concurrency is not None and (concurrency < 1 or jobs > 1):
+            raise ValueError("concurrency must be at least 1 and used with jobs=1")
+        stats = stats or IngestStats()
+        # 書き込むのは常に一つのスレッドだけ
+        with self._write_lock:
+            result = SyncResult()
+            # 書き込み中にセッションがトランザクションを握らないようにする
+            self.session.close()
+            with self._bulk_load() as conn:
+                with stats.stage("delete"), conn.begin():
+                    result.deleted += self._delete_untracked_entries(conn)
+                    if self.dedup == "skip":
+                        self._adopt_lost_copies(conn, result)
+                manifest = self._load_manifest(conn)
+                conn.commit()
+                with stats.stage("walk"):
+                    candidates, vanished = self._scan_folder(
+                        folder_path, manifest, result
+                    )
+                stats.set_total(len(candidates) + len(vanished))
+
+                if concurrency is not None:
+                    asyncio.run(
+                        self._ingest_async(
+                            conn, candidates, manifest, result, concurrency, stats
+                        )
+                    )
+                else:
+                    self._write_parsed(conn, candidates, manifest, result, jobs, stats)
+
+                for start in range(0, len(vanished), self.batch_size):
+                    keys = vanished[start : start + self.batch_size]
+                    with stats.stage("delete"), conn.begin():
+                        self._delete_files(conn, keys, manifest, result)
+                    stats.advance(len(keys))
+        stats.finish()
+        return result
+
+    def _write_parsed(
+        self,
+        conn: Connection,
+        candidates: list[tuple[Path, str]],
+        manifest: dict[str, ManifestRecord],
+        result: SyncResult,
+        jobs: int,
+        stats: IngestStats,
+    ) -> None:
+        batch: list[ParsedFile] = []
+        for parsed in self._parse_files(candidates, manifest, result, jobs, stats):
+            batch.append(parsed)
+            if len(batch) >= self.batch_size:
+                self._write_chunk(conn, batch, manifest, result, stats)
+                batch = []
+        if batch:
+            self._write_chunk(conn, batch, manifest, result, stats)
+
+    def _write_chunk(
+        self,
+        conn: Connection,
+        batch: list[ParsedFile],
+        manifest: dict[str, ManifestRecord],
+        result: SyncResult,
+        stats: IngestStats,
+    ) -> None:
+        with stats.stage("insert"), conn.begin():
+            self._write_batch(conn, batch, manifest, result)
+        stats.advance(len(batch))
+
+    def sync_paths(
+        self, paths: Iterable[str | Path], stats: IngestStats | None = None
+    ) -> SyncResult:
+        """
+        Apply the changes of the given files or folders in one transaction,
+        without walking the rest of the folder. A path that no longer exists
+        removes the entries of the file, or of every file below the folder.
+        """
+        folder_path = self._require_folder()
+        stats = stats or IngestStats()
+        keys: set[str] = set()
+        prefixes: set[str] = set()
+        for path in paths:
+            path = Path(path)
+            try:
+                relative = path.relative_to(folder_path).as_posix()
+            except ValueError:
+                continue
+            if path.is_dir():
+                keys.update(
+                    file_path.relative_to(folder_path).as_posix()
+                    for file_path in path.rglob("*.md")
+                    if file_path.is_file()
+                )
+                prefixes.add(relative)
+            elif path.suffix == ".md":
+                keys.add(relative)
+            elif not path.exists():
+                # 削除・移動されたフォルダかもしれない
+                prefixes.add(relative)
+
+        with self._write_lock:
+            result = SyncResult()
+            self.session.close()
+            with self.engine.connect() as conn:
+                manifest = self._load_manifest(conn, keys, prefixes)
+                conn.commit()
+                existing = sorted(key for key in keys if (folder_path / key).is_file())
+                candidates = self._changed_files(
+                    folder_path, existing, manifest, result
+                )
+                parsed = list(self._parse_files(candidates, manifest, result, 1, stats))
+                vanished = [key for key in manifest if key not in existing]
+                with stats.stage("insert"), conn.begin():
+                    self._write_batch(conn, parsed, manifest, result)
+                    self._delete_files(conn, vanished, manifest, result)
+                stats.advance(len(parsed) + len(vanished))
+        return result
+
+    def _require_folder(self) -> Path:
+        if self.folder_path is None:
+            raise ValueError("folder_path is required to process a folder.")
+        return self.folder_path
+
+    def iter_entries_by_year_month(
+        self, year: int, month: int, batch_size: int = 100
+    ) -> Iterator[EntryRecord]:
+        """
+        Stream a month's entries, newest first, without building ORM objects.
+        Rows are fetched from the cursor batch_size at a time, so only one
+        batch of contents is in memory at once.
+        """
+        query = (
+            select(
+                Entry.id,
+                Entry.date,
+                Entry.title,
+                _content(Entry),
+                Entry.char_count,
+                Entry.happiness_score,
+            )
+            .where(Entry.year == int(year), Entry.month == int(month))
+            # 同じ年月の中では day の降順が date の降順と同じで、索引順に読める
+            .order_by(Entry.day.desc())
+            .execution_options(yield_per=batch_size)
+        )
+        for row in self.session.execute(query):
+            yield EntryRecord(*row)
+
+    def iter_entry_headers(self, batch_size: int = 1000) -> Iterator[EntryHeader]:
+        """
+        Stream every entry without its body, oldest first; undated entries
+        come last.
+        """
+        query = (
+            select(
+                Entry.id,
+                Entry.date,
+                Entry.title,
+                Entry.char_count,
+                Entry.content_hash,
+            )
+            .order_by(
+                Entry.year.is_(None), Entry.year, Entry.month, Entry.day, Entry.id
+            )
+            .execution_options(yield_per=batch_size)
+        )
+        for row in self.session.execute(query):
+            yield EntryHeader(*row)
+
+    def iter_entries(
+        self, entry_ids: Iterable[int] | None = None, batch_size: int = 100
+    ) -> Iterator[EntryRecord]:
+        """
+        Stream whole entries, all of them in id order or only entry_ids.
+        Like iter_entries_by_year_month, only batch_size contents are in
+        memory at once.
+        """
+        columns = (
+            Entry.id,
+            Entry.date,
+            Entry.title,
+            _content(Entry),
+            Entry.char_count,
+            Entry.happiness_score,
+        )
+        if entry_ids is None:
+            query = (
+                select(*columns)
+                .order_by(Entry.id)
+                .execution_options(yield_per=batch_size)
+            )
+            for row in self.session.execute(query):
+                yield EntryRecord(*row)
+            return
+        entry_ids = sorted(set(entry_ids))
+        # IN 句が長くなりすぎないように分けて引く
+        for start in range(0, len(entry_ids), batch_size):
+            chunk = entry_ids[start : start + batch_size]
+            query = select(*columns).where(Entry.id.in_(chunk)).order_by(Entry.id)
+            for row in self.session.execute(query):
+                yield EntryRecord(*row)
+
+    def get_entries_by_year_month(self, year, month) -> "pd.DataFrame":
+        """
+        A month's entries as a pandas DataFrame with ID, Date, Title and
+        Content columns. pandas is only needed for this method.
+        """
+        import pandas as pd
+
+        return pd.DataFrame.from_records(
+            (
+                (entry.id, entry.date, entry.title, entry.content)
+                for entry in self.iter_entries_by_year_month(year, month)
+            ),
+            columns=["ID", "Date", "Title", "Content"],
+        )
+
+    def count_entries_by_year_month(self, year: int, month: int) -> int:
+        return (
+            self.session.query(func.count(Entry.id))
+            .filter(Entry.year == int(year), Entry.month == int(month))
+            .scalar()
+        )
+
+    def list_entries_by_year_month(
+        self,
+        year: int,
+        month: int,
+        offset: int = 0,
+        limit: int = 20,
+        snippet_length: int = 100,
+    ) -> list[EntrySummary]:
+        """
+        List one page of a month's entries, newest first.
+        Only the first snippet_length characters of each body are loaded;
+        use get_entry to fetch a whole entry.
+        """
+        query = (
+            self.session.query(
+                Entry.id,
+                Entry.date,
+                Entry.title,
+                Entry.char_count,
+                func.substr(_content(Entry), 1, snippet_length),
+            )
+            .filter(Entry.year == int(year), Entry.month == int(month))
+            .order_by(Entry.day.desc(), Entry.id.desc())
+            .offset(offset)
+            .limit(limit)
+        )
+        return [EntrySummary(*row) for row in query]
+
+    def get_entry(self, entry_id: int) -> EntryRecord | None:
+        row = (
+            self.session.query(
+                Entry.id,
+                Entry.date,
+                Entry.title,
+                _content(Entry),
+                Entry.char_count,
+                Entry.happiness_score,
+            )
+            .filter(Entry.id == entry_id)
+            .one_or_none()
+        )
+        return EntryRecord(*row) if row is not None else None
 
     def get_all_years(self):
         query = (
-            self.session.query(Entry)
-            .filter(Entry.date.isnot(None))
-            .with_entities(Entry.date)
+            self.session.query(Entry.year)
+            .filter(Entry.year.isnot(None))
+            .distinct()
+            .order_by(Entry.year.desc())
         )
-        years = {entry.date.year for entry in query if entry.date}
-        return sorted(years, reverse=True)
+        return [year for (year,) in query]
 
     def get_months_in_year(self, year):
         query = (
-            self.session.query(Entry)
-            .filter(Entry.date.isnot(None), Entry.date.like(f"{year}-%"))
-            .with_entities(Entry.date)
+            self.session.query(Entry.month)
+            .filter(Entry.year == int(year))
+            .distinct()
+            .order_by(Entry.month)
+        )
+        return [month for (month,) in query]
+
+    def get_entry_paths(self, entry_id: int) -> list[str]:
+        """
+        The files an entry was read from; several with the link dedup policy.
+        """
+        query = (
+            self.session.query(FileManifest.path)
+            .filter(FileManifest.entry_id == entry_id)
+            .order_by(FileManifest.path)
+        )
+        return [path for (path,) in query]
+
+    def get_monthly_stats(self, year: int | None = None) -> list[MonthStat]:
+        """
+        Entry counts, total characters and average happiness score per month,
+        oldest first, read from the monthly_stats aggregate.
+        """
+        query = self.session.query(
+            MonthlyStats.year,
+            MonthlyStats.month,
+            MonthlyStats.entry_count,
+            MonthlyStats.char_count,
+            MonthlyStats.happiness_sum,
+            MonthlyStats.happiness_count,
+        )
+        if year is not None:
+            query = query.filter(MonthlyStats.year == int(year))
+        query = query.order_by(MonthlyStats.year, MonthlyStats.month)
+        return [
+            MonthStat(
+                row.year,
+                row.month,
+                row.entry_count,
+                row.char_count,
+                (
+                    row.happiness_sum / row.happiness_count
+                    if row.happiness_count
+                    else None
+                ),
+            )
+            for row in query
+        ]
+
+    def get_entry_fields(self, entry_id: int) -> dict[str, list]:
+        """
+        The frontmatter values of an entry, as lists per (dotted) key.
+        """
+        query = (
+            self.session.query(
+                EntryField.key,
+                EntryField.value_type,
+                EntryField.text_value,
+                EntryField.number_value,
+            )
+            .filter(EntryField.entry_id == entry_id)
+            .order_by(EntryField.id)
+        )
+        fields: dict[str, list] = {}
+        for row in query:
+            fields.setdefault(row.key, []).append(_typed_value(FieldValue(*row)))
+        return fields
+
+    def get_field_keys(self) -> list[tuple[str, int]]:
+        """
+        All frontmatter keys with the number of entries that have them.
+        """
+        query = (
+            self.session.query(
+                EntryField.key, func.count(EntryField.entry_id.distinct())
+            )
+            .group_by(EntryField.key)
+            .order_by(EntryField.key)
         )
-        months = {entry.date.month for entry in query if entry.date}
-        return sorted(months)
+        return [(key, count) for key, count in query]
+
+    def get_field_values(self, key: str) -> list[tuple[str, int]]:
+        """
+        The distinct values of a key with the number of entries for each.
+        """
+        query = (
+            self.session.query(
+                EntryField.text_value, func.count(EntryField.entry_id.distinct())
+            )
+            .filter(EntryField.key == key, EntryField.text_value.isnot(None))
+            .group_by(EntryField.text_value)
+            .order_by(EntryField.text_value)
+        )
+        return [(value, count) for value, count in query]
+
+    def find_entries_by_field(
+        self,
+        key: str,
+        value: object = None,
+        year: int | None = None,
+        month: int | None = None,
+        min_value: float | None = None,
+        max_value: float | None = None,
+        limit: int | None = 100,
+        snippet_length: int = 100,
+    ) -> list[EntrySummary]:
+        """
+        Entries whose frontmatter has key, newest first.
+        value matches the stored text (e.g. a tag, or "3" for 3); min_value
+        and max_value filter numeric values. Both are index lookups on
+        entry_fields, narrowed by the year/month index of entries.
+        """
+        matches = self.session.query(EntryField.entry_id).filter(EntryField.key == key)
+        if value is not None:
+            matches = matches.filter(EntryField.text_value == field_text(value))
+        if min_value is not None:
+            matches = matches.filter(EntryField.number_value >= min_value)
+        if max_value is not None:
+            matches = matches.filter(EntryField.number_value <= max_value)
+
+        query = self.session.query(
+            Entry.id,
+            Entry.date,
+            Entry.title,
+            Entry.char_count,
+            func.substr(_content(Entry), 1, snippet_length),
+        ).filter(Entry.id.in_(matches))
+        if year is not None:
+            query = query.filter(Entry.year == int(year))
+        if month is not None:
+            query = query.filter(Entry.month == int(month))
+        query = query.order_by(Entry.date.desc(), Entry.id.desc()).limit(limit)
+        return [EntrySummary(*row) for row in query]
+
+    def search(
+        self, query: str, limit: int = 20, markers: tuple[str, str] = ("[", "]")
+    ) -> list[SearchResult]:
+        """
+        Search titles and contents, best matches first.
+        Each term must appear in the entry; matches in the snippet are wrapped
+        in markers. Terms shorter than three characters cannot use the trigram
+        index and are matched with LIKE instead.
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        long_terms = [t for t in terms if len(t) >= FTS_MIN_TERM_LENGTH]
+        short_terms = [t for t in terms if len(t) < FTS_MIN_TERM_LENGTH]
+        if not self.fts_enabled or not long_terms:
+            return self._search_like(terms, limit, markers)
+
+        params: dict = {
+            # 各語をフレーズとして扱い、FTS5 の構文として解釈させない
+            "query": " ".join('"' + t.replace('"', '""') + '"' for t in long_terms),
+            "open": markers[0],
+            "close": markers[1],
+            "limit": limit,
+        }
+        conditions = ["entries_fts MATCH :query"]
+        for i, term in enumerate(short_terms):
+            params[f"term{i}"] = f"%{term}%"
+            conditions.append(
+                f"(entries.title LIKE :term{i}"
+                f" OR krapp_content(entries.content, entries.content_blob)"
+                f" LIKE :term{i})"
+            )
+        rows = self.session.execute(
+            text(
+                "SELECT entries.id, entries.date, entries.title,"
+                " snippet(entries_fts, 1, :open, :close, '…', 32) AS snippet,"
+                " bm25(entries_fts) AS rank"
+                " FROM entries_fts JOIN entries ON entries.id = entries_fts.rowid"
+                f" WHERE {' AND '.join(conditions)}"
+                " ORDER BY rank LIMIT :limit"
+            ).columns(date=Date),
+            params,
+        )
+        return [SearchResult(*row) for row in rows]
+
+    def _search_like(
+        self, terms: list[str], limit: int, markers: tuple[str, str]
+    ) -> list[SearchResult]:
+        content = _content(Entry)
+        query = self.session.query(Entry.id, Entry.date, Entry.title, content)
+        for term in terms:
+            pattern = f"%{term}%"
+            query = query.filter(or_(Entry.title.like(pattern), content.like(pattern)))
+        query = query.order_by(Entry.date.desc()).limit(limit)
+        return [
+            SearchResult(
+                row.id,
+                row.date,
+                row.title,
+                _make_snippet(row.content, terms, markers),
+                0.0,
+            )
+            for row in query
+        ]
 
     def close(self):
-        self.session.close()
+        self.session.remove()
+
+
+def _register_functions(dbapi_connection, connection_record) -> None:
+    # 圧縮された本文を SQL の中から読めるようにする
+    dbapi_connection.create_function(
+        "krapp_content", 2, content_text, deterministic=True
+    )
+
+
+def _content(entry):
+    """
+    SQL expression for an entry's text, decompressed if needed.
+    entry is the Entry class or the columns of the entries table.
+    """
+    return func.krapp_content(entry.content, entry.content_blob, type_=String).label(
+        "content"
+    )
+
+
+def _field_rows(entry_id: int, fields: list[FieldValue]) -> list[dict]:
+    return [{"entry_id": entry_id, **field._asdict()} for field in fields]
+
+
+def _typed_value(field: FieldValue) -> object:
+    """
+    Turn a stored row back into the value YAML produced.
+    """
+    if field.value_type == "null":
+        return None
+    if field.value_type == "bool":
+        return field.text_value == "true"
+    converters = {
+        "int": int,
+        "float": float,
+        "date": date.fromisoformat,
+        "datetime": datetime.fromisoformat,
+    }
+    converter = converters.get(field.value_type)
+    return converter(field.text_value) if converter else field.text_value
+
+
+def _make_snippet(
+    content: str, terms: list[str], markers: tuple[str, str], width: int = 32
+) -> str:
+    """
+    Cut a window around the first matching term, like FTS5's snippet().
+    """
+    position = min(
+        (i for i in (content.find(term) for term in terms) if i >= 0), default=0
+    )
+    start = max(position - width // 2, 0)
+    snippet = content[start : start + width]
+    for term in terms:
+        snippet = snippet.replace(term, f"{markers[0]}{term}{markers[1]}")
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if start + width < len(content) else ""
+    return f"{prefix}{snippet}{suffix}"
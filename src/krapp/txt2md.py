@@ -1,8 +1,14 @@
+import codecs
+import json
 import os
-from dataclasses import dataclass
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Final
 
+from krapp.ingest_stats import IngestStats
+
 
 @dataclass
 class Txt2MdResult:
@@ -10,43 +16,248 @@ class Txt2MdResult:
     output_folder: str
     processed_files: list[str]
     error: str | None = None
+    # 入力ファイルごとに検出した文字コード。次回の変換にヒントとして渡せる
+    encodings: dict[str, str] = field(default_factory=dict)
+    # 出力が最新だったので変換しなかったファイル
+    skipped_files: list[str] = field(default_factory=list)
+    # 変換に失敗した入力ファイルとそのエラー
+    failed_files: dict[str, str] = field(default_factory=dict)
 
 
 class Txt2MdConverter:
+    # 変換済みの入力ファイルの状態と文字コードを出力フォルダに記録する
+    manifest_name: Final = ".txt2md-manifest.json"
     encodings: Final = ("utf-8", "shift-jis", "iso-2022-jp", "euc-jp")
+    # 文字コードの判定に使う先頭部分の長さ
+    detect_size: Final = 64 * 1024
+    # ISO-2022-JP の文字集合を切り替えるエスケープシーケンス
+    iso2022_escape: Final = re.compile(rb"\x1b\$[@B]|\x1b\([BJ]")
+
+    def __init__(
+        self, stream_threshold: int = 16 * 1024 * 1024, chunk_size: int = 1024 * 1024
+    ) -> None:
+        # これより大きいファイルは丸ごと読み込まず、chunk_size 文字ずつ変換する
+        self.stream_threshold: Final = stream_threshold
+        self.chunk_size: Final = chunk_size
+
+    def detect_encoding(self, data: bytes) -> str | None:
+        """
+        Classify the bytes by BOM, ISO-2022-JP escapes and UTF-8 validity of
+        the leading block. Returns None when the result is ambiguous.
+        """
+        if data.startswith(codecs.BOM_UTF8):
+            return "utf-8"
+        head = data[: self.detect_size]
+        if head.isascii():
+            if self.iso2022_escape.search(head):
+                return "iso-2022-jp"
+            # ASCII だけではどの文字コードとも区別できない
+            return None
+        try:
+            codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        except UnicodeDecodeError:
+            return None
+        return "utf-8"
+
+    def _candidates(self, head: bytes, hint: str | None) -> list[str]:
+        """
+        Encodings to try in order: the hint, the detected one, then the rest.
+        """
+        candidates = [hint, self.detect_encoding(head), *self.encodings]
+        return list(dict.fromkeys(c for c in candidates if c is not None))
+
+    def _decode(self, data: bytes, hint: str | None = None) -> tuple[str, str]:
+        """
+        Decode the bytes with the first candidate encoding that fits.
+        Returns the text and its encoding.
+        """
+        for encoding in self._candidates(data[: self.detect_size], hint):
+            try:
+                content = data.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+            # read_text と同じく改行コードを \n に揃える
+            return content.replace("\r\n", "\n").replace("\r", "\n"), encoding
+        raise UnicodeDecodeError(
+            ",".join(self.encodings), data, 0, len(data), "no encoding matched"
+        )
 
-    def _copy_text(self, input_path: Path, output_path: Path) -> None:
+    def _copy_text(
+        self,
+        input_path: Path,
+        output_path: Path,
+        hint: str | None = None,
+        stats: IngestStats | None = None,
+    ) -> str:
         """
         Copy text from input file to output file.
+        The input is read once as bytes. Returns the detected encoding.
+        """
+        stats = stats or IngestStats()
+        if input_path.stat().st_size > self.stream_threshold:
+            # ストリーミングでは読み込み・デコード・書き込みが交互に進む
+            with stats.stage("stream"):
+                return self._stream_text(input_path, output_path, hint)
+        with stats.stage("read"):
+            data = input_path.read_bytes()
+        with stats.stage("decode"):
+            content, encoding = self._decode(data, hint)
+        # Write the content to the md file
+        with stats.stage("write"):
+            output_path.write_text(content, encoding="utf-8")
+        return encoding
+
+    def _stream_text(
+        self, input_path: Path, output_path: Path, hint: str | None = None
+    ) -> str:
+        """
+        Copy text chunk by chunk so memory use does not grow with the file.
+        The text layer decodes incrementally, so multibyte characters and
+        CRLF pairs split across chunks come out the same as with _copy_text.
         """
-        for encoding in self.encodings:
+        with open(input_path, "rb") as file:
+            head = file.read(self.detect_size)
+        # 途中で失敗しても出力先を壊さないように、一時ファイルに書く
+        partial_path = output_path.with_name(output_path.name + ".part")
+        for encoding in self._candidates(head, hint):
             try:
-                # Read the content of the txt file
-                content = input_path.read_text(encoding=encoding)
-                # Write the content to the md file
-                output_path.write_text(content, encoding="utf-8")
-                # 成功したらおわり
-                return
+                with (
+                    open(input_path, "r", encoding=encoding) as source,
+                    open(partial_path, "w", encoding="utf-8") as target,
+                ):
+                    while chunk := source.read(self.chunk_size):
+                        target.write(chunk)
             except UnicodeDecodeError:
                 continue
-        raise UnicodeDecodeError(encoding=",".join(self.encodings))
+            os.replace(partial_path, output_path)
+            return encoding
+        partial_path.unlink(missing_ok=True)
+        raise UnicodeDecodeError(
+            ",".join(self.encodings), head, 0, len(head), "no encoding matched"
+        )
+
+    def _load_manifest(self, output_folder: Path) -> dict[str, dict]:
+        manifest_path = output_folder / self.manifest_name
+        if not manifest_path.exists():
+            return {}
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _save_manifest(self, output_folder: Path, manifest: dict[str, dict]) -> None:
+        manifest_path = output_folder / self.manifest_name
+        partial_path = manifest_path.with_name(manifest_path.name + ".part")
+        with open(partial_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(partial_path, manifest_path)
+
+    def _convert_file(
+        self,
+        input_path: Path,
+        output_path: Path,
+        record: dict | None,
+        hint: str | None,
+        force: bool,
+        stats: IngestStats | None = None,
+    ) -> tuple[str, dict]:
+        """
+        Convert one file unless its output is up to date.
+        Returns "converted" or "skipped" with the new manifest record.
+        """
+        stat = input_path.stat()
+        if not force and output_path.exists():
+            if record is not None and (record["size"], record["mtime_ns"]) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                return "skipped", record
+            # 記録がなければ、出力の方が新しいかどうかで判断する
+            if record is None and output_path.stat().st_mtime_ns >= stat.st_mtime_ns:
+                return "skipped", {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "encoding": None,
+                }
+        encoding = self._copy_text(input_path, output_path, hint, stats)
+        return "converted", {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "encoding": encoding,
+        }
 
     def convert_txt_to_md(
-        self, input_folder: str | Path, output_folder: str | Path
+        self,
+        input_folder: str | Path,
+        output_folder: str | Path,
+        encoding_hints: dict[str, str] | None = None,
+        recursive: bool = False,
+        jobs: int = 1,
+        force: bool = False,
+        stats: IngestStats | None = None,
     ) -> Txt2MdResult:
+        """
+        Convert .txt files to UTF-8 .md files.
+        With recursive the input tree is mirrored into the output folder.
+        Outputs newer than their source are skipped unless force is given,
+        and a file that fails to convert is reported instead of aborting.
+        Stage timings and progress go to stats.
+        """
+        stats = stats or IngestStats()
         # Ensure output folder exists
         input_folder = Path(input_folder)
         output_folder = Path(output_folder)
         os.makedirs(output_folder, exist_ok=True)
-        processed_files = []
-
-        # Iterate through all files in the input folder
-        for input_path in input_folder.glob("*.txt"):
-            output_path = output_folder / input_path.with_suffix(".md").name
-            self._copy_text(input_path, output_path)
-            processed_files.append(str(output_path))
-        return Txt2MdResult(
+        encoding_hints = encoding_hints or {}
+        manifest = self._load_manifest(output_folder)
+        result = Txt2MdResult(
             input_folder=str(input_folder),
             output_folder=str(output_folder),
-            processed_files=processed_files,
+            processed_files=[],
         )
+
+        # Iterate through all files in the input folder
+        input_paths = (
+            input_folder.rglob("*.txt") if recursive else input_folder.glob("*.txt")
+        )
+        with stats.stage("walk"):
+            tasks = []
+            for input_path in sorted(input_paths):
+                key = input_path.relative_to(input_folder).as_posix()
+                tasks.append(
+                    (input_path, output_folder / Path(key).with_suffix(".md"), key)
+                )
+            for folder in {output_path.parent for _, output_path, _ in tasks}:
+                os.makedirs(folder, exist_ok=True)
+        stats.set_total(len(tasks))
+
+        def convert(task: tuple[Path, Path, str]) -> tuple[str, dict | str]:
+            input_path, output_path, key = task
+            record = manifest.get(key)
+            hint = encoding_hints.get(str(input_path)) or (record or {}).get("encoding")
+            try:
+                return self._convert_file(
+                    input_path, output_path, record, hint, force, stats
+                )
+            except (UnicodeDecodeError, OSError) as e:
+                return "failed", str(e)
+            finally:
+                stats.advance()
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            outcomes = list(executor.map(convert, tasks))
+
+        for (input_path, output_path, key), (status, value) in zip(tasks, outcomes):
+            if isinstance(value, str):
+                result.failed_files[str(input_path)] = value
+                manifest.pop(key, None)
+                continue
+            manifest[key] = value
+            if value["encoding"] is not None:
+                result.encodings[str(input_path)] = value["encoding"]
+            if status == "skipped":
+                result.skipped_files.append(str(output_path))
+            else:
+                result.processed_files.append(str(output_path))
+        if manifest:
+            self._save_manifest(output_folder, manifest)
+        stats.finish()
+        return result
@@ -1,28 +1,49 @@
+import copy
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Final
+
 import yaml
 
+# libyaml があれば C 実装のローダーを使う
+YAML_LOADER: Final = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+DELIMITER: Final = "---"
+
 
 class YamlFrontmatterParser:
     """
     A simple YAML frontmatter parser.
     """
 
+    # parse_file で一度に読むバイト数
+    read_size: Final = 4096
+
     def __init__(self):
         pass
 
+    def _end_index(self, content: str) -> int:
+        """
+        Index of the closing delimiter, or -1 if there is no frontmatter.
+        """
+        if not content.startswith(DELIMITER):
+            return -1
+        return content.find(DELIMITER, 3)
+
     def has_frontmatter(self, content: str) -> bool:
         """
         Check if the content has YAML frontmatter.
         """
-        return content.startswith("---") and "---" in content[3:]
+        return self._end_index(content) != -1
 
     def split(self, content: str) -> tuple[str, str]:
         """
         Split the content into frontmatter and body.
         """
-        if not self.has_frontmatter(content):
+        end_index = self._end_index(content)
+        if end_index == -1:
             return "", content
 
-        end_index = content.find("---", 3)
         frontmatter = content[3:end_index].strip()
         body = content[end_index + 3 :].strip()
         return frontmatter, body
@@ -30,8 +51,53 @@ class YamlFrontmatterParser:
     def parse(self, content: str) -> dict:
         """
         Parse the YAML frontmatter from the content.
+        Only the frontmatter block is looked at; the body is never copied.
+        """
+        end_index = self._end_index(content)
+        if end_index == -1:
+            return {}
+        return _load(content[3:end_index].strip())
+
+    def read_header(self, file_path: str | Path) -> str | None:
         """
-        if not self.has_frontmatter(content):
+        The raw frontmatter block of a UTF-8 file, or None if it has none.
+        Only the file's leading bytes up to the closing delimiter are read.
+        """
+        with open(file_path, "rb") as file:
+            head = file.read(self.read_size)
+            if not head.startswith(DELIMITER.encode()):
+                return None
+            # 区切りが読み込み単位の境目をまたいでも見つかるように戻って探す
+            start = 3
+            while (end_index := head.find(DELIMITER.encode(), start)) == -1:
+                block = file.read(self.read_size)
+                if not block:
+                    return None
+                start = max(len(head) - 2, 3)
+                head += block
+        return head[3:end_index].decode("utf-8").strip()
+
+    def parse_file(self, file_path: str | Path) -> dict:
+        """
+        Parse the YAML frontmatter of a UTF-8 file, reading only up to the
+        closing delimiter instead of the whole file.
+        """
+        header = self.read_header(file_path)
+        if header is None:
             return {}
-        yaml_content, _ = self.split(content)
-        return yaml.safe_load(yaml_content)
+        return _load(header)
+
+
+@lru_cache(maxsize=4096)
+def _load_cached(text: str) -> Any:
+    return yaml.load(text, Loader=YAML_LOADER)
+
+
+def _load(text: str) -> Any:
+    """
+    Load a frontmatter block, reusing the result for a block seen before so
+    re-ingesting unchanged files skips YAML. Each call gets its own deep
+    copy, so a caller changing nested lists such as tags cannot change what
+    later calls see.
+    """
+    return copy.deepcopy(_load_cached(text))
@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# 軽いコマンドの起動を遅くする依存ライブラリ
+HEAVY_MODULES = ("sqlalchemy", "pandas", "yaml", "streamlit")
+
+SCRIPT = """
+import json, sys
+from typer.testing import CliRunner
+from krapp.cli import app
+result = CliRunner().invoke(app, sys.argv[1:])
+heavy = [name for name in {heavy} if name in sys.modules]
+print(json.dumps({{"exit_code": result.exit_code, "heavy": heavy}}))
+"""
+
+
+def run_cli(args, tmp_path):
+    env = {**os.environ, "XDG_CONFIG_HOME": str(tmp_path)}
+    completed = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(heavy=HEAVY_MODULES), *args],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize(
+    "args",
+    [["--help"], ["show-config"], ["set-config", "db.path", "texts.db"]],
+)
+def test_light_commands_do_not_import_heavy_modules(args, tmp_path):
+    outcome = run_cli(args, tmp_path)
+
+    assert outcome["exit_code"] == 0
+    assert outcome["heavy"] == []
+
+
+def test_database_commands_still_work(tmp_path):
+    outcome = run_cli(["stats", "--db-path", str(tmp_path / "texts.db")], tmp_path)
+
+    assert outcome["exit_code"] == 0
+    assert "sqlalchemy" in outcome["heavy"]
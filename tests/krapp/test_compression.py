@@ -0,0 +1,25 @@
+import pytest
+
+from krapp.compression import compress, content_text, decompress
+
+
+@pytest.mark.parametrize("method", ["zlib", "lzma"])
+@pytest.mark.parametrize("level", [None, 1, 9])
+def test_round_trip(method, level):
+    text = "今日は公園を散歩した。\n" * 100
+    blob = compress(text, method, level)
+
+    assert len(blob) < len(text.encode("utf-8"))
+    assert decompress(blob) == text
+
+
+def test_content_text_prefers_blob():
+    assert content_text("", compress("本文", "zlib")) == "本文"
+    assert content_text("本文", None) == "本文"
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError, match="compression must be one of"):
+        compress("本文", "gzip")
+    with pytest.raises(ValueError, match="Unknown compressed content prefix"):
+        decompress(b"?data")
@@ -5,7 +5,7 @@ from pathlib import Path
 
 import pytest
 
-from krapp.config_manager import ConfigManager
+from krapp.config_manager import ConfigManager, get_db_path, get_write_options
 
 
 @pytest.fixture
@@ -47,3 +47,28 @@ def test_config_file_linux_default(monkeypatch, config_manager):
 def test_set_config(config_manager):
     config_manager.set_config("max_retries", 5)
     assert config_manager.get_config("max_retries") == 5
+
+
+def test_db_path_falls_back_to_config(config_manager):
+    config_manager.set_config("db.path", "/data/texts.db")
+    assert get_db_path("other.db", config_manager) == "other.db"
+    assert get_db_path(config_manager=config_manager) == "/data/texts.db"
+    config_manager.set_config("db.path", None)
+    assert get_db_path(config_manager=config_manager) == "./texts.db"
+
+
+def test_write_options_fall_back_to_config(config_manager):
+    config_manager.set_config("db.dedup", "link")
+    config_manager.set_config("db.compression", "zlib")
+    config_manager.set_config("db.compression_level", "6")
+
+    # watch や Streamlit の更新でも create-db と同じ設定で書き込む
+    assert get_write_options(config_manager=config_manager) == {
+        "dedup": "link",
+        "compression": "zlib",
+        "compression_level": 6,
+    }
+    assert get_write_options("none", None, "skip", config_manager) == {"dedup": "skip"}
+    config_manager.set_config("db.dedup", None)
+    config_manager.set_config("db.compression", None)
+    assert get_write_options(config_manager=config_manager) == {"dedup": None}
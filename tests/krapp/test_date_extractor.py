@@ -1,3 +1,5 @@
+import random
+import re
 from datetime import datetime
 
 import pytest
@@ -136,3 +138,37 @@ def test_extract_dates_with_no_dates(extractor):
     text = "There are no dates in this text."
     result = extractor.extract_dates(text)
     assert result == []
+
+
+def test_extract_first_date_prefers_pattern_priority(extractor):
+    text = "20230101_0900\n2023年2月3日\n2023-04-05"
+    assert extractor.extract_first_date(text) == datetime(2023, 4, 5)
+
+
+def test_extract_first_date_skips_invalid_dates(extractor):
+    text = "2023-15-10 then 2023-10-15"
+    assert extractor.extract_first_date(text) == datetime(2023, 10, 15)
+
+
+def test_extract_first_date_with_no_dates(extractor):
+    assert extractor.extract_first_date("There are no dates in this text.") is None
+
+
+def test_combined_engine_matches_findall_per_pattern(extractor):
+    def reference(text):
+        dates = []
+        for pattern in extractor.date_patterns:
+            for match in re.findall(pattern.pattern, text):
+                try:
+                    dates.append(datetime.strptime(match, pattern.format))
+                except ValueError:
+                    continue
+        return dates
+
+    rnd = random.Random(0)
+    alphabet = "0123456789-/._年月日 a\n"
+    for _ in range(2000):
+        text = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 30)))
+        expected = reference(text)
+        assert extractor.extract_dates(text) == expected
+        assert extractor.extract_first_date(text) == (expected[0] if expected else None)
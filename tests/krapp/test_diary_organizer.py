@@ -1,9 +1,12 @@
+import errno
+from datetime import datetime
 from unittest.mock import MagicMock, patch
 
 import pytest
 
 from krapp.date_extractor import DateExtractor
-from krapp.diary_organizer import DiaryOrganizer
+from krapp.diary_organizer import DiaryOrganizer, move_file
+from krapp.ingest_stats import IngestStats
 
 
 @pytest.fixture
@@ -28,7 +31,7 @@ def test_organize_diary_creates_correct_folders_and_copies_file(
     mock_date = MagicMock()
     mock_date.year = 2023
     mock_date.month = 5
-    mock_date_extractor.extract_dates.return_value = [mock_date]
+    mock_date_extractor.extract_first_date.return_value = mock_date
 
     # Act
     diary_organizer.organize_diary(input_md_file, output_folder)
@@ -47,7 +50,7 @@ def test_organize_diary_raises_error_when_no_date_found(
     output_folder = tmp_path / "output"
     input_md_file.write_text("Content without a date", encoding="utf-8")
 
-    mock_date_extractor.extract_dates.return_value = []
+    mock_date_extractor.extract_first_date.return_value = None
 
     # Act & Assert
     with pytest.raises(ValueError, match="No valid date found in the markdown file."):
@@ -66,7 +69,7 @@ def test_organize_diary_calls_shutil_copy(
     mock_date = MagicMock()
     mock_date.year = 2023
     mock_date.month = 5
-    mock_date_extractor.extract_dates.return_value = [mock_date]
+    mock_date_extractor.extract_first_date.return_value = mock_date
 
     # Act
     diary_organizer.organize_diary(input_md_file, output_folder)
@@ -74,3 +77,123 @@ def test_organize_diary_calls_shutil_copy(
     # Assert
     expected_folder = output_folder / "2023" / "05"
     mock_copy.assert_called_once_with(input_md_file, expected_folder)
+
+
+@pytest.fixture
+def diary_folder(tmp_path):
+    folder = tmp_path / "diary"
+    (folder / "sub").mkdir(parents=True)
+    (folder / "20230501.md").write_text("五月の日記", encoding="utf-8")
+    (folder / "sub" / "memo.md").write_text("2022-12-24 のメモ", encoding="utf-8")
+    (folder / "nodate.md").write_text("日付なし", encoding="utf-8")
+    # 同じ名前のファイルが同じ月に入るので、後の方はスキップされる
+    (folder / "sub" / "20230501.md").write_text("重複", encoding="utf-8")
+    return folder
+
+
+def test_plan_does_not_touch_files(diary_folder, tmp_path):
+    organizer = DiaryOrganizer(date_extractor=DateExtractor())
+    files = sorted(diary_folder.rglob("*.md"))
+    output = tmp_path / "output"
+
+    plan = organizer.plan(files, output)
+
+    assert {move.destination for move in plan.moves} == {
+        output / "2023" / "05" / "20230501.md",
+        output / "2022" / "12" / "memo.md",
+    }
+    assert list(plan.failed) == [diary_folder / "nodate.md"]
+    assert list(plan.skipped) == [diary_folder / "sub" / "20230501.md"]
+    assert not output.exists()
+
+
+def test_execute_moves_files_in_parallel(diary_folder, tmp_path):
+    organizer = DiaryOrganizer(date_extractor=DateExtractor())
+    output = tmp_path / "output"
+    (output / "2022" / "12").mkdir(parents=True)
+    (output / "2022" / "12" / "memo.md").write_text("既存", encoding="utf-8")
+
+    plan = organizer.plan(sorted(diary_folder.rglob("*.md")), output, jobs=4)
+    result = organizer.execute(plan, remove=True, jobs=4)
+
+    assert [move.source for move in result.done] == [diary_folder / "20230501.md"]
+    assert not (diary_folder / "20230501.md").exists()
+    moved = output / "2023" / "05" / "20230501.md"
+    assert moved.read_text(encoding="utf-8") == "五月の日記"
+    # 既存のファイルは上書きしない
+    assert (output / "2022" / "12" / "memo.md").read_text(encoding="utf-8") == "既存"
+    assert (diary_folder / "sub" / "memo.md").exists()
+
+
+def test_execute_copies_without_remove(diary_folder, tmp_path):
+    organizer = DiaryOrganizer(date_extractor=DateExtractor())
+    output = tmp_path / "output"
+
+    plan = organizer.plan([diary_folder / "sub" / "memo.md"], output)
+    result = organizer.execute(plan)
+
+    assert len(result.done) == 1
+    assert (output / "2022" / "12" / "memo.md").exists()
+    assert (diary_folder / "sub" / "memo.md").exists()
+
+
+def test_move_file_falls_back_to_copy_across_devices(tmp_path):
+    source = tmp_path / "a.md"
+    source.write_text("内容", encoding="utf-8")
+    destination = tmp_path / "b.md"
+
+    with patch("os.link", side_effect=OSError(errno.EXDEV, "cross-device")):
+        move_file(source, destination)
+
+    assert not source.exists()
+    assert destination.read_text(encoding="utf-8") == "内容"
+
+
+def test_default_date_resolution_matches_combined_search(tmp_path):
+    organizer = DiaryOrganizer(date_extractor=DateExtractor())
+    extractor = DateExtractor()
+    cases = {
+        "20230415_0930.md": "本文に 2022-01-02 がある",
+        "20230415.md": "日付なし",
+        "2023-04-15.md": "2022-01-02",
+        "memo.md": "---\ndate: 2021/03/04\n---\n2020年5月6日",
+    }
+    for name, content in cases.items():
+        path = tmp_path / name
+        path.write_text(content, encoding="utf-8")
+        expected = extractor.extract_first_date(f"{path.stem}\n{content}")
+        assert organizer.find_date(path) == expected
+
+
+def test_top_priority_date_in_filename_skips_reading(tmp_path):
+    organizer = DiaryOrganizer(date_extractor=DateExtractor())
+    path = tmp_path / "2023-04-15.md"
+    path.write_text("2022-01-02", encoding="utf-8")
+    stats = IngestStats()
+
+    assert organizer.find_date(path, stats) == datetime(2023, 4, 15)
+    assert "read" not in stats.summary()["stages"]
+
+
+def test_filename_first_date_resolution(tmp_path):
+    organizer = DiaryOrganizer(
+        date_extractor=DateExtractor(),
+        date_sources=("filename", "frontmatter", "body"),
+    )
+    named = tmp_path / "20230415_0930.md"
+    named.write_text("本文に 2022-01-02 がある", encoding="utf-8")
+    header = tmp_path / "memo.md"
+    header.write_text("---\ndate: 2021/03/04\n---\n2020-05-06", encoding="utf-8")
+    body = tmp_path / "note.md"
+    body.write_text("2020年5月6日の記録", encoding="utf-8")
+    stats = IngestStats()
+
+    assert organizer.find_date(named, stats) == datetime(2023, 4, 15)
+    assert "read" not in stats.summary()["stages"]
+    assert organizer.find_date(header) == datetime(2021, 3, 4)
+    assert organizer.find_date(body) == datetime(2020, 5, 6)
+
+
+def test_unknown_date_source_is_rejected():
+    with pytest.raises(ValueError, match="Unknown date sources: title"):
+        DiaryOrganizer(date_extractor=DateExtractor(), date_sources=("title",))
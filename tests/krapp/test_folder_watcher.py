@@ -0,0 +1,173 @@
+import shutil
+import sys
+import threading
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from krapp.folder_watcher import (
+    InotifyWatcher,
+    PollingWatcher,
+    create_watcher,
+    watch_folder,
+)
+from krapp.text_db_manager import Entry, TextDBManager
+
+
+@pytest.fixture
+def texts(tmp_path):
+    folder = tmp_path / "texts"
+    (folder / "2023").mkdir(parents=True)
+    (folder / "2023" / "20230415.md").write_text("四月の日記", encoding="utf-8")
+    (folder / "20230501.md").write_text("五月の日記", encoding="utf-8")
+    return folder
+
+
+@pytest.fixture
+def db(texts, tmp_path):
+    db = TextDBManager(folder_path=texts, db_path=tmp_path / "texts.db")
+    db.process_folder()
+    yield db
+    db.close()
+
+
+def titles(db):
+    return sorted(entry.title for entry in db.session.query(Entry))
+
+
+def test_sync_paths_applies_only_given_changes(texts, db):
+    (texts / "20230502.md").write_text("追加", encoding="utf-8")
+    (texts / "20230501.md").write_text("五月の日記を修正", encoding="utf-8")
+    # 渡さなかったファイルの変更は反映されない
+    (texts / "20230503.md").write_text("無視される", encoding="utf-8")
+
+    result = db.sync_paths([texts / "20230502.md", texts / "20230501.md"])
+
+    assert (result.added, result.updated, result.deleted) == (1, 1, 0)
+    assert titles(db) == ["20230415", "20230501", "20230502"]
+
+
+def test_sync_paths_removes_deleted_folder(texts, db):
+    shutil.rmtree(texts / "2023")
+
+    result = db.sync_paths([texts / "2023"])
+
+    assert result.deleted == 1
+    assert titles(db) == ["20230501"]
+
+
+def test_polling_watcher_reports_changes(texts):
+    watcher = PollingWatcher(texts, interval=0.01)
+    assert watcher.wait(timeout=0.05) == set()
+
+    (texts / "20230502.md").write_text("追加", encoding="utf-8")
+    (texts / "20230501.md").unlink()
+
+    assert watcher.wait(timeout=1.0) == {texts / "20230502.md", texts / "20230501.md"}
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify only")
+def test_inotify_watcher_reports_changes(texts):
+    watcher = InotifyWatcher(texts)
+    (texts / "2024").mkdir()
+    assert texts / "2024" in watcher.wait(timeout=1.0)
+
+    # 新しく作られたフォルダも監視される
+    (texts / "2024" / "20240101.md").write_text("新年", encoding="utf-8")
+    assert texts / "2024" / "20240101.md" in watcher.wait(timeout=1.0)
+    watcher.close()
+
+
+def test_watch_folder_syncs_bursts(texts, db):
+    watcher = create_watcher(texts, poll_interval=0.01)
+    stop = threading.Event()
+    synced = []
+
+    def on_sync(result):
+        synced.append(result)
+        stop.set()
+
+    thread = threading.Thread(
+        target=watch_folder,
+        args=(db, watcher),
+        kwargs={"debounce": 0.2, "on_sync": on_sync, "stop": stop},
+    )
+    thread.start()
+    for day in range(10, 20):
+        (texts / f"202306{day}.md").write_text(f"六月{day}日", encoding="utf-8")
+    thread.join(timeout=10)
+    watcher.close()
+
+    assert not thread.is_alive()
+    # まとめて一回で反映される
+    assert [result.added for result in synced] == [10]
+    assert len(titles(db)) == 12
+
+
+class FlakyDB:
+    """
+    sync_paths fails the first time, like a database locked by create-db.
+    """
+
+    def __init__(self, db, stop):
+        self.db = db
+        self.stop = stop
+        self.calls = []
+
+    def sync_paths(self, paths):
+        self.calls.append(set(paths))
+        if len(self.calls) == 1:
+            raise OperationalError("UPDATE", {}, Exception("database is locked"))
+        result = self.db.sync_paths(paths)
+        self.stop.set()
+        return result
+
+
+class ScriptedWatcher:
+    def __init__(self, batches):
+        self.batches = list(batches)
+
+    def wait(self, timeout):
+        return self.batches.pop(0) if self.batches else set()
+
+    def close(self):
+        pass
+
+
+def test_watch_folder_retries_failed_sync(texts, db):
+    first, second = texts / "20230502.md", texts / "20230503.md"
+    first.write_text("追加", encoding="utf-8")
+    second.write_text("もう一つ", encoding="utf-8")
+    stop = threading.Event()
+    flaky = FlakyDB(db, stop)
+    errors = []
+
+    watch_folder(
+        flaky,
+        ScriptedWatcher([{first}, set(), {second}, set()]),
+        debounce=0,
+        retry_delay=0,
+        on_error=errors.append,
+        stop=stop,
+    )
+
+    assert len(errors) == 1
+    # 失敗したパスは新しい変更と一緒にやり直される
+    assert flaky.calls == [{first}, {first, second}]
+    assert titles(db) == ["20230415", "20230501", "20230502", "20230503"]
+
+
+def test_sync_paths_ignores_file_vanishing_during_scan(texts, db, monkeypatch):
+    vanishing = texts / "20230501.md"
+    is_file = type(vanishing).is_file
+    # is_file の直後に消えたファイル
+    monkeypatch.setattr(
+        type(vanishing),
+        "is_file",
+        lambda path: is_file(path) and (path != vanishing or not path.unlink()),
+    )
+
+    result = db.sync_paths([vanishing])
+
+    assert result.failed == 0
+    assert titles(db) == ["20230415", "20230501"]
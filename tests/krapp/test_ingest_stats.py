@@ -0,0 +1,53 @@
+import io
+import json
+
+from krapp.ingest_stats import IngestStats
+
+
+def test_stage_accumulates_time_and_count():
+    stats = IngestStats()
+    with stats.stage("read"):
+        pass
+    with stats.stage("read"):
+        pass
+    stats.merge({"read": 1.0, "decode": 0.5})
+
+    summary = stats.summary()
+    assert summary["stages"]["read"]["count"] == 3
+    assert summary["stages"]["read"]["seconds"] >= 1.0
+    assert summary["stages"]["decode"] == {"seconds": 0.5, "count": 1}
+
+
+def test_progress_line_shows_rate_and_eta():
+    stream = io.StringIO()
+    stats = IngestStats(progress=True, stream=stream)
+    stats.set_total(4)
+    stats._started -= 1.0
+    stats.advance(2)
+    stats.finish()
+
+    output = stream.getvalue()
+    assert "\r2/4 files" in output
+    assert "files/s" in output and "ETA" in output
+    assert output.endswith("\n")
+
+
+def test_no_output_without_progress():
+    stream = io.StringIO()
+    stats = IngestStats(stream=stream)
+    stats.set_total(1)
+    stats.advance()
+    stats.finish()
+
+    assert stream.getvalue() == ""
+    assert stats.summary()["files"] == 1
+
+
+def test_write_json(tmp_path):
+    stats = IngestStats()
+    stats.add_time("insert", 0.25, count=2)
+    stats.write_json(tmp_path / "stats.json")
+
+    data = json.loads((tmp_path / "stats.json").read_text(encoding="utf-8"))
+    assert data["stages"]["insert"] == {"seconds": 0.25, "count": 2}
+    assert "elapsed_seconds" in data
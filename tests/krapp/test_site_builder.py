@@ -0,0 +1,161 @@
+import json
+
+import pytest
+
+from krapp.site_builder import SiteBuilder, markdown_html
+from krapp.text_db_manager import TextDBManager
+
+
+@pytest.fixture
+def texts(tmp_path):
+    folder = tmp_path / "texts"
+    folder.mkdir()
+    (folder / "20230415_0930.md").write_text("朝の日記", encoding="utf-8")
+    (folder / "20230501.md").write_text(
+        "---\nhappiness score: 3\n---\n<b>五月</b>の日記", encoding="utf-8"
+    )
+    (folder / "memo.md").write_text("日付のないメモ", encoding="utf-8")
+    return folder
+
+
+@pytest.fixture
+def db(texts, tmp_path):
+    db = TextDBManager(folder_path=texts, db_path=tmp_path / "texts.db")
+    db.process_folder()
+    yield db
+    db.close()
+
+
+def entry_id(db, title):
+    return next(h.id for h in db.iter_entry_headers() if h.title == title)
+
+
+def test_build_site_writes_pages(db, tmp_path):
+    site = tmp_path / "site"
+    result = SiteBuilder(db).build_site(site, jobs=2)
+
+    assert not result.failed_pages
+    may = entry_id(db, "20230501")
+    for path in [
+        "index.html",
+        "2023/index.html",
+        "2023/04/index.html",
+        "2023/05/index.html",
+        "undated.html",
+        f"entries/{may}.html",
+        "search.html",
+    ]:
+        assert path in result.written_pages
+    assert 'href="2023/index.html"' in (site / "index.html").read_text()
+    assert (
+        f'href="../../entries/{may}.html"' in (site / "2023/05/index.html").read_text()
+    )
+    page = (site / f"entries/{may}.html").read_text()
+    # フロントマターはコードブロックに、本文はエスケープして出す
+    assert "<pre><code>happiness score: 3</code></pre>" in page
+    assert "<p>&lt;b&gt;五月&lt;/b&gt;の日記</p>" in page
+    assert 'href="../2023/05/index.html"' in page
+
+    # 索引は年ごとの shard の一覧で、新しい年から並ぶ
+    index = json.loads((site / "search-index.json").read_text())
+    assert index == [
+        {"url": "search/2023.json", "count": 2},
+        {"url": "search/undated.json", "count": 1},
+    ]
+    shard = json.loads((site / "search/2023.json").read_text())
+    assert {entry["title"] for entry in shard} == {"20230415_0930", "20230501"}
+    assert {entry["url"] for entry in shard} >= {f"entries/{may}.html"}
+    undated = json.loads((site / "search/undated.json").read_text())
+    assert [entry["text"] for entry in undated] == ["日付のないメモ"]
+
+
+def test_build_site_only_rebuilds_changed_pages(db, texts, tmp_path):
+    site = tmp_path / "site"
+    builder = SiteBuilder(db)
+    builder.build_site(site)
+
+    again = builder.build_site(site)
+    assert again.written_pages == []
+
+    april = entry_id(db, "20230415_0930")
+    (texts / "20230415_0930.md").write_text("夜の日記", encoding="utf-8")
+    db.process_folder()
+    result = builder.build_site(site)
+
+    # 文字数の同じ本文だけが変わったので、一覧のページはそのまま
+    assert result.written_pages == [f"entries/{april}.html", "search/2023.json"]
+    assert "夜の日記" in (site / f"entries/{april}.html").read_text()
+
+
+def test_build_site_removes_deleted_pages(db, texts, tmp_path):
+    site = tmp_path / "site"
+    builder = SiteBuilder(db)
+    builder.build_site(site)
+    april = entry_id(db, "20230415_0930")
+
+    (texts / "20230415_0930.md").unlink()
+    db.process_folder()
+    result = builder.build_site(site)
+
+    assert result.deleted_pages == ["2023/04/index.html", f"entries/{april}.html"]
+    assert not (site / f"entries/{april}.html").exists()
+    assert "2023/index.html" in result.written_pages
+
+
+def test_search_shard_holds_the_whole_text(db, texts, tmp_path):
+    (texts / "19990101.md").write_text(
+        "長い\n\n日記" * 1000 + "\n最後の一文", encoding="utf-8"
+    )
+    db.process_folder()
+    site = tmp_path / "site"
+    builder = SiteBuilder(db)
+    builder.build_site(site)
+
+    [entry] = json.loads((site / "search/1999.json").read_text())
+    # 空白は詰めるが、長い投稿の終わりの方の語でも引ける
+    assert entry["text"] == "長い 日記" * 1000 + " 最後の一文"
+    index = json.loads((site / "search-index.json").read_text())
+    assert index[-2:] == [
+        {"url": "search/1999.json", "count": 1},
+        {"url": "search/undated.json", "count": 1},
+    ]
+
+    # 年がなくなれば、その shard も消す
+    (texts / "19990101.md").unlink()
+    db.process_folder()
+    result = builder.build_site(site)
+    assert "search/1999.json" in result.deleted_pages
+    assert not (site / "search/1999.json").exists()
+
+
+def test_parallel_build_matches_serial(db, tmp_path):
+    SiteBuilder(db).build_site(tmp_path / "serial")
+    SiteBuilder(db).build_site(tmp_path / "parallel", jobs=2)
+
+    def pages(site):
+        return {
+            path.relative_to(site).as_posix(): path.read_bytes()
+            for path in site.rglob("*")
+            if path.is_file()
+        }
+
+    assert pages(tmp_path / "parallel") == pages(tmp_path / "serial")
+
+
+def test_build_site_force_rebuilds_everything(db, tmp_path):
+    site = tmp_path / "site"
+    builder = SiteBuilder(db)
+    first = builder.build_site(site)
+
+    result = builder.build_site(site, force=True)
+
+    assert result.written_pages == first.written_pages
+    assert result.skipped_pages == []
+
+
+def test_markdown_html():
+    html = markdown_html("# 見出し\n\n一行目\n二行目\n\n```\na < b\n```")
+
+    assert html == (
+        "<h1>見出し</h1>\n<p>一行目<br>二行目</p>\n<pre><code>a &lt; b</code></pre>"
+    )
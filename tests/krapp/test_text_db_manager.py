@@ -0,0 +1,814 @@
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import pytest
+
+from krapp.date_extractor import DateExtractor
+from krapp.ingest_stats import IngestStats
+from krapp.text_db_manager import Entry, FileManifest, TextDBManager
+from krapp.yaml_frontmatter_parser import YamlFrontmatterParser
+
+
+@pytest.fixture
+def texts(tmp_path):
+    folder = tmp_path / "texts"
+    folder.mkdir()
+    (folder / "20230415_0930.md").write_text("朝の日記", encoding="utf-8")
+    (folder / "sub").mkdir()
+    (folder / "sub" / "memo.md").write_text(
+        "---\nhappiness score: 3\n---\n2023-05-01 のメモ", encoding="utf-8"
+    )
+    return folder
+
+
+def open_db(texts, tmp_path, **kwargs):
+    return TextDBManager(
+        folder_path=texts,
+        date_extractor=DateExtractor(),
+        yaml_parser=YamlFrontmatterParser(),
+        db_path=tmp_path / "texts.db",
+        **kwargs,
+    )
+
+
+def test_process_folder_saves_entries(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    result = db.process_folder()
+
+    assert result.added == 2
+    entries = {entry.title: entry for entry in db.session.query(Entry)}
+    assert entries["20230415_0930"].date == date(2023, 4, 15)
+    assert entries["memo"].date == date(2023, 5, 1)
+    assert entries["memo"].happiness_score == 3
+    assert db.session.query(FileManifest).count() == 2
+    db.close()
+
+
+def test_invalid_happiness_score_fails_only_its_file(texts, tmp_path):
+    for name, score in [("list", "[1, 2]"), ("text", "とても"), ("quoted", '"4"')]:
+        (texts / f"{name}.md").write_text(
+            f"---\nhappiness score: {score}\n---\n本文", encoding="utf-8"
+        )
+    db = open_db(texts, tmp_path, batch_size=10)
+    result = db.process_folder()
+
+    # 同じバッチのほかのファイルは取り込まれる
+    assert (result.added, result.failed) == (3, 2)
+    scores = {e.title: e.happiness_score for e in db.session.query(Entry)}
+    assert scores == {"20230415_0930": None, "memo": 3, "quoted": 4}
+    db.close()
+
+
+def test_process_folder_is_incremental(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+    db.close()
+
+    memo = texts / "sub" / "memo.md"
+    memo.write_text("2023-06-01 に書き直した", encoding="utf-8")
+    (texts / "20230415_0930.md").unlink()
+    (texts / "20230416.md").write_text("新しい日記", encoding="utf-8")
+
+    db = open_db(texts, tmp_path)
+    result = db.process_folder()
+
+    assert (result.added, result.updated, result.deleted) == (1, 1, 1)
+    titles = sorted(entry.title for entry in db.session.query(Entry))
+    assert titles == ["20230416", "memo"]
+    memo_entry = db.session.query(Entry).filter(Entry.title == "memo").one()
+    assert memo_entry.date == date(2023, 6, 1)
+    assert memo_entry.happiness_score is None
+    db.close()
+
+
+def test_process_folder_skips_unchanged_files(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+
+    # 内容が同じなら mtime が変わっても再取り込みしない
+    memo = texts / "sub" / "memo.md"
+    stat = memo.stat()
+    os.utime(memo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    result = db.process_folder()
+
+    assert result.unchanged == 2
+    assert result.added == result.updated == result.deleted == 0
+    db.close()
+
+
+def test_recreate_rebuilds_database(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+    db.close()
+
+    db = open_db(texts, tmp_path, recreate=True)
+    assert db.session.query(Entry).count() == 0
+    result = db.process_folder()
+    assert result.added == 2
+    db.close()
+
+
+def test_process_folder_writes_in_batches(texts, tmp_path):
+    (texts / "20230417.md").write_text("三つ目", encoding="utf-8")
+    db = open_db(texts, tmp_path, batch_size=2)
+    result = db.process_folder()
+
+    assert result.added == 3
+    manifest = {
+        record.path: record.entry_id for record in db.session.query(FileManifest)
+    }
+    entries = {entry.id: entry.title for entry in db.session.query(Entry)}
+    assert {path: entries[entry_id] for path, entry_id in manifest.items()} == {
+        "20230415_0930.md": "20230415_0930",
+        "20230417.md": "20230417",
+        "sub/memo.md": "memo",
+    }
+    # 取り込みが終わったら接続ごとの設定は元に戻り、WAL はそのまま残る
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 2
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+    db.close()
+
+
+def test_process_folder_with_concurrent_reader(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+    (texts / "20230416.md").write_text("新しい日記", encoding="utf-8")
+    # Streamlit のように、別の接続が読み込みのトランザクションを開いている
+    reader = sqlite3.connect(tmp_path / "texts.db")
+    reader.execute("BEGIN")
+    assert reader.execute("SELECT count(*) FROM entries").fetchone() == (2,)
+
+    result = db.process_folder()
+
+    assert result.added == 1
+    assert reader.execute("SELECT count(*) FROM entries").fetchone() == (2,)
+    reader.rollback()
+    assert reader.execute("SELECT count(*) FROM entries").fetchone() == (3,)
+    reader.close()
+    db.close()
+
+
+def test_process_folder_parallel_matches_serial(texts, tmp_path):
+    for day in range(1, 10):
+        (texts / f"2023060{day}.md").write_text(f"日記 {day}", encoding="utf-8")
+    (texts / "broken.md").write_bytes(b"\xff\xfe")
+
+    def dump(db):
+        return [
+            (e.id, e.date, e.title, e.content, e.char_count, e.happiness_score)
+            for e in db.session.query(Entry).order_by(Entry.id)
+        ]
+
+    serial = TextDBManager(
+        folder_path=texts,
+        date_extractor=DateExtractor(),
+        yaml_parser=YamlFrontmatterParser(),
+    )
+    serial_result = serial.process_folder()
+    parallel = TextDBManager(
+        folder_path=texts,
+        date_extractor=DateExtractor(),
+        yaml_parser=YamlFrontmatterParser(),
+    )
+    parallel_result = parallel.process_folder(jobs=2)
+
+    assert parallel_result == serial_result
+    assert parallel_result.failed == 1
+    assert dump(parallel) == dump(serial)
+
+
+def test_year_and_month_navigation(texts, tmp_path):
+    (texts / "20220101.md").write_text("去年の日記", encoding="utf-8")
+    (texts / "no_date.md").write_text("日付なし", encoding="utf-8")
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+
+    assert db.get_all_years() == [2023, 2022]
+    assert db.get_months_in_year(2023) == [4, 5]
+    assert db.get_months_in_year(2021) == []
+    entries = db.get_entries_by_year_month(2023, 5)
+    assert list(entries["Title"]) == ["memo"]
+    db.close()
+
+
+def test_iter_entries_streams_records(texts, tmp_path):
+    for day in range(1, 6):
+        (texts / f"2023040{day}.md").write_text(f"{day} 日目", encoding="utf-8")
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+
+    records = list(db.iter_entries_by_year_month(2023, 4, batch_size=2))
+
+    assert [record.title for record in records] == [
+        "20230415_0930",
+        "20230405",
+        "20230404",
+        "20230403",
+        "20230402",
+        "20230401",
+    ]
+    assert records[1] == db.get_entry(records[1].id)
+    assert list(db.get_entries_by_year_month(2023, 4)["ID"]) == [
+        record.id for record in records
+    ]
+    assert db.get_entries_by_year_month(2020, 1).columns.tolist() == [
+        "ID",
+        "Date",
+        "Title",
+        "Content",
+    ]
+    db.close()
+
+
+def test_browsing_does_not_need_pandas(texts, tmp_path):
+    script = (
+        "import sys\n"
+        "from krapp.text_db_manager import TextDBManager\n"
+        f"db = TextDBManager(db_path={str(tmp_path / 'texts.db')!r})\n"
+        "list(db.iter_entries_by_year_month(2023, 4))\n"
+        "db.list_entries_by_year_month(2023, 4)\n"
+        "assert 'pandas' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+
+def test_existing_database_is_migrated(texts, tmp_path):
+    # 年月日の列がなかった頃のスキーマ
+    conn = sqlite3.connect(tmp_path / "texts.db")
+    conn.execute(
+        "CREATE TABLE entries (id INTEGER PRIMARY KEY, date DATE, title VARCHAR"
+        " NOT NULL, content VARCHAR NOT NULL, char_count INTEGER,"
+        " happiness_score INTEGER)"
+    )
+    conn.execute(
+        "INSERT INTO entries (date, title, content, char_count)"
+        " VALUES ('2019-07-08', 'old', 'old entry', 9)"
+    )
+    conn.commit()
+    conn.close()
+
+    db = open_db(texts, tmp_path)
+
+    assert db.get_all_years() == [2019]
+    assert db.get_months_in_year(2019) == [7]
+    entry = db.session.query(Entry).one()
+    assert (entry.year, entry.month, entry.day) == (2019, 7, 8)
+    assert [result.title for result in db.search("old entry")] == ["old"]
+    db.close()
+
+
+def test_database_without_manifest_is_rebuilt_on_sync(texts, tmp_path):
+    # file_manifest がなかった頃に texts を取り込んだデータベース
+    conn = sqlite3.connect(tmp_path / "texts.db")
+    conn.execute(
+        "CREATE TABLE entries (id INTEGER PRIMARY KEY, date DATE, title VARCHAR"
+        " NOT NULL, content VARCHAR NOT NULL, char_count INTEGER,"
+        " happiness_score INTEGER)"
+    )
+    conn.executemany(
+        "INSERT INTO entries (date, title, content, char_count, happiness_score)"
+        " VALUES (?, ?, ?, ?, ?)",
+        [
+            ("2023-04-15", "20230415_0930", "朝の日記", 4, None),
+            ("2023-05-01", "memo", "2023-05-01 のメモ", 13, 3),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    db = open_db(texts, tmp_path)
+    result = db.process_folder()
+
+    assert (result.added, result.deleted) == (2, 2)
+    assert sorted(entry.title for entry in db.session.query(Entry)) == [
+        "20230415_0930",
+        "memo",
+    ]
+    assert [s.entry_count for s in db.get_monthly_stats()] == [1, 1]
+    assert len(db.search("朝の日記")) == 1
+    assert db.process_folder().deleted == 0
+    db.close()
+
+
+def test_search_ranks_and_highlights_matches(texts, tmp_path):
+    (texts / "20230420.md").write_text(
+        "公園で桜を見た。桜がきれいだった。", encoding="utf-8"
+    )
+    (texts / "20230421.md").write_text("今日は公園を散歩した。", encoding="utf-8")
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+
+    results = db.search("公園 桜")
+    assert [result.title for result in results] == ["20230420"]
+    assert "[桜]" in results[0].snippet
+
+    results = db.search("公園で")
+    assert [result.title for result in results] == ["20230420"]
+    assert "[公園で]" in results[0].snippet
+    assert db.search("存在しない言葉") == []
+    db.close()
+
+
+def test_search_index_follows_updates_and_deletes(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+    assert [result.title for result in db.search("朝の日記")] == ["20230415_0930"]
+
+    (texts / "20230415_0930.md").write_text("夜の日記", encoding="utf-8")
+    (texts / "sub" / "memo.md").unlink()
+    db.process_folder()
+
+    assert db.search("朝の日記") == []
+    assert [result.title for result in db.search("夜の日記")] == ["20230415_0930"]
+    assert db.search("メモ") == []
+    db.close()
+
+
+def test_database_can_be_shared_across_threads(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+    reader = TextDBManager(db_path=tmp_path / "texts.db")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        years = list(executor.map(lambda _: reader.get_all_years(), range(8)))
+        refreshed = list(executor.map(lambda _: db.process_folder(), range(2)))
+
+    assert years == [[2023]] * 8
+    assert [result.unchanged for result in refreshed] == [2, 2]
+    reader.close()
+    db.close()
+
+
+def test_month_listing_is_paginated(texts, tmp_path):
+    for day in range(1, 6):
+        (texts / f"2023040{day}.md").write_text(f"四月{day}日の日記", encoding="utf-8")
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+
+    assert db.count_entries_by_year_month(2023, 4) == 6
+    first = db.list_entries_by_year_month(2023, 4, limit=4, snippet_length=3)
+    second = db.list_entries_by_year_month(2023, 4, offset=4, limit=4)
+    titles = [summary.title for summary in first + second]
+    assert titles == [
+        "20230415_0930",
+        "20230405",
+        "20230404",
+        "20230403",
+        "20230402",
+        "20230401",
+    ]
+    assert first[1].snippet == "四月5"
+    assert first[1].char_count == len("四月5日の日記")
+
+    entry = db.get_entry(first[1].id)
+    assert entry.content == "四月5日の日記"
+    assert db.get_entry(-1) is None
+    db.close()
+
+
+def test_process_folder_records_stage_timings(texts, tmp_path, capsys):
+    db = open_db(texts, tmp_path)
+    stats = IngestStats()
+    db.process_folder(stats=stats)
+    db.close()
+
+    stages = stats.summary()["stages"]
+    for name in ("walk", "read", "decode", "frontmatter", "dates", "insert"):
+        assert name in stages
+    assert stages["read"]["count"] == 2
+    assert stats.done == 2
+    # ファイルごとの出力はしない
+    assert capsys.readouterr().out == ""
+
+
+def test_frontmatter_fields_are_indexed(texts, tmp_path):
+    (texts / "20230520.md").write_text(
+        "---\ntags: [旅行, 家族]\nplace:\n  city: 京都\nrating: 4.5\n"
+        "visited: 2023-05-20\ndone: true\n---\n旅行記",
+        encoding="utf-8",
+    )
+    (texts / "20220301.md").write_text("---\ntags: 旅行\n---\n昔の旅", encoding="utf-8")
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+
+    trips = db.find_entries_by_field("tags", "旅行", year=2023)
+    assert [summary.title for summary in trips] == ["20230520"]
+    assert len(db.find_entries_by_field("tags", "旅行")) == 2
+    assert [s.title for s in db.find_entries_by_field("happiness score", 3)] == ["memo"]
+    assert [s.title for s in db.find_entries_by_field("rating", min_value=4)] == [
+        "20230520"
+    ]
+    assert [s.title for s in db.find_entries_by_field("place.city", "京都")] == [
+        "20230520"
+    ]
+    assert db.get_entry_fields(trips[0].id) == {
+        "tags": ["旅行", "家族"],
+        "place.city": ["京都"],
+        "rating": [4.5],
+        "visited": [date(2023, 5, 20)],
+        "done": [True],
+    }
+    assert ("tags", 2) in db.get_field_keys()
+    assert db.get_field_values("tags") == [("家族", 1), ("旅行", 2)]
+
+    # 更新・削除されたファイルの項目は残らない
+    (texts / "20230520.md").write_text("---\ntags: 仕事\n---\n", encoding="utf-8")
+    (texts / "20220301.md").unlink()
+    db.process_folder()
+    assert db.get_field_values("tags") == [("仕事", 1)]
+    assert db.find_entries_by_field("rating") == []
+    db.close()
+
+
+def test_fields_are_backfilled_for_existing_database(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+    db.close()
+    conn = sqlite3.connect(tmp_path / "texts.db")
+    conn.execute("DROP TABLE entry_fields")
+    conn.commit()
+    conn.close()
+
+    db = open_db(texts, tmp_path)
+    assert [s.title for s in db.find_entries_by_field("happiness score", 3)] == ["memo"]
+    db.close()
+
+
+def test_monthly_stats_follow_ingest(texts, tmp_path):
+    (texts / "20230420.md").write_text(
+        "---\nhappiness score: 5\n---\n四月", encoding="utf-8"
+    )
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+
+    stats = {(s.year, s.month): s for s in db.get_monthly_stats()}
+    april = stats[(2023, 4)]
+    assert april.entry_count == 2
+    assert april.average_happiness == 5
+    assert stats[(2023, 5)].average_happiness == 3
+
+    # 更新で月が変わると、元の月から引かれて新しい月に加わる
+    (texts / "sub" / "memo.md").write_text("2023-04-30 に移動", encoding="utf-8")
+    (texts / "20230415_0930.md").unlink()
+    db.process_folder()
+
+    stats = db.get_monthly_stats(2023)
+    assert [(s.month, s.entry_count, s.average_happiness) for s in stats] == [(4, 2, 5)]
+    assert stats[0].char_count == sum(
+        entry.char_count for entry in db.session.query(Entry)
+    )
+    db.close()
+
+
+def test_monthly_stats_are_backfilled_for_existing_database(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+    db.close()
+    conn = sqlite3.connect(tmp_path / "texts.db")
+    conn.execute("DROP TABLE monthly_stats")
+    conn.commit()
+    conn.close()
+
+    db = open_db(texts, tmp_path)
+    assert [(s.year, s.month, s.entry_count) for s in db.get_monthly_stats()] == [
+        (2023, 4, 1),
+        (2023, 5, 1),
+    ]
+    db.close()
+
+
+@pytest.fixture
+def copies(texts):
+    # txt2md の出力と org-diary のコピーのように、同じ内容のファイルが並ぶ
+    (texts / "2023" / "04").mkdir(parents=True)
+    (texts / "2023" / "04" / "20230415_0930.md").write_bytes(
+        (texts / "20230415_0930.md").read_bytes()
+    )
+    (texts / "2023" / "05").mkdir(parents=True)
+    (texts / "2023" / "05" / "memo.md").write_bytes(
+        (texts / "sub" / "memo.md").read_bytes()
+    )
+    return texts
+
+
+def count_rows(db, table):
+    with db.engine.connect() as conn:
+        return conn.exec_driver_sql(f"SELECT count(*) FROM {table}").scalar()
+
+
+def test_dedup_keep_stores_every_copy(copies, tmp_path):
+    db = open_db(copies, tmp_path)
+    result = db.process_folder()
+
+    assert (result.added, result.duplicates) == (4, 0)
+    assert count_rows(db, "entries") == 4
+    db.close()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_dedup_link_shares_entries(copies, tmp_path, jobs):
+    db = open_db(copies, tmp_path, dedup="link", batch_size=1)
+    result = db.process_folder(jobs=jobs)
+
+    assert (result.added, result.duplicates) == (2, 2)
+    assert count_rows(db, "entries") == 2
+    assert count_rows(db, "entry_fields") == 1
+    assert len(db.search("朝の日記")) == 1
+    assert [s.entry_count for s in db.get_monthly_stats()] == [1, 1]
+    memo = db.session.query(Entry).filter(Entry.title == "memo").one()
+    assert db.get_entry_paths(memo.id) == ["2023/05/memo.md", "sub/memo.md"]
+
+    # 共有している投稿は、参照するファイルがなくなるまで消えない
+    (copies / "sub" / "memo.md").unlink()
+    db.process_folder()
+    assert db.get_entry_paths(memo.id) == ["2023/05/memo.md"]
+    (copies / "2023" / "05" / "memo.md").unlink()
+    db.process_folder()
+    assert db.get_entry(memo.id) is None
+    db.close()
+
+
+def test_dedup_link_does_not_rewrite_shared_entry(copies, tmp_path):
+    db = open_db(copies, tmp_path, dedup="link")
+    db.process_folder()
+
+    (copies / "sub" / "memo.md").write_text("2023-05-02 に書き直した", encoding="utf-8")
+    result = db.process_folder()
+
+    assert result.updated == 1
+    contents = sorted(entry.content for entry in db.session.query(Entry))
+    assert contents == [
+        "---\nhappiness score: 3\n---\n2023-05-01 のメモ",
+        "2023-05-02 に書き直した",
+        "朝の日記",
+    ]
+    db.close()
+
+
+def test_dedup_skip_rereads_copy_when_original_vanishes(copies, tmp_path):
+    db = open_db(copies, tmp_path, dedup="skip")
+    result = db.process_folder()
+
+    assert (result.added, result.duplicates) == (2, 2)
+    assert count_rows(db, "entries") == 2
+    assert count_rows(db, "file_manifest") == 4
+
+    # パス順で先に読まれた方が取り込まれている
+    original = copies / "2023" / "04" / "20230415_0930.md"
+    original.unlink()
+    result = db.sync_paths([original])
+
+    # 取り込まなかった複製が同じ同期で読み直される
+    assert (result.deleted, result.added) == (1, 1)
+    copy = db.session.query(Entry).filter(Entry.title == "20230415_0930").one()
+    assert db.get_entry_paths(copy.id) == ["20230415_0930.md"]
+    assert len(db.search("朝の日記")) == 1
+    assert db.process_folder().added == 0
+    db.close()
+
+
+def test_dedup_skip_rereads_copy_when_original_changes(copies, tmp_path):
+    db = open_db(copies, tmp_path, dedup="skip")
+    db.process_folder()
+
+    original = copies / "2023" / "04" / "20230415_0930.md"
+    original.write_text("書き直した日記", encoding="utf-8")
+    result = db.process_folder()
+
+    assert (result.updated, result.added) == (1, 1)
+    contents = sorted(entry.content for entry in db.session.query(Entry))
+    assert contents == [
+        "---\nhappiness score: 3\n---\n2023-05-01 のメモ",
+        "書き直した日記",
+        "朝の日記",
+    ]
+    assert len(db.search("朝の日記")) == 1
+    for _ in range(2):
+        assert db.process_folder().added == 0
+    assert count_rows(db, "entries") == 3
+    db.close()
+
+
+def test_dedup_skip_falls_through_to_next_copy(tmp_path):
+    folder = tmp_path / "texts"
+    folder.mkdir()
+    for name in "bcd":
+        (folder / f"{name}.md").write_text("同じ日記", encoding="utf-8")
+    db = TextDBManager(folder_path=folder, db_path=tmp_path / "texts.db", dedup="skip")
+    db.process_folder()
+
+    # 次の複製 c.md も同じ同期で消えるので、d.md が取り込まれる
+    (folder / "b.md").write_text("書き直した日記", encoding="utf-8")
+    (folder / "c.md").unlink()
+    db.sync_paths([folder / "b.md", folder / "c.md"])
+
+    assert sorted(r.content for r in db.iter_entries()) == [
+        "同じ日記",
+        "書き直した日記",
+    ]
+    copy = db.session.query(Entry).filter(Entry.content == "同じ日記").one()
+    assert db.get_entry_paths(copy.id) == ["d.md"]
+    db.close()
+
+
+def test_dedup_skip_adopted_copy_survives_later_batches(tmp_path):
+    folder = tmp_path / "texts"
+    folder.mkdir()
+    for name in "ab":
+        (folder / f"{name}.md").write_text("同じ日記", encoding="utf-8")
+    db = TextDBManager(
+        folder_path=folder, db_path=tmp_path / "texts.db", dedup="skip", batch_size=1
+    )
+    db.process_folder()
+
+    # b.md は a.md のバッチで取り込まれた後、touch されただけとして次のバッチで書かれる
+    (folder / "a.md").write_text("書き直した日記", encoding="utf-8")
+    stat = (folder / "b.md").stat()
+    os.utime(folder / "b.md", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    db.process_folder()
+    db.process_folder()
+
+    assert sorted(r.content for r in db.iter_entries()) == [
+        "同じ日記",
+        "書き直した日記",
+    ]
+    db.close()
+
+
+# 方針・バッチの大きさ・同期の仕方の組み合わせごとに試す回数
+RANDOM_RUNS = 10
+
+
+def replay_random_changes(folder, db, rng, sync, steps=6):
+    """
+    Change a few files at random before each sync and check that every
+    content in the folder is stored, and nothing else.
+    """
+    bodies = ["一つ目の日記", "二つ目の日記です", "三つ目"]
+    names = [f"{name}.md" for name in "abcdef"]
+    # 同じ大きさの書き換えも見逃さないように、mtime は毎回進める
+    mtime = 1_700_000_000 * 10**9
+    log = []
+    for step in range(steps + 1):
+        changed = set()
+        for name in rng.sample(names, rng.randint(1, 3)):
+            path = folder / name
+            action = rng.choice(["write", "write", "delete", "touch"])
+            if action == "delete":
+                path.unlink(missing_ok=True)
+            else:
+                if action == "write" or not path.exists():
+                    path.write_text(rng.choice(bodies), encoding="utf-8")
+                mtime += 10**9
+                os.utime(path, ns=(mtime, mtime))
+            changed.add(path)
+            log.append((step, action, name))
+        # 最後は必ずフォルダ全体を同期する
+        if sync == "sync_paths" and step < steps:
+            db.sync_paths(changed)
+        else:
+            db.process_folder()
+        on_disk = sorted(p.read_text(encoding="utf-8") for p in folder.glob("*.md"))
+        stored = sorted(record.content for record in db.iter_entries())
+        if db.dedup != "keep":
+            on_disk = sorted(set(on_disk))
+        assert stored == on_disk, log
+
+
+@pytest.mark.parametrize("sync", ["process_folder", "sync_paths"])
+@pytest.mark.parametrize("batch_size", [1, 500])
+@pytest.mark.parametrize("dedup", ["keep", "link", "skip"])
+def test_dedup_stores_every_content_under_random_changes(
+    tmp_path, dedup, batch_size, sync
+):
+    rng = random.Random(f"{dedup}-{batch_size}-{sync}")
+    for run in range(RANDOM_RUNS):
+        folder = tmp_path / str(run) / "texts"
+        folder.mkdir(parents=True)
+        db = TextDBManager(
+            folder_path=folder,
+            db_path=folder.parent / "texts.db",
+            dedup=dedup,
+            batch_size=batch_size,
+        )
+        replay_random_changes(folder, db, rng, sync)
+        db.close()
+
+
+def test_dedup_policy_is_stored_in_database(texts, tmp_path):
+    # 方針を指定せずに開いたら、前に指定した方針で取り込む
+    for dedup, expected in [
+        (None, "keep"),
+        ("skip", "skip"),
+        (None, "skip"),
+        ("link", "link"),
+        (None, "link"),
+    ]:
+        db = open_db(texts, tmp_path, dedup=dedup)
+        assert db.dedup == expected
+        db.close()
+
+
+def test_unknown_dedup_policy_is_rejected(texts, tmp_path):
+    with pytest.raises(ValueError, match="dedup must be one of"):
+        open_db(texts, tmp_path, dedup="merge")
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_compressed_content_is_transparent(texts, tmp_path, compression):
+    db = open_db(texts, tmp_path, compression=compression, compression_level=6)
+    db.process_folder(jobs=2)
+
+    row = db.session.query(Entry).filter(Entry.title == "20230415_0930").one()
+    assert row.content == ""
+    assert row.content_blob is not None
+    assert db.get_entry(row.id).content == "朝の日記"
+    assert [s.snippet for s in db.list_entries_by_year_month(2023, 4)] == ["朝の日記"]
+    assert [r.content for r in db.iter_entries_by_year_month(2023, 4)] == ["朝の日記"]
+    assert [r.title for r in db.search("のメモ")] == ["memo"]
+    assert db.search("メモ")[0].snippet.endswith("[メモ]")
+    assert [s.title for s in db.find_entries_by_field("happiness score", 3)] == ["memo"]
+    db.close()
+
+
+def test_compression_can_be_switched_on_later(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+    db.close()
+
+    (texts / "sub" / "memo.md").write_text("2023-05-02 の新しいメモ", encoding="utf-8")
+    db = open_db(texts, tmp_path, compression="zlib")
+    db.process_folder()
+
+    contents = {r.title: (r.content, r.content_blob) for r in db.session.query(Entry)}
+    assert contents["20230415_0930"] == ("朝の日記", None)
+    assert contents["memo"][0] == ""
+    # 古い本文は索引から消え、新しい本文で引ける
+    assert db.search("のメモ") == []
+    assert [r.title for r in db.search("新しいメモ")] == ["memo"]
+    db.close()
+
+
+def test_old_full_text_index_is_rebuilt(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    db.process_folder()
+    db.close()
+    # 本文の列を直接索引していた頃の索引
+    conn = sqlite3.connect(tmp_path / "texts.db")
+    for statement in ("entries_fts_insert", "entries_fts_delete", "entries_fts_update"):
+        conn.execute(f"DROP TRIGGER {statement}")
+    conn.execute("DROP TABLE entries_fts")
+    conn.execute("DROP VIEW entries_text")
+    conn.execute(
+        "CREATE VIRTUAL TABLE entries_fts USING fts5(title, content,"
+        " content='entries', content_rowid='id', tokenize='trigram')"
+    )
+    conn.commit()
+    conn.close()
+
+    db = open_db(texts, tmp_path)
+    assert [r.title for r in db.search("朝の日記")] == ["20230415_0930"]
+    db.close()
+
+
+def dump_tables(db):
+    with db.engine.connect() as conn:
+        return {
+            table: conn.exec_driver_sql(f"SELECT * FROM {table} ORDER BY 1, 2").all()
+            for table in ["entries", "file_manifest", "entry_fields", "monthly_stats"]
+        }
+
+
+@pytest.mark.parametrize("dedup", ["keep", "link"])
+def test_async_ingest_matches_serial(copies, tmp_path, dedup):
+    (copies / "broken.md").write_bytes(b"\xff\xfe")
+    serial = TextDBManager(
+        folder_path=copies, db_path=tmp_path / "serial.db", dedup=dedup, batch_size=2
+    )
+    concurrent = TextDBManager(
+        folder_path=copies, db_path=tmp_path / "async.db", dedup=dedup, batch_size=2
+    )
+    stats = IngestStats()
+
+    expected = serial.process_folder()
+    result = concurrent.process_folder(concurrency=3, stats=stats)
+
+    assert result == expected
+    assert result.failed == 1
+    assert dump_tables(concurrent) == dump_tables(serial)
+    assert stats.done == 5
+    serial.close()
+    concurrent.close()
+
+
+def test_async_ingest_rejects_jobs(texts, tmp_path):
+    db = open_db(texts, tmp_path)
+    with pytest.raises(ValueError):
+        db.process_folder(jobs=2, concurrency=4)
+    db.close()
@@ -1,3 +1,5 @@
+import os
+
 import pytest
 
 from krapp.txt2md import Txt2MdConverter, Txt2MdResult
@@ -88,3 +90,108 @@ def test_convert_txt_to_md_empty_input_folder(tmp_path, sut):
 
     # Ensure no files were created in the output folder
     assert not any(output_folder.iterdir())
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "shift-jis", "euc-jp", "iso-2022-jp"])
+def test_convert_txt_to_md_detects_encoding(tmp_path, sut, encoding):
+    input_folder = tmp_path / "input"
+    output_folder = tmp_path / "output"
+    input_folder.mkdir()
+    txt_file = input_folder / "diary.txt"
+    txt_file.write_bytes("2023年4月15日\r\n晴れ。\r\n".encode(encoding))
+
+    result = sut.convert_txt_to_md(input_folder, output_folder)
+
+    assert result.encodings == {str(txt_file): encoding}
+    md_file = output_folder / "diary.md"
+    assert md_file.read_text(encoding="utf-8") == "2023年4月15日\n晴れ。\n"
+
+
+def test_detect_encoding(sut):
+    assert sut.detect_encoding("日記".encode("utf-8")) == "utf-8"
+    assert sut.detect_encoding(b"\xef\xbb\xbfdiary") == "utf-8"
+    assert sut.detect_encoding("日記".encode("iso-2022-jp")) == "iso-2022-jp"
+    # ASCII だけ、または UTF-8 でないものは判定しない
+    assert sut.detect_encoding(b"diary") is None
+    assert sut.detect_encoding("日記".encode("shift-jis")) is None
+
+
+def test_convert_txt_to_md_uses_encoding_hint(tmp_path, sut):
+    input_folder = tmp_path / "input"
+    output_folder = tmp_path / "output"
+    input_folder.mkdir()
+    txt_file = input_folder / "diary.txt"
+    # Shift-JIS としても読めてしまう EUC-JP のファイル
+    txt_file.write_bytes("あいう".encode("euc-jp"))
+
+    result = sut.convert_txt_to_md(
+        input_folder, output_folder, encoding_hints={str(txt_file): "euc-jp"}
+    )
+
+    assert result.encodings == {str(txt_file): "euc-jp"}
+    assert (output_folder / "diary.md").read_text(encoding="utf-8") == "あいう"
+
+
+def test_convert_txt_to_md_reports_undecodable_file(tmp_path, sut):
+    input_folder = tmp_path / "input"
+    input_folder.mkdir()
+    (input_folder / "binary.txt").write_bytes(b"\x80\xff\xfe\x1b\xa0")
+    (input_folder / "diary.txt").write_text("日記", encoding="utf-8")
+
+    result = sut.convert_txt_to_md(input_folder, tmp_path / "output")
+
+    assert result.processed_files == [str(tmp_path / "output" / "diary.md")]
+    assert list(result.failed_files) == [str(input_folder / "binary.txt")]
+    assert not (tmp_path / "output" / "binary.md").exists()
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "shift-jis", "euc-jp", "iso-2022-jp"])
+def test_streaming_matches_whole_file_conversion(tmp_path, encoding):
+    input_folder = tmp_path / "input"
+    input_folder.mkdir()
+    text = "\ufeff" if encoding == "utf-8" else ""
+    text += "".join(f"{i}日目: 今日は晴れ。\r\nabc\rあいう\n" for i in range(50))
+    (input_folder / "diary.txt").write_bytes(text.encode(encoding))
+
+    whole = Txt2MdConverter().convert_txt_to_md(input_folder, tmp_path / "whole")
+    # 小さなチャンクで、マルチバイト文字や CRLF がチャンクをまたぐようにする
+    streaming = Txt2MdConverter(stream_threshold=0, chunk_size=7).convert_txt_to_md(
+        input_folder, tmp_path / "streaming"
+    )
+
+    assert streaming.encodings == whole.encodings
+    assert (tmp_path / "streaming" / "diary.md").read_bytes() == (
+        tmp_path / "whole" / "diary.md"
+    ).read_bytes()
+    assert not (tmp_path / "streaming" / "diary.md.part").exists()
+
+
+def test_convert_txt_to_md_recursive_and_incremental(tmp_path, sut):
+    input_folder = tmp_path / "input"
+    output_folder = tmp_path / "output"
+    (input_folder / "2023" / "04").mkdir(parents=True)
+    top = input_folder / "top.txt"
+    nested = input_folder / "2023" / "04" / "nested.txt"
+    top.write_text("上", encoding="utf-8")
+    nested.write_text("晴れ。", encoding="euc-jp")
+
+    first = sut.convert_txt_to_md(input_folder, output_folder, recursive=True, jobs=2)
+
+    assert len(first.processed_files) == 2
+    nested_md = output_folder / "2023" / "04" / "nested.md"
+    assert nested_md.read_text(encoding="utf-8") == "晴れ。"
+    assert first.encodings[str(nested)] == "euc-jp"
+
+    # 変更のないファイルは変換しない
+    top.write_text("上を書き直した", encoding="utf-8")
+    os.utime(top, ns=(top.stat().st_atime_ns, top.stat().st_mtime_ns + 10**9))
+    second = sut.convert_txt_to_md(input_folder, output_folder, recursive=True)
+
+    assert second.processed_files == [str(output_folder / "top.md")]
+    assert second.skipped_files == [str(nested_md)]
+    # 前回検出した文字コードが記録されている
+    assert second.encodings[str(nested)] == "euc-jp"
+    assert (output_folder / "top.md").read_text(encoding="utf-8") == "上を書き直した"
+
+    forced = sut.convert_txt_to_md(input_folder, output_folder, force=True)
+    assert forced.processed_files == [str(output_folder / "top.md")]
@@ -95,3 +95,44 @@ author: Test Author
     parser = YamlFrontmatterParser()
     parsed_data = parser.parse(content)
     assert parsed_data == {"title": "Test Title", "author": "Test Author"}
+
+
+def test_parse_file_reads_only_frontmatter(tmp_path):
+    path = tmp_path / "entry.md"
+    path.write_text("---\ntitle: 日記\n---\n" + "本文" * 10000, encoding="utf-8")
+    parser = YamlFrontmatterParser()
+    assert parser.parse_file(path) == {"title": "日記"}
+
+
+def test_parse_file_delimiter_across_reads(tmp_path):
+    parser = YamlFrontmatterParser()
+    # 閉じる区切りが読み込み単位の境目をまたぐように長さを調整する
+    for padding in range(parser.read_size - 10, parser.read_size + 4):
+        content = "---\nnote: " + "a" * padding + "\n---\nbody"
+        path = tmp_path / "entry.md"
+        path.write_text(content, encoding="utf-8")
+        assert parser.parse_file(path) == parser.parse(content)
+
+
+def test_parse_file_without_frontmatter(tmp_path):
+    parser = YamlFrontmatterParser()
+    path = tmp_path / "entry.md"
+    path.write_text("本文だけ", encoding="utf-8")
+    assert parser.parse_file(path) == {}
+    path.write_text("---\ntitle: 閉じていない", encoding="utf-8")
+    assert parser.parse_file(path) == {}
+
+
+def test_parse_returns_independent_dicts():
+    content = "---\nhappiness score: 3\ntags: [a]\nplace: {city: x}\n---\nbody"
+    parser = YamlFrontmatterParser()
+    first = parser.parse(content)
+    first["happiness score"] = 5
+    # 入れ子の値もキャッシュと共有しない
+    first["tags"].append("b")
+    first["place"]["city"] = "y"
+    assert parser.parse(content) == {
+        "happiness score": 3,
+        "tags": ["a"],
+        "place": {"city": "x"},
+    }